@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Graphite plaintext parsing throughput: the regex based Metric.parse it
+replaced, Metric.parse and Metric.parse_many, best of a few runs.
+
+    python benchmarks/metric_parse.py [--lines 200000] [--runs 3]
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from diamond.error import DiamondException
+from diamond.metric import Metric
+
+
+def regex_parse(string):
+    """
+    Metric.parse before it was rewritten without regexes
+    """
+    match = re.match(r'^(?P<name>[A-Za-z0-9\.\-_]+)\s+' +
+                     '(?P<value>[0-9\.]+)\s+' +
+                     '(?P<timestamp>[0-9\.]+)(\n?)$',
+                     string)
+    try:
+        groups = match.groupdict()
+        return Metric(groups['name'],
+                      groups['value'],
+                      float(groups['timestamp']))
+    except:
+        raise DiamondException(
+            "Metric could not be parsed from string: %s." % string)
+
+
+def lines(count):
+    return ['servers.www%d.cpu.cpu%d.user %d.%02d %d\n'
+            % (i % 50, i % 32, i % 100, i % 97, 1400000000 + i)
+            for i in xrange(count)]
+
+
+def parse_each(parse, all_lines):
+    for line in all_lines:
+        parse(line)
+
+
+def best(runs, function, *args):
+    times = []
+    for i in xrange(runs):
+        start = time.time()
+        function(*args)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lines', type='int', default=200000)
+    parser.add_option('--runs', type='int', default=3)
+    options, args = parser.parse_args()
+
+    all_lines = lines(options.lines)
+    buffer = ''.join(all_lines)
+    print '%d lines, best of %d' % (options.lines, options.runs)
+
+    for name, function, arguments in (
+            ('regex Metric.parse', parse_each, (regex_parse, all_lines)),
+            ('Metric.parse', parse_each, (Metric.parse, all_lines)),
+            ('Metric.parse_many', Metric.parse_many, (buffer,))):
+        seconds = best(options.runs, function, *arguments)
+        rate = options.lines / seconds / 1000
+        print '  %-20s %6.0fk lines/s' % (name, rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Time SentryHandler rule matching: every rule's expression against every
+path, as before RuleSet, against the RuleSet suffix index and its cache.
+
+    python benchmarks/sentry_rules.py [--rules 500] [--paths 50000]
+        [--distinct 1000]
+"""
+
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from diamond.handler.sentry import Rule
+from diamond.handler.sentry import RuleSet
+
+COLLECTORS = ('cpu', 'memory', 'diskspace', 'network', 'loadavg', 'vmstat')
+
+
+def rules(count):
+    """
+    Mostly literal paths, with one rule in ten ending in an expression
+    """
+    built = []
+    for i in xrange(count):
+        collector = COLLECTORS[i % len(COLLECTORS)]
+        if i % 10 == 0:
+            path = r'%s\.[a-z]+%d\..*' % (collector, i)
+        elif i % 10 == 1:
+            path = r'%s\.dev[0-9]+\.metric%d' % (collector, i)
+        else:
+            path = '%s.metric%d' % (collector, i)
+        built.append(Rule('rule%d' % i, path, max=100))
+    return built
+
+
+def paths(count, distinct):
+    names = ['servers.host%d.%s.metric%d' % (
+        i % 20, COLLECTORS[i % len(COLLECTORS)], i) for i in xrange(distinct)]
+    return [names[i % distinct] for i in xrange(count)]
+
+
+def every_rule(all_rules, all_paths):
+    matched = 0
+    for path in all_paths:
+        for rule in all_rules:
+            if rule.match(path):
+                matched += 1
+    return matched
+
+
+def rule_set(instance, all_paths):
+    matched = 0
+    for path in all_paths:
+        matched += len(instance.match(path))
+    return matched
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--rules', type='int', default=500)
+    parser.add_option('--paths', type='int', default=50000)
+    parser.add_option('--distinct', type='int', default=1000)
+    options, args = parser.parse_args()
+
+    all_rules = rules(options.rules)
+    all_paths = paths(options.paths, options.distinct)
+    print '%d rules x %d paths (%d distinct)' % (
+        options.rules, options.paths, options.distinct)
+
+    instance = RuleSet(all_rules)
+    expected, seconds = timed(every_rule, all_rules, all_paths)
+    print '  matching every rule: %8.3fs' % seconds
+    matched, seconds = timed(rule_set, instance, all_paths)
+    print '  RuleSet, first pass: %8.3fs' % seconds
+    assert matched == expected, (matched, expected)
+    matched, seconds = timed(rule_set, instance, all_paths)
+    print '  RuleSet, cached:     %8.3fs' % seconds
+    assert matched == expected, (matched, expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Datagrams and CPU time StatsdHandler needs to send 10k metrics over
+loopback, against a bare loop sending one datagram per metric.
+
+    python benchmarks/statsd_datagrams.py [--metrics 10000] [--batch 10000]
+"""
+
+import optparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import configobj
+
+from diamond.handler.stats_d import StatsdHandler
+from diamond.metric import Metric
+
+
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    sock.setblocking(0)
+    return sock
+
+
+def drain(sock):
+    count = 0
+    while True:
+        try:
+            sock.recv(65536)
+        except socket.error:
+            return count
+        count += 1
+
+
+def metrics(count):
+    return [Metric('servers.www%d.cpu.cpu%d.user' % (i % 50, i % 32),
+                   i % 100, raw_value=i, timestamp=1400000000, precision=2,
+                   metric_type='GAUGE' if i % 2 else 'COUNTER')
+            for i in xrange(count)]
+
+
+def bench_handler(sock, points, batch):
+    config = configobj.ConfigObj()
+    config['host'] = '127.0.0.1'
+    config['port'] = sock.getsockname()[1]
+    config['batch'] = batch
+    handler = StatsdHandler(config)
+
+    start = time.clock()
+    for metric in points:
+        handler.process(metric)
+    handler.flush()
+    cpu = time.clock() - start
+    return handler.datagrams, handler.dropped, cpu
+
+
+def bench_bare(sock, points):
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = sock.getsockname()
+
+    start = time.clock()
+    for metric in points:
+        sender.sendto('%s:%0.2f|g' % (metric.path, metric.value), address)
+    cpu = time.clock() - start
+    sender.close()
+    return len(points), cpu
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--metrics', type='int', default=10000)
+    parser.add_option('--batch', type='int', default=10000,
+                      help='batch option of the handler')
+    options, args = parser.parse_args()
+
+    points = metrics(options.metrics)
+    sock = receiver()
+
+    datagrams, dropped, cpu = bench_handler(sock, points, options.batch)
+    received = drain(sock)
+    print 'StatsdHandler: %d datagrams sent, %d dropped, %d received, ' \
+          '%.1fms CPU' % (datagrams, dropped, received, cpu * 1000)
+
+    datagrams, cpu = bench_bare(sock, points)
+    received = drain(sock)
+    print 'one sendto per metric: %d datagrams sent, %d received, ' \
+          '%.1fms CPU' % (datagrams, received, cpu * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -141,7 +141,8 @@ setup(
     description='Smart data producer for graphite graphing package',
     package_dir={'': 'src'},
     packages=['diamond', 'diamond.handler', 'diamond.utils'],
-    scripts=['bin/diamond', 'bin/diamond-setup'],
+    scripts=['bin/diamond', 'bin/diamond-setup', 'bin/diamond-replay',
+             'bin/diamond-query'],
     data_files=data_files,
     install_requires=install_requires,
     ** setup_kwargs
@@ -22,6 +22,7 @@ Uses /proc/mounts and os.statvfs() to get disk space usage
 
 import diamond.collector
 import diamond.convertor
+from diamond.metric import intern_tags
 import os
 import re
 
@@ -199,6 +200,9 @@ class DiskSpaceCollector(diamond.collector.Collector):
                 if name == '_':
                     name = 'root'
 
+            tags = intern_tags({'device': info['device'],
+                                'mount': info['mount_point']})
+
             if hasattr(os, 'statvfs'):  # POSIX
                 try:
                     data = os.statvfs(info['mount_point'])
@@ -232,34 +236,37 @@ class DiskSpaceCollector(diamond.collector.Collector):
                 metric_name = '%s.%s_percentfree' % (name, unit)
                 metric_value = float(blocks_free) / float(
                     blocks_free + (blocks_total - blocks_free)) * 100
-                self.publish_gauge(metric_name, metric_value, 2)
+                self.publish_gauge(metric_name, metric_value, 2, tags=tags)
 
                 metric_name = '%s.%s_used' % (name, unit)
                 metric_value = float(block_size) * float(
                     blocks_total - blocks_free)
                 metric_value = diamond.convertor.binary.convert(
                     value=metric_value, oldUnit='byte', newUnit=unit)
-                self.publish_gauge(metric_name, metric_value, 2)
+                self.publish_gauge(metric_name, metric_value, 2, tags=tags)
 
                 metric_name = '%s.%s_free' % (name, unit)
                 metric_value = float(block_size) * float(blocks_free)
                 metric_value = diamond.convertor.binary.convert(
                     value=metric_value, oldUnit='byte', newUnit=unit)
-                self.publish_gauge(metric_name, metric_value, 2)
+                self.publish_gauge(metric_name, metric_value, 2, tags=tags)
 
                 if os.name != 'nt':
                     metric_name = '%s.%s_avail' % (name, unit)
                     metric_value = float(block_size) * float(blocks_avail)
                     metric_value = diamond.convertor.binary.convert(
                         value=metric_value, oldUnit='byte', newUnit=unit)
-                    self.publish_gauge(metric_name, metric_value, 2)
+                    self.publish_gauge(metric_name, metric_value, 2, tags=tags)
 
             if os.name != 'nt':
                 if float(inodes_total) > 0:
                     self.publish_gauge(
                         '%s.inodes_percentfree' % name,
-                        float(inodes_free) / float(inodes_total) * 100)
+                        float(inodes_free) / float(inodes_total) * 100,
+                        tags=tags)
                 self.publish_gauge('%s.inodes_used' % name,
-                                   inodes_total - inodes_free)
-                self.publish_gauge('%s.inodes_free' % name, inodes_free)
-                self.publish_gauge('%s.inodes_avail' % name, inodes_avail)
+                                   inodes_total - inodes_free, tags=tags)
+                self.publish_gauge('%s.inodes_free' % name, inodes_free,
+                                   tags=tags)
+                self.publish_gauge('%s.inodes_avail' % name, inodes_avail,
+                                   tags=tags)
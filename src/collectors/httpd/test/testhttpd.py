@@ -39,9 +39,15 @@ class TestHttpdCollector(CollectorTestCase):
 
         self.HTTPResponse = TestHTTPResponse()
 
-        httplib.HTTPConnection.request = Mock(return_value=True)
-        httplib.HTTPConnection.getresponse = Mock(
-            return_value=self.HTTPResponse)
+        patch_request = patch.object(httplib.HTTPConnection, 'request',
+                                     Mock(return_value=True))
+        patch_getresponse = patch.object(httplib.HTTPConnection,
+                                         'getresponse',
+                                         Mock(return_value=self.HTTPResponse))
+        patch_request.start()
+        self.addCleanup(patch_request.stop)
+        patch_getresponse.start()
+        self.addCleanup(patch_getresponse.stop)
 
     def test_import(self):
         self.assertTrue(HttpdCollector)
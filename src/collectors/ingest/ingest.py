@@ -0,0 +1,451 @@
+# coding=utf-8
+
+"""
+Receive metrics pushed by local applications, in the statsd or the graphite
+plaintext format, over UDP or TCP, and publish their aggregates every
+collector interval. This makes running a separate statsd daemon next to
+Diamond unnecessary.
+
+```
+echo "myapp.requests:1|c" | nc -u -w0 127.0.0.1 8125
+echo "myapp.queue.size 42" | nc -w0 127.0.0.1 8125
+```
+
+Lines are aggregated in the collector process as they arrive:
+
+ * statsd counters (`c`) are summed, honouring sample rates, and published
+   as rates per second.
+ * statsd timers and distributions (`ms`, `h`, `d`) are accumulated in
+   quantile sketches and published as histograms, see `percentiles`.
+ * statsd gauges (`g`) keep their last value, `+n` and `-n` change it.
+ * statsd sets (`s`) are published as their number of distinct values.
+ * graphite lines are published as gauges of their last value; their
+   timestamp is ignored.
+
+DogStatsD tags, `myapp.requests:1|c|#env:prod`, are published as metric tags.
+Tags without a value are ignored. The collector also publishes the rates of
+received packets (`packets_received`), lines it could not parse
+(`bad_lines_seen`) and metrics dropped because `max_series` was reached or
+a line was too long (`metrics_dropped`).
+
+The sockets are non-blocking and served by a thread: the datagrams waiting
+on the UDP socket are read in batches, and each batch is parsed with a
+single lock acquisition.
+
+#### Configuration
+
+ * `listen_address` - Address to listen on. (default: `127.0.0.1`)
+ * `udp_port` - UDP port, empty to disable. (default: `8125`)
+ * `tcp_port` - TCP port, empty to disable. (default: `8125`)
+ * `max_series` - Series aggregated per interval, the lines of new series
+   are dropped beyond it. (default: `10000`)
+ * `batch_size` - Datagrams read per batch. (default: `1000`)
+ * `receive_buffer` - Size of the UDP receive buffer, large buffers avoid
+   losing packets while a batch is parsed. (default: `1048576`)
+
+"""
+
+import errno
+import os
+import re
+import select
+import socket
+import threading
+
+import diamond.collector
+from diamond.sketch import QuantileSketch
+
+_INVALID_NAME_CHARS = re.compile('[^a-zA-Z0-9_\-.]')
+# Longest line kept from a TCP connection
+_MAX_LINE = 65536
+
+
+def _number(string):
+    """
+    Returns the float of a string, rejecting NaN and infinities
+    """
+    value = float(string)
+    if value != value or value in (float('inf'), float('-inf')):
+        raise ValueError(string)
+    return value
+
+
+def parse_tags(tags):
+    """
+    Returns the (name, value) pairs of DogStatsD tags, e.g. env:prod,az:b
+    """
+    pairs = []
+    for tag in tags.split(','):
+        name, sep, value = tag.partition(':')
+        if name and value:
+            pairs.append((name, value))
+    return pairs
+
+
+class Aggregator(object):
+    """
+    Aggregates statsd and graphite lines between collections
+    """
+
+    def __init__(self, max_series=10000, accuracy=0.01):
+        self.max_series = max_series
+        self.accuracy = accuracy
+        self.series = 0
+        # (name, tags) -> aggregate, tags are the raw DogStatsD tags
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.sets = {}
+        # Gauges of the previous interval, the base of +n and -n
+        self.last_gauges = {}
+
+        self.packets = 0
+        self.malformed = 0
+        self.dropped = 0
+
+    def flush(self):
+        """
+        Returns the counters, gauges, timers and sets aggregated since the
+        last flush, and starts over
+        """
+        aggregates = (self.counters, self.gauges, self.timers, self.sets)
+        self.last_gauges = self.gauges
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+        self.sets = {}
+        self.series = 0
+        return aggregates
+
+    def _new_series(self):
+        if self.series >= self.max_series:
+            self.dropped += 1
+            return False
+        self.series += 1
+        return True
+
+    def add(self, data):
+        """
+        Aggregate the lines of a packet, or of several joined by newlines
+        """
+        for line in data.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                pipe = line.find('|')
+                if pipe < 0:
+                    self._add_plaintext(line)
+                else:
+                    self._add_statsd(line, pipe)
+            except (ValueError, IndexError):
+                self.malformed += 1
+
+    def _add_plaintext(self, line):
+        # name value [timestamp]
+        parts = line.split()
+        if len(parts) == 3:
+            float(parts[2])
+        elif len(parts) != 2:
+            raise ValueError(line)
+        value = _number(parts[1])
+        key = (parts[0], '')
+        if key in self.gauges or self._new_series():
+            self.gauges[key] = value
+
+    def _add_statsd(self, line, pipe):
+        # name:value|type[|@rate][|#tags]
+        colon = line.rfind(':', 0, pipe)
+        if colon <= 0:
+            raise ValueError(line)
+        name = line[:colon]
+        value = line[colon + 1:pipe]
+        fields = line[pipe + 1:].split('|')
+        kind = fields[0]
+        rate = 1.0
+        tags = ''
+        for field in fields[1:]:
+            if field[:1] == '@':
+                rate = _number(field[1:])
+                if not 0 < rate <= 1:
+                    raise ValueError(line)
+            elif field[:1] == '#':
+                tags = field[1:]
+        key = (name, tags)
+
+        if kind == 'c':
+            value = _number(value) / rate
+            if key in self.counters:
+                self.counters[key] += value
+            elif self._new_series():
+                self.counters[key] = value
+        elif kind == 'g':
+            if value[:1] in ('+', '-'):
+                base = self.gauges.get(key)
+                if base is None:
+                    base = self.last_gauges.get(key, 0.0)
+                value = base + _number(value)
+            else:
+                value = _number(value)
+            if key in self.gauges or self._new_series():
+                self.gauges[key] = value
+        elif kind in ('ms', 'h', 'd'):
+            value = _number(value)
+            sketch = self.timers.get(key)
+            if sketch is None:
+                if not self._new_series():
+                    return
+                sketch = self.timers[key] = QuantileSketch(self.accuracy)
+            sketch.add(value, 1 / rate)
+        elif kind == 's':
+            if not value:
+                raise ValueError(line)
+            values = self.sets.get(key)
+            if values is None:
+                if not self._new_series():
+                    return
+                values = self.sets[key] = set()
+            values.add(value)
+        else:
+            raise ValueError(line)
+
+
+class IngestCollector(diamond.collector.Collector):
+
+    def __init__(self, *args, **kwargs):
+        super(IngestCollector, self).__init__(*args, **kwargs)
+        self.aggregator = Aggregator(int(self.config['max_series']),
+                                     float(self.config['sketch_accuracy']))
+        self.lock = threading.Lock()
+        # name -> sanitized name
+        self.names = {}
+
+        # Sockets, served by a thread of the collector process
+        self.listener_pid = None
+        self.running = False
+        self.udp_socket = None
+        self.tcp_socket = None
+        # TCP socket -> incomplete line
+        self.connections = {}
+
+    def get_default_config_help(self):
+        config_help = super(IngestCollector, self).get_default_config_help()
+        config_help.update({
+            'listen_address': 'Address to listen on',
+            'udp_port': 'UDP port, empty to disable',
+            'tcp_port': 'TCP port, empty to disable',
+            'max_series': 'Series aggregated per interval',
+            'batch_size': 'Datagrams read per batch',
+            'receive_buffer': 'Size of the UDP receive buffer',
+        })
+        return config_help
+
+    def get_default_config(self):
+        config = super(IngestCollector, self).get_default_config()
+        config.update({
+            'path': 'ingest',
+            'listen_address': '127.0.0.1',
+            'udp_port': 8125,
+            'tcp_port': 8125,
+            'max_series': 10000,
+            'batch_size': 1000,
+            'receive_buffer': 1048576,
+        })
+        return config
+
+    def _start_listener(self):
+        """
+        Open the sockets and serve them. Threads do not survive the fork of
+        the collector process, so this is done on the first collection.
+        """
+        self.listener_pid = os.getpid()
+        address = self.config['listen_address']
+        try:
+            if str(self.config['udp_port']):
+                self.udp_socket = socket.socket(socket.AF_INET,
+                                                socket.SOCK_DGRAM)
+                try:
+                    self.udp_socket.setsockopt(
+                        socket.SOL_SOCKET, socket.SO_RCVBUF,
+                        int(self.config['receive_buffer']))
+                except socket.error:
+                    pass
+                self.udp_socket.bind((address, int(self.config['udp_port'])))
+                self.udp_socket.setblocking(0)
+            if str(self.config['tcp_port']):
+                self.tcp_socket = socket.socket(socket.AF_INET,
+                                                socket.SOCK_STREAM)
+                self.tcp_socket.setsockopt(socket.SOL_SOCKET,
+                                           socket.SO_REUSEADDR, 1)
+                self.tcp_socket.bind((address, int(self.config['tcp_port'])))
+                self.tcp_socket.listen(socket.SOMAXCONN)
+                self.tcp_socket.setblocking(0)
+        except socket.error, e:
+            self.log.error('IngestCollector: Unable to listen on %s: %s',
+                           address, e)
+            self.close()
+            return
+
+        self.running = True
+        thread = threading.Thread(target=self._listen)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """
+        Stop listening
+        """
+        self.running = False
+        sockets = [self.udp_socket, self.tcp_socket] + self.connections.keys()
+        for sock in sockets:
+            if sock is not None:
+                sock.close()
+        self.udp_socket = None
+        self.tcp_socket = None
+        self.connections = {}
+
+    def _listen(self):
+        udp_socket = self.udp_socket
+        tcp_socket = self.tcp_socket
+        batch_size = int(self.config['batch_size'])
+        while self.running:
+            sockets = [s for s in (udp_socket, tcp_socket) if s is not None]
+            sockets.extend(self.connections)
+            try:
+                readable = select.select(sockets, [], [], 1)[0]
+            except (select.error, socket.error), e:
+                if not self.running:
+                    return
+                if e.args[0] == errno.EINTR:
+                    continue
+                self.log.error('IngestCollector: %s', e)
+                return
+            for sock in readable:
+                try:
+                    if sock is udp_socket:
+                        self._read_datagrams(sock, batch_size)
+                    elif sock is tcp_socket:
+                        self._accept(sock)
+                    else:
+                        self._read_stream(sock)
+                except socket.error, e:
+                    if not self.running:
+                        return
+                    self.log.debug('IngestCollector: %s', e)
+
+    def _read_datagrams(self, sock, batch_size):
+        """
+        Aggregate the datagrams waiting on the UDP socket, batch_size at a
+        time
+        """
+        while True:
+            packets = []
+            try:
+                while len(packets) < batch_size:
+                    packets.append(sock.recv(65535))
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            if packets:
+                self._add(packets)
+            if len(packets) < batch_size:
+                return
+
+    def _accept(self, sock):
+        try:
+            connection, address = sock.accept()
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        connection.setblocking(0)
+        self.connections[connection] = ''
+
+    def _read_stream(self, sock):
+        """
+        Aggregate the complete lines received on a TCP connection
+        """
+        try:
+            data = sock.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        pending = self.connections[sock]
+        if not data:
+            # Closed, the last line may lack its newline
+            del self.connections[sock]
+            sock.close()
+            if pending:
+                self._add([pending])
+            return
+
+        data = pending + data
+        end = data.rfind('\n') + 1
+        pending = data[end:]
+        if len(pending) > _MAX_LINE:
+            pending = ''
+            self.lock.acquire()
+            self.aggregator.dropped += 1
+            self.lock.release()
+        self.connections[sock] = pending
+        if end:
+            self._add([data[:end]])
+
+    def _add(self, packets):
+        self.lock.acquire()
+        try:
+            self.aggregator.packets += len(packets)
+            self.aggregator.add('\n'.join(packets))
+        finally:
+            self.lock.release()
+
+    def _name(self, name):
+        """
+        Returns name as a valid metric path
+        """
+        path = self.names.get(name)
+        if path is None:
+            path = '.'.join(part for part in _INVALID_NAME_CHARS.sub(
+                '_', name.replace(' ', '_').replace('/', '-')).split('.')
+                if part)
+            if len(self.names) >= 100000:
+                self.names.clear()
+            self.names[name] = path
+        return path
+
+    def collect(self):
+        if self.listener_pid != os.getpid():
+            self._start_listener()
+
+        self.lock.acquire()
+        try:
+            counters, gauges, timers, sets = self.aggregator.flush()
+            packets = self.aggregator.packets
+            malformed = self.aggregator.malformed
+            dropped = self.aggregator.dropped
+        finally:
+            self.lock.release()
+
+        interval = float(self.config['interval'])
+        for (name, tags), value in counters.iteritems():
+            self._publish(name, tags, value / interval, 'COUNTER')
+        for (name, tags), value in gauges.iteritems():
+            self._publish(name, tags, value, 'GAUGE')
+        for (name, tags), values in sets.iteritems():
+            self._publish(name, tags, len(values), 'GAUGE')
+        for (name, tags), sketch in timers.iteritems():
+            path = self._name(name)
+            if path:
+                self.publish_histogram(path, sketch, precision=3,
+                                       tags=parse_tags(tags))
+
+        self.publish_counter('packets_received', packets)
+        self.publish_counter('bad_lines_seen', malformed)
+        self.publish_counter('metrics_dropped', dropped)
+
+    def _publish(self, name, tags, value, metric_type):
+        path = self._name(name)
+        if path:
+            self.publish(path, value, precision=3, metric_type=metric_type,
+                         tags=parse_tags(tags))
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+import socket
+import time
+
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import patch
+
+from diamond.collector import Collector
+from ingest import Aggregator
+from ingest import IngestCollector
+from ingest import parse_tags
+
+##########################################################################
+
+
+class TestAggregator(unittest.TestCase):
+
+    def test_statsd_lines(self):
+        aggregator = Aggregator()
+        aggregator.add('\n'.join([
+            'app.requests:1|c',
+            'app.requests:2|c|@0.5',
+            'app.queue:10|g',
+            'app.queue:-3|g',
+            'app.latency:20|ms',
+            'app.latency:40|ms|#env:prod',
+            'app.users:alice|s',
+            'app.users:bob|s',
+            'app.users:alice|s',
+        ]))
+        counters, gauges, timers, sets = aggregator.flush()
+
+        self.assertEqual(counters, {('app.requests', ''): 5})
+        self.assertEqual(gauges, {('app.queue', ''): 7})
+        self.assertEqual(sorted(timers), [('app.latency', ''),
+                                          ('app.latency', 'env:prod')])
+        self.assertEqual(timers[('app.latency', '')].sum, 20)
+        self.assertEqual(sets, {('app.users', ''): set(['alice', 'bob'])})
+        self.assertEqual(aggregator.malformed, 0)
+
+        # Gauge deltas apply to the value of the previous interval
+        aggregator.add('app.queue:+1|g')
+        self.assertEqual(aggregator.flush()[1], {('app.queue', ''): 8})
+
+    def test_graphite_lines(self):
+        aggregator = Aggregator()
+        aggregator.add('app.size 4 1400000000\n  app.size 5\n')
+        self.assertEqual(aggregator.flush()[1], {('app.size', ''): 5})
+
+    def test_malformed_lines(self):
+        aggregator = Aggregator()
+        aggregator.add('\n'.join([
+            'app.requests:x|c',
+            'app.requests|c',
+            'app.requests:1|q',
+            'app.requests:1|c|@2',
+            'app.size nan',
+            'app.size 1 2 3',
+            'app.size',
+        ]))
+        self.assertEqual(aggregator.malformed, 7)
+        self.assertEqual(aggregator.flush(), ({}, {}, {}, {}))
+
+    def test_max_series(self):
+        aggregator = Aggregator(max_series=2)
+        aggregator.add('a:1|c\nb:1|c\nc:1|c\na:1|c')
+        self.assertEqual(aggregator.flush()[0], {('a', ''): 2, ('b', ''): 1})
+        self.assertEqual(aggregator.dropped, 1)
+
+    def test_parse_tags(self):
+        self.assertEqual(parse_tags('env:prod,canary,url:/a:b'),
+                         [('env', 'prod'), ('url', '/a:b')])
+        self.assertEqual(parse_tags(''), [])
+
+
+class TestIngestCollector(CollectorTestCase):
+
+    def setUp(self):
+        config = get_collector_config('IngestCollector', {
+            'interval': 10,
+            'udp_port': 0,
+            'tcp_port': 0,
+            'percentiles': ['50'],
+        })
+        self.collector = IngestCollector(config, None)
+
+    def tearDown(self):
+        self.collector.close()
+
+    def test_import(self):
+        self.assertTrue(IngestCollector)
+
+    def wait_for(self, packets):
+        deadline = time.time() + 5
+        while (self.collector.aggregator.packets < packets and
+               time.time() < deadline):
+            time.sleep(0.01)
+
+    @patch.object(Collector, 'publish_metric')
+    def test_should_publish_received_metrics(self, publish_mock):
+        self.collector.collect()
+        publish_mock.reset_mock()
+
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.sendto('app.requests:20|c\napp.bad:line|c',
+                   self.collector.udp_socket.getsockname())
+        udp.sendto('app.latency:5|ms|#env:prod',
+                   self.collector.udp_socket.getsockname())
+        udp.close()
+        tcp = socket.create_connection(
+            self.collector.tcp_socket.getsockname())
+        tcp.sendall('app.size 42\napp.na me:3|g')
+        tcp.close()
+        self.wait_for(4)
+
+        self.collector.collect()
+        metrics = dict((m[0][0].path.split('.ingest.', 1)[1], m[0][0])
+                       for m in publish_mock.call_args_list)
+
+        self.assertEqual(metrics['app.requests'].value, 2)
+        self.assertEqual(metrics['app.size'].value, 42)
+        self.assertEqual(metrics['app.na_me'].value, 3)
+        self.assertEqual(metrics['app.latency'].metric_type, 'HISTOGRAM')
+        self.assertEqual(metrics['app.latency'].tags, (('env', 'prod'),))
+        self.assertEqual(metrics['packets_received'].raw_value, 4)
+        self.assertEqual(metrics['bad_lines_seen'].raw_value, 1)
+        self.assertEqual(metrics['metrics_dropped'].raw_value, 0)
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -13,6 +13,7 @@ using /proc/net/dev.
 import diamond.collector
 from diamond.collector import str_to_bool
 import diamond.convertor
+from diamond.metric import intern_tags
 import os
 import re
 
@@ -109,6 +110,7 @@ class NetworkCollector(diamond.collector.Collector):
 
         for device in results:
             stats = results[device]
+            tags = intern_tags({'device': device})
             for s, v in stats.items():
                 # Get Metric Name
                 metric_name = '.'.join([device.replace('.', '_'), s])
@@ -125,9 +127,9 @@ class NetworkCollector(diamond.collector.Collector):
                     for u in self.config['byte_unit']:
                         # Public Converted Metric
                         self.publish(metric_name.replace('bytes', u),
-                                     convertor.get(unit=u), 2)
+                                     convertor.get(unit=u), 2, tags=tags)
                 else:
                     # Publish Metric Derivative
-                    self.publish(metric_name, metric_value)
+                    self.publish(metric_name, metric_value, tags=tags)
 
         return None
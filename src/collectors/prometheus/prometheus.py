@@ -0,0 +1,351 @@
+# coding=utf-8
+
+"""
+Scrape Prometheus text format and OpenMetrics `/metrics` endpoints.
+
+The endpoints are fetched concurrently, then parsed line by line. The
+series of a line, its name and labels, is only parsed the first time it is
+seen: its Diamond path, type and tags are cached, so later scrapes of an
+endpoint cost a string split, a dict lookup and a float() per line.
+OpenMetrics exemplars, after ` # ` on a sample line, are ignored.
+
+Counters, and the `_bucket`, `_sum` and `_count` series of histograms and
+summaries, are published as rates per second by derivative(), as
+publish_counter() does. Other samples are published as gauges. The labels of
+a series are published as metric tags. To keep up with endpoints exposing
+100k series, the metrics are built directly rather than through publish(),
+which looks up the collector configuration for each metric.
+
+The path of a series is its name followed by its label values, in label name
+order: `node_cpu_seconds_total{cpu="0",mode="idle"}` is published as
+`node_cpu_seconds_total.0.idle`. `templates` change this for the metric
+names matching a pattern, with a format string using `{name}` and the label
+names:
+
+```
+templates = node_cpu_seconds_total cpu.{cpu}.{mode}, go_* go.{name}
+```
+
+#### Configuration
+
+ * `urls` - Endpoints to scrape, optionally as `alias@url` to publish their
+   metrics under `alias`. With several urls without alias, the host and port
+   of the url are used. (default: `http://localhost:9100/metrics`)
+ * `templates` - `pattern template` pairs, see above.
+ * `timeout` - Seconds to wait for an endpoint. (default: `5`)
+ * `precision` - Decimal places of the published values. (default: `4`)
+
+#### Dependencies
+
+ * urllib2
+
+"""
+
+import fnmatch
+import math
+import re
+import threading
+import time
+import urllib2
+import urlparse
+
+import diamond.collector
+from diamond.metric import Metric
+from diamond.metric import intern_tags
+
+# Sample name suffixes of the series of histograms and summaries
+_SUFFIXES = ('_total', '_bucket', '_count', '_sum', '_created', '_gcount',
+             '_gsum', '_info')
+# Types whose samples are rates once derived
+_COUNTER_TYPES = ('counter', 'histogram', 'summary')
+_COUNTER_SUFFIXES = ('_total', '_bucket', '_count', '_sum')
+_INVALID_PATH_CHARS = re.compile('[^a-zA-Z0-9_\-]')
+
+
+def parse_labels(labels):
+    """
+    Returns the (name, value) pairs of the inside of a label set, e.g.
+    cpu="0",mode="idle"
+    """
+    pairs = []
+    pos = 0
+    end = len(labels)
+    while pos < end:
+        eq = labels.find('=', pos)
+        if eq < 0:
+            break
+        name = labels[pos:eq].strip().lstrip(',').strip()
+        start = labels.find('"', eq) + 1
+        if start <= 0:
+            break
+        stop = labels.find('"', start)
+        # Skip escaped quotes
+        while stop > 0 and _escaped(labels, stop):
+            stop = labels.find('"', stop + 1)
+        if stop < 0:
+            break
+        value = labels[start:stop]
+        if '\\' in value:
+            value = (value.replace('\\\\', '\0').replace('\\"', '"')
+                     .replace('\\n', '\n').replace('\0', '\\'))
+        pairs.append((name, value))
+        pos = stop + 1
+    return pairs
+
+
+def _series_end(line, brace):
+    """
+    Returns the index following the label set opened at brace, skipping
+    quoted label values, 0 if it is not closed
+    """
+    pos = brace + 1
+    while True:
+        close = line.find('}', pos)
+        quote = line.find('"', pos)
+        if quote < 0 or close < quote:
+            return close + 1
+        stop = line.find('"', quote + 1)
+        while stop > 0 and _escaped(line, stop):
+            stop = line.find('"', stop + 1)
+        if stop < 0:
+            return 0
+        pos = stop + 1
+
+
+def _escaped(string, pos):
+    """
+    Returns True if the character at pos is preceded by an odd number of
+    backslashes
+    """
+    count = 0
+    pos -= 1
+    while pos >= 0 and string[pos] == '\\':
+        count += 1
+        pos -= 1
+    return count % 2 == 1
+
+
+class PrometheusCollector(diamond.collector.Collector):
+
+    def __init__(self, *args, **kwargs):
+        super(PrometheusCollector, self).__init__(*args, **kwargs)
+        # (prefix, series) -> (name, is_counter, tags), None to skip
+        self.series = {}
+
+    def process_config(self):
+        super(PrometheusCollector, self).process_config()
+
+        urls = self.config['urls']
+        if isinstance(urls, basestring):
+            urls = [urls]
+        self.endpoints = []
+        for url in urls:
+            alias = None
+            if '@' in url and ':' not in url.split('@', 1)[0]:
+                alias, url = url.split('@', 1)
+            elif len(urls) > 1:
+                alias = urlparse.urlparse(url).netloc
+            if alias is not None:
+                alias = _INVALID_PATH_CHARS.sub('_', alias)
+            self.endpoints.append((alias, url))
+
+        templates = self.config['templates']
+        if isinstance(templates, basestring):
+            templates = [templates]
+        self.templates = []
+        for template in templates:
+            parts = template.split()
+            if len(parts) != 2:
+                self.log.error('PrometheusCollector: Invalid template %r',
+                               template)
+                continue
+            self.templates.append((re.compile(fnmatch.translate(parts[0])),
+                                   parts[1]))
+
+        self.series = {}
+
+    def get_default_config_help(self):
+        config_help = super(PrometheusCollector,
+                            self).get_default_config_help()
+        config_help.update({
+            'urls': 'Endpoints to scrape, as url or alias@url',
+            'templates': 'Path templates of the series, as "pattern '
+                         'template" pairs',
+            'timeout': 'Seconds to wait for an endpoint',
+            'precision': 'Decimal places of the published values',
+        })
+        return config_help
+
+    def get_default_config(self):
+        default_config = super(PrometheusCollector, self).get_default_config()
+        default_config.update({
+            'path': 'prometheus',
+            'urls': ['http://localhost:9100/metrics'],
+            'templates': [],
+            'timeout': 5,
+            'precision': 4,
+        })
+        return default_config
+
+    def _fetch(self, url, bodies, index):
+        request = urllib2.Request(url, headers={
+            'Accept': 'text/plain;version=0.0.4',
+            'User-Agent': 'Diamond Prometheus collector',
+        })
+        try:
+            bodies[index] = urllib2.urlopen(
+                request, timeout=float(self.config['timeout'])).read()
+        except Exception, e:
+            self.log.error("PrometheusCollector: Can't scrape %s: %s", url, e)
+
+    def _path(self, name, labels):
+        """
+        Returns the Diamond path of a series
+        """
+        for pattern, template in self.templates:
+            if pattern.match(name):
+                fields = dict(labels)
+                fields['name'] = name
+                try:
+                    path = template.format(**fields)
+                except (KeyError, IndexError):
+                    break
+                return '.'.join(_INVALID_PATH_CHARS.sub('_', part)
+                                for part in path.split('.'))
+        parts = [_INVALID_PATH_CHARS.sub('_', name)]
+        parts.extend(_INVALID_PATH_CHARS.sub('_', value)
+                     for label, value in sorted(labels))
+        return '.'.join(parts)
+
+    def _parse_series(self, prefix, series, types):
+        """
+        Returns (name, is_counter, tags) of a series, None for series that
+        are not published
+        """
+        brace = series.find('{')
+        if brace < 0:
+            name = series
+            labels = []
+        else:
+            name = series[:brace]
+            labels = parse_labels(series[brace + 1:series.rfind('}')])
+
+        family = name
+        metric_type = types.get(name)
+        if metric_type is None:
+            for suffix in _SUFFIXES:
+                if name.endswith(suffix):
+                    family = name[:-len(suffix)]
+                    metric_type = types.get(family)
+                    break
+        if name.endswith('_created'):
+            # Creation timestamps of OpenMetrics counters
+            return None
+
+        is_counter = (metric_type in _COUNTER_TYPES and
+                      (metric_type == 'counter' or
+                       name.endswith(_COUNTER_SUFFIXES)))
+        path = self._path(name, labels)
+        if prefix is not None:
+            path = '%s.%s' % (prefix, path)
+        return path, is_counter, intern_tags(labels)
+
+    def parse(self, prefix, body):
+        """
+        Yields (path, value, is_counter, tags) for the samples of an
+        exposition body
+        """
+        types = {}
+        cache = self.series
+        for line in body.split('\n'):
+            if not line:
+                continue
+            if line[0] == '#':
+                if line.startswith('# TYPE '):
+                    parts = line.split()
+                    if len(parts) >= 4:
+                        types[parts[2]] = parts[3]
+                continue
+
+            brace = line.find('{')
+            space = line.find(' ')
+            if brace >= 0 and (space < 0 or brace < space):
+                if ' # ' in line:
+                    # An OpenMetrics exemplar follows the value
+                    end = _series_end(line, brace)
+                else:
+                    end = line.rfind('}') + 1
+                series = line[:end]
+                rest = line[end:].split()
+            else:
+                rest = line.split()
+                series = rest.pop(0)
+            if not rest:
+                continue
+
+            key = (prefix, series)
+            info = cache.get(key, False)
+            if info is False:
+                info = cache[key] = self._parse_series(prefix, series, types)
+            if info is None:
+                continue
+
+            try:
+                value = float(rest[0])
+            except ValueError:
+                continue
+            if math.isnan(value) or math.isinf(value):
+                continue
+            yield info[0], value, info[1], info[2]
+
+    def collect(self):
+        bodies = [None] * len(self.endpoints)
+        threads = []
+        for index, (alias, url) in enumerate(self.endpoints):
+            thread = threading.Thread(target=self._fetch,
+                                      args=(url, bodies, index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        precision = int(self.config['precision'])
+        interval = float(self.config['interval'])
+        ttl = interval * float(self.config['ttl_multiplier'])
+        whitelist = self.config['metrics_whitelist']
+        blacklist = self.config['metrics_blacklist']
+        prefix = self.get_metric_path('')
+        host = self.get_hostname()
+        timestamp = int(time.time())
+
+        seen = set()
+        for (alias, url), body in zip(self.endpoints, bodies):
+            if body is None:
+                continue
+            for name, value, is_counter, tags in self.parse(alias, body):
+                if whitelist:
+                    if not whitelist.match(name):
+                        continue
+                elif blacklist and blacklist.match(name):
+                    continue
+                seen.add(name)
+
+                metric_type = 'GAUGE'
+                if is_counter:
+                    metric_type = 'COUNTER'
+                    value = self.derivative(name, value, interval=interval)
+
+                self.publish_metric(Metric(
+                    prefix + name, value, timestamp=timestamp,
+                    precision=precision, host=host, metric_type=metric_type,
+                    ttl=ttl, tags=tags))
+
+        # Forget the series that are gone
+        if len(self.series) > 2 * len(seen):
+            self.series = dict((key, info)
+                               for key, info in self.series.iteritems()
+                               if info is None or info[0] in seen)
+            self.last_values = dict(
+                (path, value) for path, value in self.last_values.iteritems()
+                if path[len(prefix):] in seen)
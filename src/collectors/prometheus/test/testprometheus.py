@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+from test import CollectorTestCase
+from test import get_collector_config
+from test import unittest
+from mock import Mock
+from mock import patch
+
+from diamond.collector import Collector
+from prometheus import PrometheusCollector
+from prometheus import parse_labels
+
+##########################################################################
+
+
+class TestPrometheusCollector(CollectorTestCase):
+
+    def setUp(self):
+        config = get_collector_config('PrometheusCollector', {
+            'interval': 10,
+            'templates': ['node_cpu_* cpu.{cpu}.{mode}'],
+        })
+        self.collector = PrometheusCollector(config, None)
+
+    def test_import(self):
+        self.assertTrue(PrometheusCollector)
+
+    def test_parse_labels(self):
+        self.assertEqual(parse_labels('a="1",b="x\\"y,z}",c="\\\\",'),
+                         [('a', '1'), ('b', 'x"y,z}'), ('c', '\\')])
+
+    @patch.object(Collector, 'publish_metric')
+    def test_should_work_with_real_data(self, publish_mock):
+        urlopen_mock = patch('urllib2.urlopen', Mock(
+            side_effect=lambda *a, **kw: self.getFixture('metrics')))
+        urlopen_mock.start()
+        self.collector.collect()
+        urlopen_mock.stop()
+
+        self.assertPublishedMetricMany(publish_mock, {
+            'node_load1': 0.25,
+            'app_info.C__app__main_.1_2_3': 1,
+        })
+        self.assertUnpublishedMetric(publish_mock, 'app_nan', 0)
+
+        urlopen_mock = patch('urllib2.urlopen', Mock(
+            side_effect=lambda *a, **kw: self.getFixture('metrics_next')))
+        urlopen_mock.start()
+        self.collector.collect()
+        urlopen_mock.stop()
+
+        self.assertPublishedMetricMany(publish_mock, {
+            'cpu.0.idle': 1,
+            'cpu.0.user': 1,
+            'http_request_duration_seconds_bucket._api.0_1': (0.5, 2),
+            'http_request_duration_seconds_bucket._api._Inf': 1,
+            'http_request_duration_seconds_count._api': 1,
+            'http_request_duration_seconds_sum._api': (0.1, 2),
+            'node_load1': 0.25,
+        })
+
+    @patch.object(Collector, 'publish_metric')
+    def test_labels_are_tags(self, publish_mock):
+        urlopen_mock = patch('urllib2.urlopen', Mock(
+            side_effect=lambda *a, **kw: self.getFixture('metrics')))
+        urlopen_mock.start()
+        self.collector.collect()
+        urlopen_mock.stop()
+
+        tags = dict((c[0][0].path.split('.', 3)[3], c[0][0].tags)
+                    for c in publish_mock.call_args_list)
+        self.assertEqual(tags['cpu.0.idle'],
+                         (('cpu', '0'), ('mode', 'idle')))
+        self.assertEqual(tags['node_load1'], ())
+
+    @patch.object(Collector, 'publish_metric')
+    def test_counter_resets(self, publish_mock):
+        for body in ('# TYPE jobs_total counter\njobs_total 50\n',
+                     '# TYPE jobs_total counter\njobs_total 20\n',
+                     '# TYPE jobs_total counter\njobs_total 30\n'):
+            urlopen_mock = patch('urllib2.urlopen', Mock(
+                return_value=Mock(read=Mock(return_value=body))))
+            urlopen_mock.start()
+            self.collector.collect()
+            urlopen_mock.stop()
+
+        self.assertEqual([c[0][0].value for c in publish_mock.call_args_list],
+                         [0, 0, 1])
+        self.assertEqual(self.collector.last_values.values(), [30])
+
+    def test_exemplars_are_ignored(self):
+        body = '\n'.join([
+            '# TYPE rpc_seconds histogram',
+            'rpc_seconds_bucket{le="1",path="a # }"} 3 # {trace_id="a"} 0.5',
+            'rpc_seconds_count 3 # {trace_id="b"} 0.7 1400000000',
+            '# TYPE jobs gauge',
+            'jobs 5 # {trace_id="c"} 1',
+        ])
+        self.assertEqual(list(self.collector.parse(None, body)), [
+            ('rpc_seconds_bucket.1.a____', 3, True,
+             (('le', '1'), ('path', 'a # }'))),
+            ('rpc_seconds_count', 3, True, ()),
+            ('jobs', 5, False, ()),
+        ])
+
+    def test_aliases(self):
+        config = get_collector_config('PrometheusCollector', {
+            'urls': ['app@http://localhost:8080/metrics',
+                     'http://localhost:9100/metrics'],
+        })
+        collector = PrometheusCollector(config, None)
+        self.assertEqual(collector.endpoints, [
+            ('app', 'http://localhost:8080/metrics'),
+            ('localhost_9100', 'http://localhost:9100/metrics')])
+
+##########################################################################
+if __name__ == "__main__":
+    unittest.main()
@@ -13,7 +13,10 @@ import time
 import re
 import subprocess
 
+from diamond.metric import HistogramMetric
 from diamond.metric import Metric
+from diamond.metric import intern_tags
+from diamond.sketch import QuantileSketch
 from diamond.utils.config import load_config
 from error import DiamondException
 
@@ -174,6 +177,8 @@ class Collector(object):
 
         self.handlers = handlers
         self.last_values = {}
+        # (name, instance, tags) -> QuantileSketch of the current run
+        self.sketches = {}
 
         self.configfile = None
         self.load_config(configfile, config)
@@ -254,6 +259,9 @@ class Collector(object):
                                  'Mutually exclusive with metrics_blacklist',
             'metrics_blacklist': 'Regex to match metrics to block. ' +
                                  'Mutually exclusive with metrics_whitelist',
+            'percentiles': 'Percentiles of histograms sent to handlers that '
+                           'do not support histograms',
+            'sketch_accuracy': 'Relative error of histogram percentiles',
         }
 
     def get_default_config(self):
@@ -306,6 +314,10 @@ class Collector(object):
 
             # Blacklist of metrics to let through
             'metrics_blacklist': None,
+
+            # Percentiles of histograms, and their relative error
+            'percentiles': ['50', '90', '99'],
+            'sketch_accuracy': 0.01,
         }
 
     def get_metric_path(self, name, instance=None):
@@ -366,9 +378,12 @@ class Collector(object):
         raise NotImplementedError()
 
     def publish(self, name, value, raw_value=None, precision=0,
-                metric_type='GAUGE', instance=None):
+                metric_type='GAUGE', instance=None, tags=None):
         """
         Publish a metric with the given name
+
+        tags is a dict or a tuple of (name, value) pairs describing the series,
+        the instance, if any, is added as the instance tag.
         """
         # Check whitelist/blacklist
         if self.config['metrics_whitelist']:
@@ -385,11 +400,15 @@ class Collector(object):
         ttl = float(self.config['interval']) * float(
             self.config['ttl_multiplier'])
 
+        if instance is not None:
+            tags = dict(tags or ())
+            tags['instance'] = instance
+
         # Create Metric
         try:
             metric = Metric(path, value, raw_value=raw_value, timestamp=None,
                             precision=precision, host=self.get_hostname(),
-                            metric_type=metric_type, ttl=ttl)
+                            metric_type=metric_type, ttl=ttl, tags=tags)
         except DiamondException:
             self.log.error(('Error when creating new Metric: path=%r, '
                             'value=%r'), path, value)
@@ -406,13 +425,14 @@ class Collector(object):
         for handler in self.handlers:
             handler._process(metric)
 
-    def publish_gauge(self, name, value, precision=0, instance=None):
+    def publish_gauge(self, name, value, precision=0, instance=None,
+                      tags=None):
         return self.publish(name, value, precision=precision,
-                            metric_type='GAUGE', instance=instance)
+                            metric_type='GAUGE', instance=instance, tags=tags)
 
     def publish_counter(self, name, value, precision=0, max_value=0,
                         time_delta=True, interval=None, allow_negative=False,
-                        instance=None):
+                        instance=None, tags=None):
         raw_value = value
         value = self.derivative(name, value, max_value=max_value,
                                 time_delta=time_delta, interval=interval,
@@ -420,7 +440,59 @@ class Collector(object):
                                 instance=instance)
         return self.publish(name, value, raw_value=raw_value,
                             precision=precision, metric_type='COUNTER',
-                            instance=instance)
+                            instance=instance, tags=tags)
+
+    def observe(self, name, value, instance=None, tags=None):
+        """
+        Add an observation, e.g. a latency, to the histogram of a metric. The
+        histograms are published after each collection. NaN and infinite
+        values are ignored.
+        """
+        key = (name, instance, intern_tags(tags))
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = QuantileSketch(
+                float(self.config['sketch_accuracy']))
+        try:
+            sketch.add(value)
+        except ValueError, e:
+            self.log.debug('Ignoring observation of %s: %s', name, e)
+
+    def publish_histogram(self, name, sketch, precision=2, instance=None,
+                          tags=None):
+        """
+        Publish a QuantileSketch with the given name
+        """
+        if self.config['metrics_whitelist']:
+            if not self.config['metrics_whitelist'].match(name):
+                return
+        elif self.config['metrics_blacklist']:
+            if self.config['metrics_blacklist'].match(name):
+                return
+
+        path = self.get_metric_path(name, instance=instance)
+        ttl = float(self.config['interval']) * float(
+            self.config['ttl_multiplier'])
+        if instance is not None:
+            tags = dict(tags or ())
+            tags['instance'] = instance
+        percentiles = self.config['percentiles']
+        if isinstance(percentiles, basestring):
+            percentiles = [percentiles]
+
+        self.publish_metric(HistogramMetric(
+            path, sketch, precision=precision, host=self.get_hostname(),
+            ttl=ttl, tags=tags, percentiles=percentiles))
+
+    def publish_observations(self):
+        """
+        Publish and reset the histograms of observe()
+        """
+        sketches = self.sketches
+        self.sketches = {}
+        for (name, instance, tags), sketch in sketches.iteritems():
+            self.publish_histogram(name, sketch, instance=instance,
+                                   tags=tags)
 
     def derivative(self, name, new, max_value=0,
                    time_delta=True, interval=None,
@@ -470,6 +542,8 @@ class Collector(object):
 
             # Collect Data
             self.collect()
+            if self.sketches:
+                self.publish_observations()
 
             end_time = time.time()
             collector_time = int((end_time - start_time) * 1000)
@@ -39,6 +39,7 @@
 
 from xdrlib import Packer, Unpacker
 import socket
+import struct
 
 slope_str2int = {'zero': 0,
                  'positive': 1,
@@ -103,6 +104,14 @@ def gmetric_write(NAME, VAL, TYPE, UNITS, SLOPE, TMAX, DMAX, GROUP):
     """
     Arguments are in all upper-case to match XML
     """
+    return (gmetric_write_meta(NAME, TYPE, UNITS, SLOPE, TMAX, DMAX, GROUP),
+            gmetric_write_value(gmetric_value_header(NAME), VAL))
+
+
+def gmetric_write_meta(NAME, TYPE, UNITS, SLOPE, TMAX, DMAX, GROUP):
+    """
+    Returns the metadata packet of a metric
+    """
     packer = Packer()
     HOSTNAME = "test"
     SPOOF = 0
@@ -124,17 +133,33 @@ def gmetric_write(NAME, VAL, TYPE, UNITS, SLOPE, TMAX, DMAX, GROUP):
         packer.pack_int(1)
         packer.pack_string("GROUP")
         packer.pack_string(GROUP)
+    return packer.get_buffer()
 
-    # Actual data sent in a separate packet
+
+def gmetric_value_header(NAME):
+    """
+    Returns the part of the value packets of a metric before the value, which
+    only depends on the metric name
+    """
+    HOSTNAME = "test"
+    SPOOF = 0
     data = Packer()
     data.pack_int(128 + 5)
     data.pack_string(HOSTNAME)
     data.pack_string(NAME)
     data.pack_int(SPOOF)
     data.pack_string("%s")
-    data.pack_string(str(VAL))
+    return data.get_buffer()
+
 
-    return packer.get_buffer(),  data.get_buffer()
+def gmetric_write_value(header, VAL):
+    """
+    Returns a value packet, from the header of its metric
+    """
+    # Actual data sent in a separate packet
+    value = str(VAL)
+    return '%s%s%s%s' % (header, struct.pack('>I', len(value)), value,
+                         '\0' * (-len(value) % 4))
 
 
 def gmetric_read(msg):
@@ -1,17 +1,29 @@
 # coding=utf-8
 
 import logging
+import os
 import threading
 import traceback
+import weakref
+from collections import deque
 from configobj import ConfigObj
 import time
 
+# Circuit breaker states
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half-open'
+
 
 class Handler(object):
     """
     Handlers process metrics that are collected by Collectors.
     """
 
+    # Handlers that send HistogramMetric sketches as such set this, the
+    # others get the count, sum and percentile gauges of the histograms
+    native_histograms = False
+
     def __init__(self, config=None, log=None):
         """
         Create a new instance of the Handler class
@@ -40,6 +52,34 @@ class Handler(object):
             self.config['server_error_interval'])
         self._errors = {}
 
+        # circuit breaker
+        self.breaker_failures = int(self.config['breaker_failures'])
+        self.breaker_initial_delay = float(self.config['breaker_delay'])
+        self.breaker_max_delay = float(self.config['breaker_max_delay'])
+        spill_size = int(self.config['breaker_spill_size'])
+        self.breaker_spill = None
+        if spill_size > 0:
+            self.breaker_spill = deque(maxlen=spill_size)
+        self.breaker_state = BREAKER_CLOSED
+        self.breaker_delay = self.breaker_initial_delay
+        self.breaker_probe_time = 0
+        self.breaker_opened = 0
+        self.breaker_dropped = 0
+        self.consecutive_failures = 0
+        self._call_result = None
+
+        # send-on-change
+        self.dedup = str(self.config['dedup']).lower() == 'true'
+        self.dedup_heartbeat = int(self.config['dedup_heartbeat'])
+        self.dedup_max_paths = int(self.config['dedup_max_paths'])
+        # (path, tags) -> (last sent value, points suppressed since), split in
+        # two generations: when the current one is full it replaces the old
+        # one, so paths that stopped reporting are evicted
+        self._dedup_current = {}
+        self._dedup_old = {}
+        self.dedup_suppressed = 0
+        self.dedup_sent = 0
+
         # Initialize Lock
         self.lock = threading.Lock()
 
@@ -51,6 +91,26 @@ class Handler(object):
             'get_default_config_help': 'get_default_config_help',
             'server_error_interval': ('How frequently to send repeated server '
                                       'errors'),
+            'breaker_failures': ('Stop calling the handler after this many '
+                                 'consecutive failures, 0 to never stop'),
+            'breaker_delay': ('Seconds before trying the handler again after '
+                              'it was stopped, doubled after each failed '
+                              'try'),
+            'breaker_max_delay': 'Maximum seconds between two tries',
+            'breaker_spill_size': ('How many metrics to keep while the '
+                                   'handler is stopped, 0 to drop them'),
+            'rollup_interval': ('Send this handler the aggregates of each '
+                                'metric over windows of this many seconds '
+                                'instead of every point, 0 to send every '
+                                'point'),
+            'rollup_aggregates': ('Aggregates to send, of avg, min, max, sum, '
+                                  'count and last'),
+            'dedup': ('Only send a metric when its value changed since it was '
+                      'last sent'),
+            'dedup_heartbeat': ('With dedup, send an unchanged value anyway '
+                                'every this many points'),
+            'dedup_max_paths': ('How many paths dedup remembers, the ones '
+                                'not seen for longest are forgotten first'),
         }
 
     def get_default_config(self):
@@ -60,6 +120,15 @@ class Handler(object):
         return {
             'get_default_config': 'get_default_config',
             'server_error_interval': 120,
+            'breaker_failures': 5,
+            'breaker_delay': 1,
+            'breaker_max_delay': 300,
+            'breaker_spill_size': 0,
+            'rollup_interval': 0,
+            'rollup_aggregates': 'avg',
+            'dedup': False,
+            'dedup_heartbeat': 10,
+            'dedup_max_paths': 100000,
         }
 
     def _process(self, metric):
@@ -68,10 +137,30 @@ class Handler(object):
         """
         if not self.enabled:
             return
+        if metric.metric_type == 'HISTOGRAM' and not self.native_histograms:
+            for part in metric.expand():
+                self._process(part)
+            return
         try:
             try:
                 self.lock.acquire()
-                self.process(metric)
+                if self._breaker_allows():
+                    if (self.dedup and metric.metric_type != 'HISTOGRAM' and
+                            self._dedup_suppress(metric)):
+                        return
+                    self._call_result = None
+                    try:
+                        self.process(metric)
+                    except Exception:
+                        self._call_result = False
+                        self.log.error(traceback.format_exc())
+                    self._breaker_update()
+                elif self.breaker_spill is not None:
+                    if len(self.breaker_spill) == self.breaker_spill.maxlen:
+                        self.breaker_dropped += 1
+                    self.breaker_spill.append(metric)
+                else:
+                    self.breaker_dropped += 1
             except Exception:
                 self.log.error(traceback.format_exc())
         finally:
@@ -95,7 +184,14 @@ class Handler(object):
         try:
             try:
                 self.lock.acquire()
-                self.flush()
+                if self._breaker_allows():
+                    self._call_result = None
+                    try:
+                        self.flush()
+                    except Exception:
+                        self._call_result = False
+                        self.log.error(traceback.format_exc())
+                    self._breaker_update()
             except Exception:
                 self.log.error(traceback.format_exc())
         finally:
@@ -110,6 +206,126 @@ class Handler(object):
         """
         pass
 
+    def get_stats(self):
+        """
+        Returns the internal counters of the handler, published by the
+        handler process every handler_stats_interval seconds
+
+        Optional: Should be extended in subclasses
+        """
+        spilled = 0
+        if self.breaker_spill is not None:
+            spilled = len(self.breaker_spill)
+        stats = {
+            'breaker_open': int(self.breaker_state != BREAKER_CLOSED),
+            'breaker_consecutive_failures': self.consecutive_failures,
+            'breaker_opened': self.breaker_opened,
+            'breaker_dropped': self.breaker_dropped,
+            'breaker_spilled': spilled,
+            'breaker_delay': self.breaker_delay,
+        }
+        if self.dedup:
+            stats.update({
+                'dedup_sent': self.dedup_sent,
+                'dedup_suppressed': self.dedup_suppressed,
+                'dedup_paths': (len(self._dedup_current) +
+                                len(self._dedup_old)),
+            })
+        return stats
+
+    def _record_success(self):
+        """
+        Tell the circuit breaker that the downstream accepted data
+        """
+        self._call_result = True
+
+    def _record_failure(self):
+        """
+        Tell the circuit breaker that connecting or sending failed
+        """
+        self._call_result = False
+
+    def _breaker_allows(self):
+        """
+        Returns True if the handler may be called. An open breaker lets
+        calls through again, half-open, once its delay has passed.
+        """
+        if self.breaker_state != BREAKER_OPEN:
+            return True
+        if time.time() < self.breaker_probe_time:
+            return False
+        self.breaker_state = BREAKER_HALF_OPEN
+        self.log.info("%s: Circuit breaker half-open, trying again",
+                      self.__class__.__name__)
+        return True
+
+    def _breaker_update(self):
+        """
+        Update the circuit breaker with the outcome of the last call
+        """
+        # A call that neither raised nor recorded a failure succeeded
+        if self._call_result is not False:
+            self.consecutive_failures = 0
+            if self.breaker_state != BREAKER_CLOSED:
+                self.breaker_state = BREAKER_CLOSED
+                self.breaker_delay = self.breaker_initial_delay
+                self.log.info("%s: Circuit breaker closed",
+                              self.__class__.__name__)
+                self._replay_spill()
+            return
+
+        self.consecutive_failures += 1
+        if self.breaker_state == BREAKER_HALF_OPEN:
+            self.breaker_delay = min(self.breaker_delay * 2,
+                                     self.breaker_max_delay)
+        elif (self.breaker_failures <= 0 or
+              self.consecutive_failures < self.breaker_failures):
+            return
+        self.breaker_state = BREAKER_OPEN
+        self.breaker_probe_time = time.time() + self.breaker_delay
+        self.breaker_opened += 1
+        self.log.warning("%s: Circuit breaker open after %d failures, trying "
+                         "again in %.0fs", self.__class__.__name__,
+                         self.consecutive_failures, self.breaker_delay)
+
+    def _replay_spill(self):
+        """
+        Process the metrics kept while the breaker was open
+        """
+        if not self.breaker_spill:
+            return
+        metrics = list(self.breaker_spill)
+        self.breaker_spill.clear()
+        for metric in metrics:
+            try:
+                self.process(metric)
+            except Exception:
+                self.log.error(traceback.format_exc())
+
+    def _dedup_suppress(self, metric):
+        """
+        Returns True if the metric has the value last sent for its path and
+        is not due for a heartbeat
+        """
+        key = (metric.path, metric.tags)
+        entry = self._dedup_current.get(key)
+        if entry is None:
+            entry = self._dedup_old.pop(key, None)
+
+        if (entry is not None and entry[0] == metric.value and
+                entry[1] + 1 < self.dedup_heartbeat):
+            self._dedup_current[key] = (entry[0], entry[1] + 1)
+            self.dedup_suppressed += 1
+            return True
+
+        if (key not in self._dedup_current and
+                len(self._dedup_current) * 2 >= self.dedup_max_paths):
+            self._dedup_old = self._dedup_current
+            self._dedup_current = {}
+        self._dedup_current[key] = (metric.value, 0)
+        self.dedup_sent += 1
+        return False
+
     def _throttle_error(self, msg, *args, **kwargs):
         """
         Avoids sending errors repeatedly. Waits at least
@@ -149,3 +365,238 @@ class Handler(object):
             del self._errors[msg]
         else:
             self._errors = {}
+
+
+def _flush_periodically(ref, stop, interval):
+    """
+    Timer thread flushing the due batches of a BatchingHandler, until the
+    handler is garbage collected or stopped
+    """
+    while not stop.wait(interval):
+        handler = ref()
+        if handler is None:
+            return
+        if handler.is_batch_due():
+            handler._flush()
+        del handler
+
+
+class BatchingHandler(Handler):
+    """
+    Handler sending metrics in batches.
+
+    A batch is sent when it holds `batch` metrics or `batch_max_bytes`
+    encoded bytes, when it is `batch_max_interval` seconds old, and on
+    flush. A timer thread sends batches that are due even when no metrics
+    arrive. Failed sends are retried `batch_retries` times with an
+    exponential backoff.
+
+    Subclasses implement send(payload). They may override encode(metric)
+    and take(), or add(metric) and take() to build payloads their own way.
+    """
+
+    def __init__(self, config=None, log=None):
+        """
+        Create a new instance of the BatchingHandler class
+        """
+        Handler.__init__(self, config, log)
+
+        self.batch_size = int(self.config['batch'])
+        self.batch_max_bytes = int(self.config['batch_max_bytes'])
+        self.batch_max_interval = float(self.config['batch_max_interval'])
+        self.batch_retries = int(self.config['batch_retries'])
+        self.batch_retry_backoff = float(self.config['batch_retry_backoff'])
+
+        # Encoded metrics of the default add() and take()
+        self.items = []
+        self._reset_batch()
+
+        # Statistics: batch size histogram, by power of two upper bound
+        self.batch_sizes = {}
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+        # Timer thread, started in the process that handles the metrics
+        self.timer_pid = None
+        self.timer_stop = threading.Event()
+
+    def get_default_config_help(self):
+        """
+        Returns the help text for the configuration options for this handler
+        """
+        config = super(BatchingHandler, self).get_default_config_help()
+
+        config.update({
+            'batch': 'How many metrics to send at once',
+            'batch_max_bytes': 'Send the batch when it reaches this many '
+                               'encoded bytes, 0 for no limit',
+            'batch_max_interval': 'Send the batch when it is this many '
+                                  'seconds old, 0 to only send it when full '
+                                  'or flushed',
+            'batch_retries': 'How many times to retry sending a batch',
+            'batch_retry_backoff': 'Seconds to wait before the first retry, '
+                                   'doubled for each retry',
+        })
+
+        return config
+
+    def get_default_config(self):
+        """
+        Return the default config for the handler
+        """
+        config = super(BatchingHandler, self).get_default_config()
+
+        config.update({
+            'batch': 1,
+            'batch_max_bytes': 0,
+            'batch_max_interval': 0,
+            'batch_retries': 0,
+            'batch_retry_backoff': 1,
+        })
+
+        return config
+
+    def _reset_batch(self):
+        self.batch_count = 0
+        self.batch_bytes = 0
+        self.batch_timestamp = time.time()
+
+    def _start_timer(self):
+        """
+        Start the timer thread. Threads do not survive the fork of the
+        handler process, so this is done on the first metric.
+        """
+        self.timer_pid = os.getpid()
+        timer = threading.Thread(
+            target=_flush_periodically,
+            args=(weakref.ref(self), self.timer_stop,
+                  min(self.batch_max_interval, 1.0)))
+        timer.daemon = True
+        timer.start()
+
+    def encode(self, metric):
+        """
+        Encode a metric for the default add(), as a graphite line
+        """
+        return str(metric)
+
+    def add(self, metric):
+        """
+        Add a metric to the batch being built. Returns the number of bytes
+        it added, or None if the metric was skipped.
+        """
+        item = self.encode(metric)
+        if item is None:
+            return None
+        self.items.append(item)
+        return len(item)
+
+    def take(self):
+        """
+        Returns the list of payloads of the batch, and starts a new batch
+        """
+        items, self.items = self.items, []
+        return [''.join(items)]
+
+    def send(self, payload):
+        """
+        Send a payload, raising an exception on failure
+
+        Should be overridden in subclasses
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Returns the batch counters, and the batch size histogram as one
+        batch_size_<upper bound> counter per bucket
+        """
+        stats = super(BatchingHandler, self).get_stats()
+        stats.update({
+            'batches_sent': self.batches_sent,
+            'batches_failed': self.batches_failed,
+            'last_flush_seconds': self.last_flush_seconds,
+            'total_flush_seconds': self.total_flush_seconds,
+        })
+        for bucket, count in self.batch_sizes.iteritems():
+            stats['batch_size_%d' % bucket] = count
+        return stats
+
+    def is_batch_due(self):
+        """
+        Returns True if the batch is older than batch_max_interval
+        """
+        return (self.batch_count > 0 and self.batch_max_interval > 0 and
+                time.time() - self.batch_timestamp >= self.batch_max_interval)
+
+    def process(self, metric):
+        """
+        Add a metric to the batch, sending the batch if it is full or due
+        """
+        if self.batch_max_interval > 0 and self.timer_pid != os.getpid():
+            self._start_timer()
+
+        size = self.add(metric)
+        if size is None:
+            return
+        if self.batch_count == 0:
+            self.batch_timestamp = time.time()
+        self.batch_count += 1
+        self.batch_bytes += size
+
+        if (self.batch_count >= self.batch_size or
+                (self.batch_max_bytes > 0 and
+                 self.batch_bytes >= self.batch_max_bytes) or
+                self.is_batch_due()):
+            self.send_batch()
+
+    def flush(self):
+        """
+        Send the batch
+        """
+        self.send_batch()
+
+    def send_batch(self):
+        """
+        Send the payloads of the batch, retrying failures
+        """
+        if self.batch_count == 0:
+            return
+        count = self.batch_count
+        self._reset_batch()
+
+        start = time.time()
+        failed = False
+        for payload in self.take():
+            attempt = 0
+            while True:
+                try:
+                    self.send(payload)
+                    self._record_success()
+                    break
+                except Exception, e:
+                    if attempt >= self.batch_retries:
+                        self._record_failure()
+                        failed = True
+                        self._throttle_error(
+                            "%s: Failed to send a batch of %d metrics: %s",
+                            self.__class__.__name__, count, e)
+                        break
+                    time.sleep(self.batch_retry_backoff * 2 ** attempt)
+                    attempt += 1
+
+        self.last_flush_seconds = time.time() - start
+        self.total_flush_seconds += self.last_flush_seconds
+        if failed:
+            self.batches_failed += 1
+        else:
+            self.batches_sent += 1
+        bucket = 1
+        while bucket < count:
+            bucket *= 2
+        self.batch_sizes[bucket] = self.batch_sizes.get(bucket, 0) + 1
+        self.log.debug("%s: Sent %d metrics in %.3fs",
+                       self.__class__.__name__, count,
+                       self.last_flush_seconds)
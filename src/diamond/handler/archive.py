@@ -3,11 +3,334 @@
 """
 Write the collected stats to a locally stored log file. Rotate the log file
 every night and remove after 7 days.
+
+Metrics are appended in batches through a buffered file. Rotated segments are
+compressed in the background (gzip, or zstd if
+[zstandard](https://pypi.python.org/pypi/zstandard) is installed) and listed
+with the time range they cover in `<log_file>.index`, one
+`segment first_timestamp last_timestamp count` line per segment.
+
+An archive can be streamed back through any handler with `diamond-replay`,
+for instance to backfill an outage:
+
+    diamond-replay --handler diamond.handler.graphite.GraphiteHandler \\
+        --start 1420070400 --end 1420074000 --rate 5000
 """
 
 from Handler import Handler
+from diamond.metric import Metric
+from diamond.error import DiamondException
+import codecs
+import glob
+import gzip
 import logging
-import logging.handlers
+import os
+import shutil
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'none': '',
+}
+
+
+def _open_segment(filename):
+    """
+    Open an archive segment for reading, whatever its compression
+    """
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    if filename.endswith('.zst'):
+        if zstandard is None:
+            raise DiamondException('zstandard is needed to read %s' %
+                                   filename)
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(filename, 'rb'))
+    return open(filename, 'rb')
+
+
+def _compress_segment(filename, compression):
+    """
+    Compress a rotated segment and return the compressed file name
+    """
+    target = filename + COMPRESSION_SUFFIXES[compression]
+    if target == filename:
+        return filename
+    with open(filename, 'rb') as source:
+        if compression == 'zstd':
+            with open(target, 'wb') as dest:
+                compressor = zstandard.ZstdCompressor()
+                compressor.copy_stream(source, dest)
+        else:
+            dest = gzip.open(target, 'wb')
+            try:
+                shutil.copyfileobj(source, dest)
+            finally:
+                dest.close()
+    os.unlink(filename)
+    return target
+
+
+def _segment_range(filename):
+    """
+    Returns the (first_timestamp, last_timestamp, count) of the lines of an
+    uncompressed segment, None if it has none
+    """
+    first = last = None
+    count = 0
+    with open(filename, 'rb') as segment:
+        for line in segment:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            try:
+                timestamp = int(parts[2])
+            except ValueError:
+                continue
+            if count == 0:
+                first = last = timestamp
+            else:
+                first = min(first, timestamp)
+                last = max(last, timestamp)
+            count += 1
+    if not count:
+        return None
+    return first, last, count
+
+
+class ArchiveWriter(object):
+    """
+    Appends metric lines to a buffered file, rotating, compressing and
+    indexing segments
+    """
+
+    def __init__(self, filename, rotate_interval=None, days=7,
+                 compression='gzip', buffer_size=65536, encoding=None,
+                 log=None):
+        self.filename = filename
+        self.index_filename = filename + '.index'
+        self.rotate_interval = rotate_interval
+        self.days = days
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.encoding = encoding or None
+        self.log = log or logging.getLogger('diamond')
+
+        self.file = None
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.count = 0
+        self.rollover_at = self._compute_rollover(time.time())
+        self.index_lock = threading.Lock()
+        self.compressors = []
+        # A file left by a previous run is appended to. Its lines are only
+        # counted when it is rotated, in the background
+        self.inherited = (os.path.exists(filename) and
+                          os.path.getsize(filename) > 0)
+
+    def _compute_rollover(self, now):
+        """
+        Returns the time of the next rotation, midnight by default
+        """
+        if self.rotate_interval:
+            interval = self.rotate_interval
+            return (int(now) // interval + 1) * interval
+        t = time.localtime(now)
+        midnight = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1,
+                                0, 0, 0, 0, 0, -1))
+        return int(midnight)
+
+    def _open(self):
+        if self.encoding:
+            self.file = codecs.open(self.filename, 'ab', self.encoding,
+                                    buffering=self.buffer_size)
+        else:
+            self.file = open(self.filename, 'ab', self.buffer_size)
+
+    def write(self, lines, first_timestamp, last_timestamp):
+        """
+        Append already formatted lines covering the given time range
+        """
+        if time.time() >= self.rollover_at:
+            self.rotate()
+        if self.file is None:
+            self._open()
+        self.file.write(''.join(lines))
+        if self.count == 0:
+            self.first_timestamp = first_timestamp
+            self.last_timestamp = last_timestamp
+        else:
+            self.first_timestamp = min(self.first_timestamp, first_timestamp)
+            self.last_timestamp = max(self.last_timestamp, last_timestamp)
+        self.count += len(lines)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rotate(self):
+        """
+        Move the current file aside and compress it in the background
+        """
+        self.close()
+        now = time.time()
+        self.rollover_at = self._compute_rollover(now)
+        if (not os.path.exists(self.filename) or
+                not (self.count or self.inherited)):
+            return
+
+        segment = '%s.%s' % (self.filename,
+                             time.strftime('%Y-%m-%d_%H-%M-%S',
+                                           time.localtime(now)))
+        os.rename(self.filename, segment)
+        entry = None
+        if not self.inherited:
+            entry = (self.first_timestamp, self.last_timestamp, self.count)
+        self.first_timestamp = self.last_timestamp = None
+        self.count = 0
+        self.inherited = False
+
+        compressor = threading.Thread(target=self._finish_segment,
+                                      args=(segment, entry))
+        compressor.daemon = True
+        compressor.start()
+        self.compressors = [t for t in self.compressors if t.is_alive()]
+        self.compressors.append(compressor)
+
+    def _finish_segment(self, segment, entry):
+        if entry is None:
+            entry = _segment_range(segment)
+        try:
+            segment = _compress_segment(segment, self.compression)
+        except Exception, e:
+            self.log.error('ArchiveHandler: Failed to compress %s: %s',
+                           segment, e)
+        with self.index_lock:
+            if entry is not None:
+                with open(self.index_filename, 'a') as index:
+                    index.write('%s %d %d %d\n' % (
+                        (os.path.basename(segment),) + entry))
+            self._remove_expired()
+
+    def _remove_expired(self):
+        """
+        Remove segments, and their index lines, older than self.days
+        """
+        if not self.days:
+            return
+        oldest = time.time() - self.days * 86400
+        segments = read_index(self.filename)
+        expired = [s for s in segments if s[2] < oldest]
+        if not expired:
+            return
+        for segment in expired:
+            try:
+                os.unlink(segment[0])
+            except OSError:
+                pass
+        with open(self.index_filename, 'w') as index:
+            for segment in segments:
+                if segment[2] >= oldest:
+                    index.write('%s %d %d %d\n' % (
+                        (os.path.basename(segment[0]),) + segment[1:]))
+
+    def join(self):
+        """
+        Wait for background compression to finish
+        """
+        for compressor in self.compressors:
+            compressor.join()
+
+
+def _parse_line(line):
+    """
+    Parse an archived "path value timestamp" line, keeping the precision
+    of the value
+    """
+    parts = line.split()
+    if len(parts) != 3:
+        return None
+    path, value, timestamp = parts
+    precision = 0
+    if '.' in value:
+        precision = len(value) - value.index('.') - 1
+    try:
+        return Metric(path, float(value), timestamp=int(timestamp),
+                      precision=precision)
+    except (ValueError, DiamondException):
+        return None
+
+
+def read_index(filename):
+    """
+    Returns the (path, first_timestamp, last_timestamp, count) of the
+    rotated segments of an archive, oldest first
+    """
+    segments = []
+    dirname = os.path.dirname(filename)
+    try:
+        index = open(filename + '.index')
+    except IOError:
+        return segments
+    with index:
+        for line in index:
+            parts = line.split()
+            if len(parts) != 4:
+                continue
+            segments.append((os.path.join(dirname, parts[0]),
+                             int(parts[1]), int(parts[2]), int(parts[3])))
+    return segments
+
+
+def read_archive(filename, start=None, end=None):
+    """
+    Yields the archived metrics with start <= timestamp <= end, reading
+    only the segments whose indexed time range overlaps
+    """
+    segments = []
+    indexed = set()
+    for path, first, last, count in read_index(filename):
+        indexed.add(path)
+        if start is not None and last < start:
+            continue
+        if end is not None and first > end:
+            continue
+        segments.append(path)
+    # Segments rotated by the logging based handler are not indexed
+    for path in sorted(glob.glob(filename + '.*')):
+        if path.endswith('.index') or path in indexed:
+            continue
+        segments.append(path)
+    segments.append(filename)
+
+    for path in segments:
+        if not os.path.exists(path):
+            continue
+        segment = _open_segment(path)
+        try:
+            for line in segment:
+                metric = _parse_line(line)
+                if metric is None:
+                    continue
+                if start is not None and metric.timestamp < start:
+                    continue
+                if end is not None and metric.timestamp > end:
+                    continue
+                yield metric
+        finally:
+            segment.close()
 
 
 class ArchiveHandler(Handler):
@@ -22,23 +345,36 @@ class ArchiveHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config)
 
-        # Create Archive Logger
-        self.archive = logging.getLogger('archive')
-        self.archive.setLevel(logging.DEBUG)
-        self.archive.propagate = self.config['propagate']
-        # Create Archive Log Formatter
-        formatter = logging.Formatter('%(message)s')
-        # Create Archive Log Handler
-        handler = logging.handlers.TimedRotatingFileHandler(
-            filename=self.config['log_file'],
-            when='midnight',
-            interval=1,
-            backupCount=int(self.config['days']),
-            encoding=self.config['encoding']
-        )
-        handler.setFormatter(formatter)
-        handler.setLevel(logging.DEBUG)
-        self.archive.addHandler(handler)
+        compression = self.config['compression'].lower()
+        if compression not in COMPRESSION_SUFFIXES:
+            self.log.error('ArchiveHandler: Unknown compression %s, using '
+                           'gzip', compression)
+            compression = 'gzip'
+        if compression == 'zstd' and zstandard is None:
+            self.log.error('ArchiveHandler: zstandard import failed, using '
+                           'gzip')
+            compression = 'gzip'
+
+        self.batch_size = int(self.config['batch'])
+        self.lines = []
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        self.writer = ArchiveWriter(
+            self.config['log_file'],
+            rotate_interval=int(self.config['rotate_interval']),
+            days=int(self.config['days']),
+            compression=compression,
+            buffer_size=int(self.config['buffer_size']),
+            encoding=self.config['encoding'],
+            log=self.log)
+
+        # Metrics only go through the logging machinery when asked to
+        # reach the root logger
+        self.archive = None
+        if str(self.config['propagate']) == 'True':
+            self.archive = logging.getLogger('archive')
+            self.archive.setLevel(logging.DEBUG)
 
     def get_default_config_help(self):
         """
@@ -49,8 +385,13 @@ class ArchiveHandler(Handler):
         config.update({
             'log_file': 'Path to the logfile',
             'days': 'How many days to store',
-            'encoding': '',
+            'encoding': 'Encoding of the archive file, e.g. utf-8',
             'propagate': 'Pass handled metrics to configured root logger',
+            'batch': 'How many metrics to buffer before writing',
+            'buffer_size': 'Size of the file write buffer in bytes',
+            'rotate_interval': 'Rotate every this many seconds, 0 for '
+                               'midnight',
+            'compression': 'Compression of rotated files: gzip, zstd or none',
         })
 
         return config
@@ -66,13 +407,54 @@ class ArchiveHandler(Handler):
             'days': 7,
             'encoding': None,
             'propagate': False,
+            'batch': 1000,
+            'buffer_size': 65536,
+            'rotate_interval': 0,
+            'compression': 'gzip',
         })
 
         return config
 
+    def __del__(self):
+        """
+        Write out anything still buffered
+        """
+        if hasattr(self, 'writer'):
+            self._flush()
+            self.writer.close()
+
     def process(self, metric):
         """
         Send a Metric to the Archive.
         """
-        # Archive Metric
-        self.archive.info(str(metric).strip())
+        line = str(metric)
+        self.lines.append(line)
+        if self.first_timestamp is None:
+            self.first_timestamp = metric.timestamp
+            self.last_timestamp = metric.timestamp
+        else:
+            self.first_timestamp = min(self.first_timestamp,
+                                       metric.timestamp)
+            self.last_timestamp = max(self.last_timestamp, metric.timestamp)
+
+        if self.archive is not None:
+            self.archive.info(line.strip())
+
+        if len(self.lines) >= self.batch_size:
+            self._write()
+
+    def flush(self):
+        """
+        Write batched metrics and flush the file buffer
+        """
+        self._write()
+        self.writer.flush()
+
+    def _write(self):
+        if not self.lines:
+            return
+        self.writer.write(self.lines, self.first_timestamp,
+                          self.last_timestamp)
+        self.lines = []
+        self.first_timestamp = None
+        self.last_timestamp = None
@@ -4,6 +4,10 @@ Output the collected values to AWS CloudWatch
 
 Automatically adds the InstanceId Dimension
 
+Rules are looked up by (collector, metric). Matching values are aggregated
+into a statistic set per rule and minute, and sent on flush with as few
+PutMetricData calls as possible, `max_datums` datums per call.
+
 #### Dependencies
 
  * [boto](http://boto.readthedocs.org/en/latest/index.html)
@@ -65,6 +69,7 @@ class cloudwatchHandler(Handler):
         if not boto:
             self.log.error(
                 "CloudWatch: Boto is not installed, please install boto.")
+            self.enabled = False
             return
 
         # Initialize Data
@@ -72,9 +77,12 @@ class cloudwatchHandler(Handler):
 
         # Initialize Options
         self.region = self.config['region']
+        self.max_datums = int(self.config['max_datums'])
+        self.period = int(self.config['period'])
         instances = boto.utils.get_instance_metadata()
         if 'instance-id' not in instances:
             self.log.error('CloudWatch: Failed to load instance metadata')
+            self.enabled = False
             return
         self.instance_id = instances['instance-id']
         self.log.debug("Setting InstanceId: " + self.instance_id)
@@ -83,6 +91,12 @@ class cloudwatchHandler(Handler):
                              'name', 'unit')
 
         self.rules = []
+        # Rules by (collector, metric)
+        self.rule_index = {}
+        # Statistic sets by (namespace, name, unit, period), and their keys
+        # in arrival order
+        self.datums = {}
+        self.datum_keys = []
         for key_name, section in self.config.items():
             if section.__class__ is Section:
                 keys = section.keys()
@@ -95,6 +109,10 @@ class cloudwatchHandler(Handler):
                         rules[key] = section[key]
 
                 self.rules.append(rules)
+                key = (str(rules.get('collector')), str(rules.get('metric')))
+                self.rule_index.setdefault(key, []).append(
+                    (str(rules.get('namespace')), str(rules.get('name')),
+                     str(rules.get('unit'))))
 
         # Create CloudWatch Connection
         self._bind()
@@ -112,6 +130,9 @@ class cloudwatchHandler(Handler):
             'name': '',
             'unit': '',
             'collector': '',
+            'max_datums': 'How many datums to send per PutMetricData call',
+            'period': 'Aggregate the values of a metric over this many '
+                      'seconds',
         })
 
         return config
@@ -129,6 +150,8 @@ class cloudwatchHandler(Handler):
             'namespace': 'MachineLoad',
             'name': 'Avg01',
             'unit': 'None',
+            'max_datums': 20,
+            'period': 60,
         })
 
         return config
@@ -161,51 +184,66 @@ class cloudwatchHandler(Handler):
 
     def process(self, metric):
         """
-          Process a metric and send it to CloudWatch
+          Aggregate a metric into the statistic sets of its rules
         """
         if not boto:
             return
 
-        collector = str(metric.getCollectorPath())
-        metricname = str(metric.getMetricPath())
-        timestamp = datetime.datetime.fromtimestamp(metric.timestamp)
+        rules = self.rule_index.get((metric.getCollectorPath(),
+                                     metric.getMetricPath()))
+        if rules is None:
+            return
 
-        # Send the data as ......
+        value = float(metric.value)
+        period = metric.timestamp - metric.timestamp % self.period
+        for namespace, name, unit in rules:
+            key = (namespace, name, unit, period)
+            datum = self.datums.get(key)
+            if datum is None:
+                self.datums[key] = {'maximum': value, 'minimum': value,
+                                    'samplecount': 1, 'sum': value}
+                self.datum_keys.append(key)
+            else:
+                datum['maximum'] = max(datum['maximum'], value)
+                datum['minimum'] = min(datum['minimum'], value)
+                datum['samplecount'] += 1
+                datum['sum'] += value
+
+    def flush(self):
+        """
+          Send the aggregated statistic sets to CloudWatch
+        """
+        if not boto or not self.datums:
+            return
 
-        for rule in self.rules:
-            self.log.debug(
-                "Comparing Collector: [%s] with (%s) "
-                "and Metric: [%s] with (%s)",
-                str(rule['collector']),
-                collector,
-                str(rule['metric']),
-                metricname
-            )
-
-            if ((str(rule['collector']) == collector and
-                 str(rule['metric']) == metricname)):
+        # Group by namespace, one PutMetricData call per max_datums datums
+        by_namespace = {}
+        namespaces = []
+        for key in self.datum_keys:
+            if key[0] not in by_namespace:
+                by_namespace[key[0]] = []
+                namespaces.append(key[0])
+            by_namespace[key[0]].append((key, self.datums[key]))
+        self.datums = {}
+        self.datum_keys = []
+
+        dimensions = {'InstanceId': self.instance_id}
+        for namespace in namespaces:
+            datums = by_namespace[namespace]
+            for i in range(0, len(datums), self.max_datums):
+                chunk = datums[i:i + self.max_datums]
                 self.log.debug(
-                    "CloudWatch: Attempting to publish metric: %s to %s "
-                    "with value (%s) @%s",
-                    rule['name'],
-                    rule['namespace'],
-                    str(metric.value),
-                    str(metric.timestamp)
-                )
+                    "CloudWatch: Attempting to publish %d datums to %s",
+                    len(chunk), namespace)
                 try:
                     self.connection.put_metric_data(
-                        str(rule['namespace']),
-                        str(rule['name']),
-                        str(metric.value),
-                        timestamp, str(rule['unit']),
-                        {'InstanceId': self.instance_id})
-                    self.log.debug(
-                        "CloudWatch: Successfully published metric: %s to"
-                        " %s with value (%s)",
-                        rule['name'],
-                        rule['namespace'],
-                        str(metric.value)
-                    )
+                        namespace,
+                        [key[1] for key, datum in chunk],
+                        timestamp=[datetime.datetime.utcfromtimestamp(key[3])
+                                   for key, datum in chunk],
+                        unit=[key[2] for key, datum in chunk],
+                        dimensions=[dimensions] * len(chunk),
+                        statistics=[datum for key, datum in chunk])
                 except AttributeError, e:
                     self.log.error(
                         "CloudWatch: Failed publishing - %s ", str(e))
@@ -4,9 +4,9 @@ Operations and Development teams who write and run applications
 at scale, and want to turn the massive amounts of data produced
 by their apps, tools and services into actionable insight.
 
-#### Dependencies
-
-  * [dogapi]
+Queued metrics are posted to the series API in as few requests as possible,
+with the points of each series grouped together. Payloads larger than
+`max_payload_size` bytes are split, and request bodies are gzip compressed.
 
 #### Configuration
 
@@ -16,39 +16,48 @@ Enable handler
 
   * api_key = DATADOG_API_KEY
 
-  * queue_size = [optional | 1]
+  * batch = [optional | 1] metrics to queue before posting, also read
+    from queue_size
 
 """
 
-from Handler import Handler
+from Handler import BatchingHandler
+from httpclient import HTTPClient
+import json
 import logging
+import urllib
 from collections import deque
 
-try:
-    import dogapi
-except ImportError:
-    dogapi = None
-
 
-class DatadogHandler(Handler):
+class DatadogHandler(BatchingHandler):
 
     def __init__(self, config=None):
         """
         New instance of DatadogHandler class
         """
 
-        Handler.__init__(self, config)
+        BatchingHandler.__init__(self, config)
         logging.debug("Initialized Datadog handler.")
 
-        if dogapi is None:
-            logging.error("Failed to load dogapi module.")
-            return
-
-        self.api = dogapi.dog_http_api
-        self.api.api_key = self.config.get('api_key', '')
-        self.queue_size = self.config.get('queue_size', 1)
+        self.api_key = self.config.get('api_key', '')
+        if self.config.get('queue_size'):
+            self.batch_size = int(self.config['queue_size'])
+        self.max_payload_size = int(self.config['max_payload_size'])
         self.queue = deque([])
 
+        self.client = HTTPClient(
+            '%s?%s' % (self.config['url'],
+                       urllib.urlencode({'api_key': self.api_key})),
+            timeout=self.config['timeout'],
+            compress=str(self.config['compress']) == 'True',
+            retries=self.config['retries'],
+            max_in_flight=self.config['max_in_flight'],
+            headers={'Content-Type': 'application/json'},
+            log=self.log)
+
+        # Datadog metric names, by metric path
+        self.names = {}
+
     def get_default_config_help(self):
         """
         Help text
@@ -57,7 +66,13 @@ class DatadogHandler(Handler):
 
         config.update({
             'api_key': '',
-            'queue_size': '',
+            'queue_size': 'Same as batch',
+            'url': 'Datadog series API endpoint',
+            'max_payload_size': 'Split payloads larger than this many bytes',
+            'compress': 'gzip request bodies',
+            'timeout': 'HTTP timeout in seconds',
+            'retries': 'How many times to retry a failed request',
+            'max_in_flight': 'How many requests to send concurrently',
         })
 
         return config
@@ -71,46 +86,81 @@ class DatadogHandler(Handler):
         config.update({
             'api_key': '',
             'queue_size': '',
+            'url': 'https://app.datadoghq.com/api/v1/series',
+            'max_payload_size': 1000000,
+            'compress': True,
+            'timeout': 15,
+            'retries': 2,
+            'max_in_flight': 1,
         })
 
         return config
 
-    def process(self, metric):
-        """
-        Process metric by sending it to datadog api
-        """
-
-        self.queue.append(metric)
-        if len(self.queue) >= self.queue_size:
-            self._send()
+    def __del__(self):
+        self.client.close()
 
-    def flush(self):
+    def add(self, metric):
         """
-        Flush metrics
+        Queue a metric
         """
+        self.queue.append(metric)
+        return 0
 
-        self._send()
-
-    def _send(self):
+    def _get_name(self, metric):
         """
-        Take metrics from queue and send it to Datadog API
+        Returns the datadog metric name, the path without the hostname
         """
-
-        while len(self.queue) > 0:
-            metric = self.queue.popleft()
-
-            path = '%s.%s.%s' % (
+        name = self.names.get(metric.path)
+        if name is None:
+            name = '%s.%s.%s' % (
                 metric.getPathPrefix(),
                 metric.getCollectorPath(),
                 metric.getMetricPath()
             )
+            self.names[metric.path] = name
+        return name
 
-            topic, value, timestamp = str(metric).split()
-            logging.debug(
-                "Sending.. topic[%s], value[%s], timestamp[%s]",
-                path,
-                value,
-                timestamp
-            )
-
-            self.api.metric(path, (timestamp, value), host=metric.host)
+    def take(self):
+        """
+        Group the queued points per series and return the json encoded
+        series payloads, each at most max_payload_size bytes when possible
+        """
+        series = {}
+        order = []
+        while len(self.queue) > 0:
+            metric = self.queue.popleft()
+            key = (metric.path, metric.host, metric.tags)
+            points = series.get(key)
+            if points is None:
+                points = series[key] = []
+                order.append((key, metric))
+            points.append([metric.timestamp, metric.value])
+
+        payloads = []
+        chunk = []
+        size = 0
+        for key, metric in order:
+            data = {
+                'metric': self._get_name(metric),
+                'points': series[key],
+                'type': 'gauge',
+                'host': metric.host,
+            }
+            if metric.tags:
+                data['tags'] = ['%s:%s' % tag for tag in metric.tags]
+            encoded = json.dumps(data, separators=(',', ':'))
+            if chunk and size + len(encoded) + 1 > self.max_payload_size:
+                payloads.append('{"series":[%s]}' % ','.join(chunk))
+                chunk = []
+                size = 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk:
+            payloads.append('{"series":[%s]}' % ','.join(chunk))
+        return payloads
+
+    def send(self, payload):
+        """
+        Post a series payload to the Datadog API
+        """
+        self.client.submit(payload)
@@ -3,14 +3,16 @@
 """
 Emulate a gmetric client for usage with
 [Ganglia Monitoring System](http://ganglia.sourceforge.net/)
+
+The metadata packet of a metric is packed once and sent again every
+`metadata_interval` seconds, instead of before every value. Value packets
+are built from a cached per metric header and sent in batches of `batch`
+packets, and on flush.
 """
 
 from Handler import Handler
-import logging
-try:
-    import gmetric
-except ImportError:
-    gmetric = None
+from diamond import gmetric
+import time
 
 
 class GmetricHandler(Handler):
@@ -26,10 +28,6 @@ class GmetricHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config)
 
-        if gmetric is None:
-            logging.error("Failed to load gmetric module")
-            return
-
         # Initialize Data
         self.socket = None
 
@@ -39,6 +37,15 @@ class GmetricHandler(Handler):
         self.protocol = self.config['protocol']
         if not self.protocol:
             self.protocol = 'udp'
+        self.batch_size = int(self.config['batch'])
+        self.metadata_interval = float(self.config['metadata_interval'])
+
+        # Packed metadata and the time it was last sent, by metric name
+        self.metadata = {}
+        # Packed value packet headers, by metric name
+        self.headers = {}
+        # Packets waiting to be sent
+        self.packets = []
 
         # Initialize
         self.gmetric = gmetric.Gmetric(self.host, self.port, self.protocol)
@@ -52,7 +59,10 @@ class GmetricHandler(Handler):
         config.update({
             'host': 'Hostname',
             'port': 'Port',
-            'protocol': 'udp or tcp',
+            'protocol': 'udp or multicast',
+            'batch': 'How many packets to send at once',
+            'metadata_interval': 'Seconds between two metadata packets of '
+                                 'a metric',
         })
 
         return config
@@ -67,6 +77,8 @@ class GmetricHandler(Handler):
             'host': 'localhost',
             'port': 8651,
             'protocol': 'udp',
+            'batch': 100,
+            'metadata_interval': 300,
         })
 
         return config
@@ -79,34 +91,62 @@ class GmetricHandler(Handler):
 
     def process(self, metric):
         """
-        Process a metric by sending it to a gmond instance
+        Process a metric by queueing its packets for a gmond instance
         """
-        # Just send the data as a string
-        self._send(metric)
+        metric_name = metric.path
+        now = time.time()
+
+        metadata = self.metadata.get(metric_name)
+        if metadata is None or now - metadata[1] >= self.metadata_interval:
+            if metadata is None:
+                tmax = "60"
+                dmax = "0"
+                slope = "both"
+                # FIXME: Badness, shouldn't *assume* double type
+                metric_type = "double"
+                units = ""
+                group = ""
+                packet = gmetric.gmetric_write_meta(metric_name,
+                                                    metric_type,
+                                                    units,
+                                                    slope,
+                                                    tmax,
+                                                    dmax,
+                                                    group)
+                self.headers[metric_name] = gmetric.gmetric_value_header(
+                    metric_name)
+            else:
+                packet = metadata[0]
+            self.metadata[metric_name] = (packet, now)
+            self.packets.append(packet)
+
+        self.packets.append(gmetric.gmetric_write_value(
+            self.headers[metric_name], metric.value))
+        if len(self.packets) >= self.batch_size:
+            self._send()
+
+    def flush(self):
+        """
+        Send the queued packets
+        """
+        self._send()
 
-    def _send(self, metric):
+    def _send(self):
         """
         Send data to gmond.
         """
-        metric_name = self.get_name_from_path(metric.path)
-        tmax = "60"
-        dmax = "0"
-        slope = "both"
-        # FIXME: Badness, shouldn't *assume* double type
-        metric_type = "double"
-        units = ""
-        group = ""
-        self.gmetric.send(metric_name,
-                          metric.value,
-                          metric_type,
-                          units,
-                          slope,
-                          tmax,
-                          dmax,
-                          group)
+        if self.gmetric is None:
+            return
+        packets, self.packets = self.packets, []
+        sock = self.gmetric.socket
+        hostport = self.gmetric.hostport
+        for packet in packets:
+            sock.sendto(packet, hostport)
 
     def _close(self):
         """
         Close the connection
         """
+        if getattr(self, 'gmetric', None) is not None:
+            self.gmetric.socket.close()
         self.gmetric = None
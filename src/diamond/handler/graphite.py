@@ -14,6 +14,11 @@ the e-commerce monitoring system. Today many
 [large companies](http://graphite.readthedocs.org/en/latest/who-is-using.html)
 use it.
 
+Metric tags are not part of the graphite path. To add them, set
+`tags_template` to a format string using `{path}`, any tag name, and `{tags}`
+for the graphite 1.1 `;name=value` form, e.g. `{path}{tags}`. Metrics lacking
+a tag of the template are sent with their plain path.
+
 """
 
 from Handler import Handler
@@ -49,6 +54,9 @@ class GraphiteHandler(Handler):
             self.config['trim_backlog_multiplier'])
         self.flow_info = self.config['flow_info']
         self.scope_id = self.config['scope_id']
+        self.tags_template = self.config['tags_template']
+        # (path, tags) -> flattened path
+        self.tagged_paths = {}
         self.metrics = []
 
         # Connect
@@ -72,6 +80,9 @@ class GraphiteHandler(Handler):
             'keepaliveinterval': 'How frequently to send keepalives',
             'flow_info': 'IPv6 Flow Info',
             'scope_id': 'IPv6 Scope ID',
+            'tags_template': ('Format of the path of tagged metrics, using '
+                              '{path}, {tags} and tag names. Empty to '
+                              'ignore tags'),
         })
 
         return config
@@ -94,6 +105,7 @@ class GraphiteHandler(Handler):
             'keepaliveinterval': 10,
             'flow_info': 0,
             'scope_id': 0,
+            'tags_template': '',
         })
 
         return config
@@ -109,10 +121,36 @@ class GraphiteHandler(Handler):
         Process a metric by sending it to graphite
         """
         # Append the data to the array as a string
-        self.metrics.append(str(metric))
+        line = str(metric)
+        path = self._get_path(metric)
+        if path is not metric.path:
+            line = path + line[len(metric.path):]
+        self.metrics.append(line)
         if len(self.metrics) >= self.batch_size:
             self._send()
 
+    def _get_path(self, metric):
+        """
+        Returns the path of a metric with its tags flattened by tags_template
+        """
+        if not self.tags_template or not metric.tags:
+            return metric.path
+
+        key = (metric.path, metric.tags)
+        path = self.tagged_paths.get(key)
+        if path is None:
+            fields = dict(metric.tags)
+            fields['path'] = metric.path
+            fields['tags'] = ''.join(';%s=%s' % tag for tag in metric.tags)
+            try:
+                path = self.tags_template.format(**fields)
+            except (KeyError, IndexError):
+                path = metric.path
+            if len(self.tagged_paths) >= 100000:
+                self.tagged_paths.clear()
+            self.tagged_paths[key] = path
+        return path
+
     def flush(self):
         """Flush metrics in queue"""
         self._send()
@@ -124,6 +162,7 @@ class GraphiteHandler(Handler):
         try:
             self.socket.sendall(data)
             self._reset_errors()
+            self._record_success()
         except:
             self._close()
             self._throttle_error("GraphiteHandler: Socket error, "
@@ -132,8 +171,10 @@ class GraphiteHandler(Handler):
             try:
                 self.socket.sendall(data)
             except:
+                self._record_failure()
                 return
             self._reset_errors()
+            self._record_success()
 
     def _send(self):
         """
@@ -191,6 +232,7 @@ class GraphiteHandler(Handler):
                 self.log.error("GraphiteHandler: Error looking up graphite host"
                                " '%s' - %s",
                                self.host, ex)
+                self._record_failure()
                 return
             if (len(addrinfo) > 0):
                 family = addrinfo[0][0]
@@ -230,6 +272,7 @@ class GraphiteHandler(Handler):
             # Log Error
             self._throttle_error("GraphiteHandler: Failed to connect to "
                                  "%s:%i. %s.", self.host, self.port, ex)
+            self._record_failure()
             # Close Socket
             self._close()
             return
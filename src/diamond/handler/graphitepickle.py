@@ -73,7 +73,7 @@ class GraphitePickleHandler(GraphiteHandler):
 
     def process(self, metric):
         # Convert metric to pickle format
-        m = (metric.path, (metric.timestamp, metric.value))
+        m = (self._get_path(metric), (metric.timestamp, metric.value))
         # Add the metric to the match
         self.batch.append(m)
         # If there are sufficient metrics, then pickle and send
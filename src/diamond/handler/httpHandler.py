@@ -4,32 +4,35 @@
 """
 Send metrics to a http endpoint via POST
 
-#### Dependencies
-
- * urllib2
-
-
 #### Configuration
 Enable this handler
 
  * handlers = diamond.handler.httpHandler.HttpPostHandler
 
  * url = http://www.example.com/endpoint
+ * compress = [optional | False] gzip request bodies
+ * max_in_flight = [optional | 1] concurrent requests, sent in the
+     background when more than 1
 
 """
 
-from Handler import Handler
-import urllib2
+from Handler import BatchingHandler
+from httpclient import HTTPClient
 
 
-class HttpPostHandler(Handler):
+class HttpPostHandler(BatchingHandler):
 
     # Inititalize Handler with url and batch size
     def __init__(self, config=None):
-        Handler.__init__(self, config)
-        self.metrics = []
-        self.batch_size = int(self.config['batch'])
+        BatchingHandler.__init__(self, config)
         self.url = self.config.get('url')
+        self.client = HTTPClient(
+            self.url,
+            timeout=self.config['timeout'],
+            compress=str(self.config['compress']) == 'True',
+            retries=self.config['retries'],
+            max_in_flight=self.config['max_in_flight'],
+            log=self.log)
 
     def get_default_config_help(self):
         """
@@ -40,6 +43,10 @@ class HttpPostHandler(Handler):
         config.update({
             'url': 'Fully qualified url to send metrics to',
             'batch': 'How many to store before sending to the graphite server',
+            'timeout': 'HTTP timeout in seconds',
+            'compress': 'gzip request bodies',
+            'retries': 'How many times to retry a failed request',
+            'max_in_flight': 'How many requests to send concurrently',
         })
 
         return config
@@ -53,22 +60,21 @@ class HttpPostHandler(Handler):
         config.update({
             'url': 'http://localhost/blah/blah/blah',
             'batch': 100,
+            'timeout': 15,
+            'compress': False,
+            'retries': 2,
+            'max_in_flight': 1,
         })
 
         return config
 
     # Join batched metrics and push to url mentioned in config
-    def process(self, metric):
-        self.metrics.append(str(metric))
-        if len(self.metrics) >= self.batch_size:
-            self.post()
-
-    # Overriding flush to post metrics for every collector.
-    def flush(self):
-        """Flush metrics in queue"""
-        self.post()
-
-    def post(self):
-        req = urllib2.Request(self.url, "\n".join(self.metrics))
-        urllib2.urlopen(req)
-        self.metrics = []
+    def take(self):
+        items, self.items = self.items, []
+        return ["\n".join(items)]
+
+    def send(self, body):
+        self.client.submit(body)
+
+    def __del__(self):
+        self.client.close()
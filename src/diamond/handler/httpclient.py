@@ -0,0 +1,211 @@
+# coding=utf-8
+
+"""
+HTTP client shared by the handlers posting metrics over HTTP.
+
+Connections are kept alive and pooled per endpoint, so a handler pays the TCP
+and TLS handshakes once instead of once per batch. Request bodies can be gzip
+compressed, failed requests are retried with an exponential backoff, and
+requests may be sent from a few background threads so that a slow endpoint
+does not block the handler process.
+"""
+
+import base64
+import httplib
+import logging
+import Queue
+import socket
+import threading
+import time
+import urlparse
+import zlib
+
+
+class HTTPClientError(Exception):
+    """
+    Raised when a request still fails after all retries
+    """
+
+    def __init__(self, message, status=None, body=None):
+        Exception.__init__(self, message)
+        self.status = status
+        self.body = body
+
+
+class HTTPResponse(object):
+
+    def __init__(self, status, reason, body, headers):
+        self.status = status
+        self.reason = reason
+        self.body = body
+        self.headers = headers
+
+
+class HTTPClient(object):
+    """
+    Keep-alive HTTP(S) client with compression, retries and optional
+    concurrent requests
+    """
+
+    def __init__(self, url=None, timeout=15, compress=False, retries=2,
+                 backoff=0.5, max_in_flight=1, headers=None,
+                 username=None, password=None, log=None):
+        self.url = url
+        self.timeout = float(timeout)
+        self.compress = compress
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.headers = dict(headers or {})
+        if username:
+            self.headers['Authorization'] = 'Basic %s' % base64.b64encode(
+                '%s:%s' % (username, password or ''))
+        self.log = log or logging.getLogger('diamond')
+
+        # Idle connections, by (scheme, netloc)
+        self.pool = {}
+        self.pool_lock = threading.Lock()
+
+        # Background senders, only used when max_in_flight > 1
+        self.requests = None
+        self.workers = []
+
+    def _get_connection(self, scheme, netloc, pooled=True):
+        if pooled:
+            with self.pool_lock:
+                idle = self.pool.get((scheme, netloc))
+                if idle:
+                    return idle.pop(), True
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release_connection(self, scheme, netloc, connection):
+        with self.pool_lock:
+            self.pool.setdefault((scheme, netloc), []).append(connection)
+
+    def request(self, method, url=None, body=None, headers=None):
+        """
+        Send a request, retrying failures, and return the HTTPResponse.
+        Raises HTTPClientError once the retries are exhausted.
+        """
+        url = urlparse.urlsplit(url or self.url)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+        if body is not None and self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = compressor.compress(body) + compressor.flush()
+            request_headers['Content-Encoding'] = 'gzip'
+
+        attempt = 0
+        pooled = True
+        while True:
+            connection, reused = self._get_connection(url.scheme, url.netloc,
+                                                      pooled)
+            try:
+                connection.request(method, path, body, request_headers)
+                raw = connection.getresponse()
+                response = HTTPResponse(raw.status, raw.reason, raw.read(),
+                                        dict(raw.getheaders()))
+            except (httplib.HTTPException, socket.error, IOError), e:
+                connection.close()
+                error = HTTPClientError('%s %s://%s%s failed: %s' % (
+                    method, url.scheme, url.netloc, path, e))
+                # A pooled connection may have been closed by the server
+                # while idle, retry once on a new one right away. This is
+                # not one of the retries
+                if reused:
+                    pooled = False
+                    continue
+            else:
+                if response.headers.get('connection', '').lower() == 'close':
+                    connection.close()
+                else:
+                    self._release_connection(url.scheme, url.netloc,
+                                             connection)
+                if response.status < 500:
+                    if response.status >= 300:
+                        raise HTTPClientError(
+                            '%s %s://%s%s returned %d %s' % (
+                                method, url.scheme, url.netloc, path,
+                                response.status, response.body),
+                            status=response.status, body=response.body)
+                    return response
+                error = HTTPClientError('%s %s://%s%s returned %d %s' % (
+                    method, url.scheme, url.netloc, path, response.status,
+                    response.body), status=response.status,
+                    body=response.body)
+
+            if attempt >= self.retries:
+                raise error
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    def post(self, body, url=None, headers=None):
+        """
+        POST a body and return the HTTPResponse
+        """
+        return self.request('POST', url, body, headers)
+
+    def submit(self, body, url=None, headers=None):
+        """
+        POST a body from a background thread when max_in_flight > 1,
+        otherwise right away. Errors of background requests are logged.
+        """
+        if self.max_in_flight == 1:
+            return self.post(body, url, headers)
+
+        if self.requests is None:
+            self.requests = Queue.Queue(self.max_in_flight)
+            for i in range(self.max_in_flight):
+                worker = threading.Thread(target=self._worker,
+                                          args=(self.requests,))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+        # Blocks while max_in_flight requests are already waiting
+        self.requests.put((body, url, headers))
+
+    def _worker(self, requests):
+        while True:
+            item = requests.get()
+            try:
+                if item is None:
+                    return
+                try:
+                    self.post(*item)
+                except HTTPClientError, e:
+                    self.log.error('HTTPClient: %s', e)
+                except Exception, e:
+                    # Keep serving, submit() blocks once all workers died
+                    self.log.exception('HTTPClient: %s', e)
+            finally:
+                requests.task_done()
+
+    def join(self):
+        """
+        Wait for all submitted requests to complete
+        """
+        if self.requests is not None:
+            self.requests.join()
+
+    def close(self):
+        """
+        Stop the background senders and close all connections
+        """
+        if self.requests is not None:
+            self.join()
+            for worker in self.workers:
+                self.requests.put(None)
+            self.requests = None
+            self.workers = []
+        with self.pool_lock:
+            for connections in self.pool.values():
+                for connection in connections:
+                    connection.close()
+            self.pool = {}
@@ -9,9 +9,11 @@ v1.1 : force influxdb driver with SSL
 v1.2 : added a timer to delay influxdb writing in case of failure
        this whill avoid the 100% cpu loop when influx in not responding
        Sebastien Prune THOMAS - prune@lecentre.net
+v1.3 : native line protocol writer (influxdb >= 0.9) with gzip compressed
+       batches over a persistent http connection and path templates
 
 - Dependency:
-    - influxdb client (pip install influxdb)
+    - influxdb client (pip install influxdb), only for protocol = json
       you need version > 0.1.6 for HTTPS (not yet released)
 
 - enable it in `diamond.conf` :
@@ -24,21 +26,118 @@ handlers = diamond.handler.influxdbHandler.InfluxdbHandler
 hostname = localhost
 port = 8086 #8084 for HTTPS
 batch_size = 100 # default to 1
+batch_interval = 10 # default to 0, send as soon as batch_size is reached
 cache_size = 1000 # default to 20000
 username = root
 password = root
 database = graphite
 time_precision = s
+protocol = line # default to json (influxdb < 0.9)
+compress = True
+
+- line protocol templates :
+
+Templates map the dotted metric path to a measurement, a field and tags,
+using the same syntax as the influxdb graphite input. Each template is an
+optional filter followed by the template itself. The first template whose
+filter matches the path is used. A path that matches no template is written
+as measurement = path and field = value.
+
+Template parts are `measurement`, `field`, any tag name, or empty to skip the
+part. A trailing `*` on `measurement` or `field` consumes the rest of the path.
+
+templates = servers.*.cpu.* .host.measurement.cpu.field, .host.measurement*
+
+The tags the collector set on a metric are added to the tags of the template.
 """
 
+import math
 import time
+import urllib
 from Handler import Handler
+from httpclient import HTTPClient
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 try:
     from influxdb.client import InfluxDBClient
 except ImportError:
     InfluxDBClient = None
 
+# Multipliers from a timestamp in seconds to the line protocol precision
+_PRECISION_MULTIPLIERS = {
+    's': 1,
+    'ms': 1000,
+    'u': 1000000,
+    'n': 1000000000,
+}
+
+
+def _escape_measurement(value):
+    return value.replace(',', '\\,').replace(' ', '\\ ')
+
+
+def _escape_tag(value):
+    return value.replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+class InfluxdbTemplate(object):
+    """
+    Maps a dotted metric path to a line protocol series key and field name
+    """
+
+    def __init__(self, template, filter=None):
+        self.filter = None
+        if filter:
+            self.filter = filter.split('.')
+        self.parts = template.split('.')
+
+    def match(self, parts):
+        """
+        Return True if the filter matches the leading parts of the path
+        """
+        if self.filter is None:
+            return True
+        if len(parts) < len(self.filter):
+            return False
+        for expected, actual in zip(self.filter, parts):
+            if expected != '*' and expected != actual:
+                return False
+        return True
+
+    def apply(self, parts):
+        """
+        Returns (measurement, tags, field) for the given path parts
+        """
+        measurement = []
+        field = []
+        tags = []
+        for i, part in enumerate(self.parts):
+            if i >= len(parts):
+                break
+            if part == 'measurement*':
+                measurement.extend(parts[i:])
+                break
+            elif part == 'field*':
+                field.extend(parts[i:])
+                break
+            elif part == 'measurement':
+                measurement.append(parts[i])
+            elif part == 'field':
+                field.append(parts[i])
+            elif part:
+                tags.append((part, parts[i]))
+
+        if not measurement:
+            measurement = parts
+        if not field:
+            field = ['value']
+
+        return '.'.join(measurement), sorted(tags), '.'.join(field)
+
 
 class InfluxdbHandler(Handler):
     """
@@ -52,14 +151,17 @@ class InfluxdbHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config)
 
-        if not InfluxDBClient:
+        self.influx = None
+        self.protocol = self.config['protocol'].lower()
+
+        if self.protocol == 'json' and not InfluxDBClient:
             self.log.error('influxdb.client.InfluxDBClient import failed. '
                            'Handler disabled')
             self.enabled = False
             return
 
         # Initialize Options
-        if self.config['ssl'] == "True":
+        if str(self.config['ssl']) == "True":
             self.ssl = True
         else:
             self.ssl = False
@@ -69,14 +171,32 @@ class InfluxdbHandler(Handler):
         self.password = self.config['password']
         self.database = self.config['database']
         self.batch_size = int(self.config['batch_size'])
+        self.batch_interval = float(self.config['batch_interval'])
         self.metric_max_cache = int(self.config['cache_size'])
         self.batch_count = 0
         self.time_precision = self.config['time_precision']
+        self.compress = str(self.config['compress']) == 'True'
+        self.timeout = float(self.config['timeout'])
+        self.retries = int(self.config['retries'])
+
+        templates = self.config['templates']
+        if isinstance(templates, basestring):
+            templates = [templates]
+        self.templates = []
+        for template in templates:
+            template = template.split()
+            if len(template) == 1:
+                self.templates.append(InfluxdbTemplate(template[0]))
+            elif len(template) > 1:
+                self.templates.append(InfluxdbTemplate(template[1],
+                                                       filter=template[0]))
 
         # Initialize Data
         self.batch = {}
-        self.influx = None
+        self.buffer = StringIO()
+        self.series = {}
         self.batch_timestamp = time.time()
+        self.retry_timestamp = 0
         self.time_multiplier = 1
 
         # Connect
@@ -94,6 +214,8 @@ class InfluxdbHandler(Handler):
             'ssl': 'set to True to use HTTPS instead of http',
             'batch_size': 'How many metrics to store before sending to the'
             ' influxdb server',
+            'batch_interval': 'How many seconds to wait before sending a'
+            ' batch smaller than batch_size, 0 to disable',
             'cache_size': 'How many values to store in cache in case of'
             ' influxdb failure',
             'username': 'Username for connection',
@@ -101,6 +223,14 @@ class InfluxdbHandler(Handler):
             'database': 'Database name',
             'time_precision': 'time precision in second(s), milisecond(ms) or '
             'microsecond (u)',
+            'protocol': 'json for influxdb < 0.9 (requires the influxdb '
+            'client), line for the native line protocol',
+            'compress': 'gzip line protocol request bodies',
+            'timeout': 'HTTP timeout in seconds for the line protocol',
+            'retries': 'How many times to retry a failed line protocol '
+            'request before backing off',
+            'templates': 'line protocol templates mapping metric paths to '
+            'measurement, tags and field',
         })
 
         return config
@@ -119,8 +249,14 @@ class InfluxdbHandler(Handler):
             'password': 'root',
             'database': 'graphite',
             'batch_size': 1,
+            'batch_interval': 0,
             'cache_size': 20000,
             'time_precision': 's',
+            'protocol': 'json',
+            'compress': True,
+            'timeout': 15,
+            'retries': 0,
+            'templates': [],
         })
 
         return config
@@ -132,29 +268,85 @@ class InfluxdbHandler(Handler):
         self._close()
 
     def process(self, metric):
+        value = float(metric.value)
+        if math.isnan(value) or math.isinf(value):
+            # InfluxDB rejects the whole batch for one of these
+            self.log.debug("InfluxdbHandler: Skipping %s, its value is %r",
+                           metric.path, value)
+            return
+
         if self.batch_count <= self.metric_max_cache:
             # Add the data to the batch
-            self.batch.setdefault(metric.path, []).append([metric.timestamp,
-                                                           metric.value])
+            if self.protocol == 'line':
+                self._write_line(metric)
+            else:
+                self.batch.setdefault(metric.path, []).append(
+                    [metric.timestamp, metric.value])
             self.batch_count += 1
-        # If there are sufficient metrics, then pickle and send
-        if self.batch_count >= self.batch_size and (
-                time.time() - self.batch_timestamp) > 2**self.time_multiplier:
+
+        if self._should_send():
             # Log
             self.log.debug(
                 "InfluxdbHandler: Sending batch sizeof : %d/%d after %fs",
                 self.batch_count,
                 self.batch_size,
                 (time.time() - self.batch_timestamp))
-            # reset the batch timer
-            self.batch_timestamp = time.time()
-            # Send pickled batch
+            # Send batch
             self._send()
-        else:
-            self.log.debug(
-                "InfluxdbHandler: not sending batch of %d as timestamp is %f",
-                self.batch_count,
-                (time.time() - self.batch_timestamp))
+
+    def flush(self):
+        """
+        Send the batch if it is older than batch_interval
+        """
+        if self.batch_interval > 0 and self._should_send():
+            self._send()
+
+    def _should_send(self):
+        """
+        Returns True when the batch is full or old enough, and we are not
+        waiting before retrying a failed send
+        """
+        if self.batch_count == 0:
+            return False
+        now = time.time()
+        if now < self.retry_timestamp:
+            return False
+        if self.batch_count >= self.batch_size:
+            return True
+        return (self.batch_interval > 0 and
+                now - self.batch_timestamp >= self.batch_interval)
+
+    def _get_series(self, metric):
+        """
+        Returns the cached line protocol series key and field for a path and
+        tag set
+        """
+        key = (metric.path, metric.tags)
+        series = self.series.get(key)
+        if series is None:
+            parts = metric.path.split('.')
+            measurement, tags, field = metric.path, [], 'value'
+            for template in self.templates:
+                if template.match(parts):
+                    measurement, tags, field = template.apply(parts)
+                    break
+            if metric.tags:
+                tags = sorted(dict(tags + list(metric.tags)).items())
+            line = _escape_measurement(measurement)
+            for tag, value in tags:
+                line += ',%s=%s' % (_escape_tag(tag), _escape_tag(value))
+            series = ('%s %s=' % (line, _escape_tag(field)),
+                      _PRECISION_MULTIPLIERS.get(self.time_precision, 1))
+            self.series[key] = series
+        return series
+
+    def _write_line(self, metric):
+        """
+        Append the line protocol representation of a metric to the buffer
+        """
+        prefix, multiplier = self._get_series(metric)
+        self.buffer.write('%s%r %d\n' % (prefix, float(metric.value),
+                                         metric.timestamp * multiplier))
 
     def _send(self):
         """
@@ -168,34 +360,63 @@ class InfluxdbHandler(Handler):
                 self._connect()
             if self.influx is None:
                 self.log.debug("InfluxdbHandler: Reconnect failed.")
+                self._backoff()
             else:
-                # build metrics data
-                metrics = []
-                for path in self.batch:
-                    metrics.append({
-                        "points": self.batch[path],
-                        "name": path,
-                        "columns": ["time", "value"]})
-                # Send data to influxdb
-                self.log.debug("InfluxdbHandler: writing %d series of data",
-                               len(metrics))
-                self.influx.write_points(metrics,
-                                         time_precision=self.time_precision)
+                if self.protocol == 'line':
+                    self._send_lines()
+                else:
+                    self._send_points()
 
                 # empty batch buffer
                 self.batch = {}
+                self.buffer = StringIO()
                 self.batch_count = 0
+                self.batch_timestamp = time.time()
+                self.retry_timestamp = 0
                 self.time_multiplier = 1
 
         except Exception:
             self._close()
-            if self.time_multiplier < 5:
-                self.time_multiplier += 1
+            self._backoff()
             self._throttle_error(
                 "InfluxdbHandler: Error sending metrics, waiting for %ds.",
                 2**self.time_multiplier)
             raise
 
+    def _backoff(self):
+        """
+        Wait exponentially longer, up to 32s, before the next send attempt
+        """
+        if self.time_multiplier < 5:
+            self.time_multiplier += 1
+        self.retry_timestamp = time.time() + 2**self.time_multiplier
+
+    def _send_points(self):
+        """
+        Write the batch with the pre 0.9 json series format
+        """
+        # build metrics data
+        metrics = []
+        for path in self.batch:
+            metrics.append({
+                "points": self.batch[path],
+                "name": path,
+                "columns": ["time", "value"]})
+        # Send data to influxdb
+        self.log.debug("InfluxdbHandler: writing %d series of data",
+                       len(metrics))
+        self.influx.write_points(metrics,
+                                 time_precision=self.time_precision)
+
+    def _send_lines(self):
+        """
+        Write the buffer to the /write endpoint with the line protocol
+        """
+        body = self.buffer.getvalue()
+        self.log.debug("InfluxdbHandler: writing %d lines in %d bytes",
+                       self.batch_count, len(body))
+        self.influx.post(body)
+
     def _connect(self):
         """
         Connect to the influxdb server
@@ -203,9 +424,27 @@ class InfluxdbHandler(Handler):
 
         try:
             # Open Connection
-            self.influx = InfluxDBClient(self.hostname, self.port,
-                                         self.username, self.password,
-                                         self.database, self.ssl)
+            if self.protocol == 'line':
+                if self.ssl:
+                    scheme = 'https'
+                else:
+                    scheme = 'http'
+                self.influx = HTTPClient(
+                    '%s://%s:%d/write?%s' % (
+                        scheme, self.hostname, self.port,
+                        urllib.urlencode({'db': self.database,
+                                          'precision': self.time_precision})),
+                    timeout=self.timeout,
+                    compress=self.compress,
+                    retries=self.retries,
+                    headers={'Content-Type': 'text/plain; charset=utf-8'},
+                    username=self.username,
+                    password=self.password,
+                    log=self.log)
+            else:
+                self.influx = InfluxDBClient(self.hostname, self.port,
+                                             self.username, self.password,
+                                             self.database, self.ssl)
             # Log
             self.log.debug("InfluxdbHandler: Established connection to "
                            "%s:%d/%s.",
@@ -221,6 +460,8 @@ class InfluxdbHandler(Handler):
 
     def _close(self):
         """
-        Close the socket = do nothing for influx which is http stateless
+        Close the http connection, the json client is stateless
         """
+        if self.protocol == 'line' and self.influx is not None:
+            self.influx.close()
         self.influx = None
@@ -32,9 +32,8 @@ Enable this handler
 
 """
 
-from Handler import Handler
+from Handler import BatchingHandler
 import logging
-import time
 import re
 
 try:
@@ -43,28 +42,27 @@ except ImportError:
     librato = None
 
 
-class LibratoHandler(Handler):
+class LibratoHandler(BatchingHandler):
 
     def __init__(self, config=None):
         """
         Create a new instance of the LibratoHandler class
         """
         # Initialize Handler
-        Handler.__init__(self, config)
+        BatchingHandler.__init__(self, config)
         logging.debug("Initialized Librato handler.")
 
         if librato is None:
             logging.error("Failed to load librato module")
+            self.enabled = False
             return
 
         # Initialize Options
-        api = librato.connect(self.config['user'],
-                              self.config['apikey'])
-        self.queue = api.new_queue()
-        self.queue_max_size = int(self.config['queue_max_size'])
-        self.queue_max_interval = int(self.config['queue_max_interval'])
-        self.queue_max_timestamp = int(time.time() + self.queue_max_interval)
-        self.current_n_measurements = 0
+        self.api = librato.connect(self.config['user'],
+                                   self.config['apikey'])
+        self.queue = self.api.new_queue()
+        self.batch_size = int(self.config['queue_max_size'])
+        self.batch_max_interval = float(self.config['queue_max_interval'])
 
         # If a user leaves off the ending comma, cast to a array for them
         include_filters = self.config['include_filters']
@@ -105,43 +103,39 @@ class LibratoHandler(Handler):
 
         return config
 
-    def process(self, metric):
+    def add(self, metric):
         """
-        Process a metric by sending it to Librato
+        Queue a measurement for Librato
         """
         path = metric.getCollectorPath()
         path += '.'
         path += metric.getMetricPath()
 
-        if self.include_reg.match(path):
-            if metric.metric_type == 'GAUGE':
-                m_type = 'gauge'
-            else:
-                m_type = 'counter'
-            self.queue.add(path,                # name
-                           float(metric.value),  # value
-                           type=m_type,
-                           source=metric.host,
-                           measure_time=metric.timestamp)
-            self.current_n_measurements += 1
-        else:
+        if not self.include_reg.match(path):
             self.log.debug("LibratoHandler: Skip %s, no include_filters match",
                            path)
+            return None
 
-        if (self.current_n_measurements >= self.queue_max_size or
-                time.time() >= self.queue_max_timestamp):
-            self.log.debug("LibratoHandler: Sending batch size: %d",
-                           self.current_n_measurements)
-            self._send()
-
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
+        if metric.metric_type == 'GAUGE':
+            m_type = 'gauge'
+        else:
+            m_type = 'counter'
+        self.queue.add(path,                # name
+                       float(metric.value),  # value
+                       type=m_type,
+                       source=metric.host,
+                       measure_time=metric.timestamp)
+        return 0
+
+    def take(self):
+        """
+        Returns the queue of measurements, and starts a new one
+        """
+        queue, self.queue = self.queue, self.api.new_queue()
+        return [queue]
 
-    def _send(self):
+    def send(self, queue):
         """
         Send data to Librato.
         """
-        self.queue.submit()
-        self.queue_max_timestamp = int(time.time() + self.queue_max_interval)
-        self.current_n_measurements = 0
+        queue.submit()
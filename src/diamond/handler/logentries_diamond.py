@@ -21,8 +21,9 @@ Enable this handler
 """
 
 from Handler import Handler
+from httpclient import HTTPClient
+from httpclient import HTTPClientError
 import logging
-import urllib2
 import json
 from collections import deque
 
@@ -43,6 +44,10 @@ class LogentriesDiamondHandler(Handler):
         self.queue = deque([])
         if self.log_token is None:
             raise Exception
+        self.client = HTTPClient(
+            "https://js.logentries.com/v1/logs/" + self.log_token,
+            timeout=self.config['timeout'],
+            log=self.log)
 
     def get_default_config_help(self):
         """
@@ -53,7 +58,8 @@ class LogentriesDiamondHandler(Handler):
 
         config.update({
             'log_token': '',
-            'queue_size': ''
+            'queue_size': '',
+            'timeout': 'HTTP timeout in seconds',
         })
 
         return config
@@ -66,7 +72,8 @@ class LogentriesDiamondHandler(Handler):
 
         config.update({
             'log_token': '',
-            'queue_size': 100
+            'queue_size': 100,
+            'timeout': 15,
         })
 
         return config
@@ -89,9 +96,11 @@ class LogentriesDiamondHandler(Handler):
             metric = self.queue.popleft()
             topic, value, timestamp = str(metric).split()
             msg = json.dumps({"event": {topic: value}})
-            req = urllib2.Request("https://js.logentries.com/v1/logs/" +
-                                  self.log_token, msg)
             try:
-                urllib2.urlopen(req)
-            except urllib2.URLError, e:
+                self.client.post(msg)
+            except HTTPClientError, e:
                 logging.error("Can't send log message to Logentries %s", e)
+
+    def __del__(self):
+        if hasattr(self, 'client'):
+            self.client.close()
@@ -0,0 +1,55 @@
+# coding=utf-8
+
+"""
+Packing of metric lines into newline delimited messages, for the handlers
+publishing to message buses.
+"""
+
+
+class MessageBatch(object):
+    """
+    Metric lines, ending with a newline, grouped by routing key or topic.
+    A message holds at most max_bytes bytes, unless a single line is larger.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        # Lines and their size, by key, and the keys in order of first use
+        self.lines = {}
+        self.sizes = {}
+        self.keys = []
+
+    def add(self, key, line):
+        """
+        Add a line to the message of a key. Returns the message that was
+        full and is ready to be published, or None.
+        """
+        size = len(line)
+        lines = self.lines.get(key)
+        if lines is None:
+            self.lines[key] = [line]
+            self.sizes[key] = size
+            self.keys.append(key)
+            return None
+        if self.sizes[key] + size > self.max_bytes:
+            message = ''.join(lines)
+            self.lines[key] = [line]
+            self.sizes[key] = size
+            return message
+        lines.append(line)
+        self.sizes[key] += size
+        return None
+
+    def drain(self):
+        """
+        Returns a list of (key, message) of all pending messages, and
+        empties the batch
+        """
+        messages = [(key, ''.join(self.lines[key])) for key in self.keys]
+        self.lines = {}
+        self.sizes = {}
+        self.keys = []
+        return messages
+
+    def __len__(self):
+        return len(self.lines)
@@ -30,6 +30,13 @@ a `diamond.conf` containing something along these lines:
         # MQTT broker
         prefix = some/pre/fix       (default: "")
 
+        # Publish all metrics as newline delimited "path value timestamp"
+        # lines to a single topic, in messages of up to batch_max_bytes,
+        # instead of one message per metric topic
+        batch = True        (default: False)
+        batch_topic = diamond/batch (default: diamond/<hostname>)
+        batch_max_bytes = 131072
+
         # If you want to connect to your MQTT broker with TLS, you'll have
         # to set the following four parameters
         tls = True          (default: False)
@@ -55,11 +62,13 @@ which subscribes to an MQTT broker and sends metrics off to Graphite.
 * This handler sets a last will and testament, so that the broker
   publishes its death at a topic called clients/diamond/<hostname>
 * Support for reconnecting to a broker is implemented and ought to
-  work.
+  work. Batch messages that could not be published are kept and
+  published again.
 
 """
 
 from Handler import Handler
+from messagebatch import MessageBatch
 from diamond.collector import get_hostname
 import os
 HAVE_SSL = True
@@ -99,6 +108,15 @@ class MQTTHandler(Handler):
         self.qos = int(self.config.get('qos', 0))
         self.prefix = self.config.get('prefix', "")
         self.tls = self.config.get('tls', False)
+        self.batch_mode = str(self.config.get('batch', False)) == 'True'
+        self.batch = MessageBatch(self.config.get('batch_max_bytes', 131072))
+        self.batch_topic = self.config.get('batch_topic',
+                                           'diamond/%s' % self.hostname)
+        if len(self.prefix):
+            self.batch_topic = "%s/%s" % (self.prefix, self.batch_topic)
+        self.max_pending = int(self.config.get('max_pending', 100))
+        # Batch messages not published yet
+        self.pending = []
         self.timestamp = 0
         try:
             self.timestamp = self.config['timestamp']
@@ -182,6 +200,12 @@ class MQTTHandler(Handler):
             return
 
         line = str(metric)
+        if self.batch_mode:
+            message = self.batch.add(self.batch_topic, line)
+            if message is not None:
+                self._publish_batch([message])
+            return
+
         topic, value, timestamp = line.split()
         if len(self.prefix):
             topic = "%s/%s" % (self.prefix, topic)
@@ -193,6 +217,34 @@ class MQTTHandler(Handler):
         else:
             self.mqttc.publish(topic, "%s %s" % (value, timestamp), self.qos)
 
+    def flush(self):
+        """
+        Publish the pending batch message
+        """
+        if mosquitto and self.batch_mode:
+            self._publish_batch([message for topic, message
+                                 in self.batch.drain()])
+
+    def _publish_batch(self, messages):
+        """
+        Publish batch messages, keeping those the client did not accept
+        """
+        pending = self.pending + messages
+        while pending:
+            rc, mid = self.mqttc.publish(self.batch_topic, pending[0],
+                                         self.qos)
+            if rc != mosquitto.MOSQ_ERR_SUCCESS:
+                self.log.debug("MQTTHandler: publish failed (%d), keeping %d "
+                               "messages", rc, len(pending))
+                break
+            pending.pop(0)
+
+        if len(pending) > self.max_pending:
+            self.log.warning("MQTTHandler: Dropping %d messages",
+                             len(pending) - self.max_pending)
+            del pending[:len(pending) - self.max_pending]
+        self.pending = pending
+
     def _disconnect(self, mosq, obj, rc):
 
         self.log.debug("MQTTHandler: reconnecting to broker...")
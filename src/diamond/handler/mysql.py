@@ -2,10 +2,43 @@
 
 """
 Insert the collected values into a mysql table
+
+Metrics are buffered and written with multi-row inserts, `batch` rows at a
+time or every `batch_max_interval` seconds, in one transaction per write.
+When the server is unreachable the pending rows are kept, up to
+`max_pending` rows, and written once the connection is back.
+
+#### Dependencies
+
+ * MySQLdb
+
+#### Configuration
+
+Enable this handler
+
+ * handlers = diamond.handler.mysql.MySQLHandler
+
+ * hostname, port, username, password, database
+ * table, col_time, col_metric, col_value = the table to insert into and the
+   names of its columns
+ * staging_table = [optional] an unindexed table with the same columns plus
+   `col_writer`. Rows are bulk inserted there, tagged with `staging_writer`
+   (the hostname by default), and every `staging_interval` seconds the rows
+   of this writer are moved into `table` with a single `INSERT ... SELECT`.
+   This lets `table` carry a (col_metric, col_time) index for time range
+   queries without slowing down every insert. Several agents can share the
+   staging table, each only moves its own rows.
+
 """
 
 from Handler import Handler
-import MySQLdb
+import socket
+import time
+
+try:
+    import MySQLdb
+except ImportError:
+    MySQLdb = None
 
 
 class MySQLHandler(Handler):
@@ -21,6 +54,11 @@ class MySQLHandler(Handler):
         # Initialize Handler
         Handler.__init__(self, config)
 
+        if MySQLdb is None:
+            self.log.error("MySQLHandler: Failed to load MySQLdb module")
+            self.enabled = False
+            return
+
         # Initialize Options
         self.hostname = self.config['hostname']
         self.port = int(self.config['port'])
@@ -28,9 +66,38 @@ class MySQLHandler(Handler):
         self.password = self.config['password']
         self.database = self.config['database']
         self.table = self.config['table']
+        self.staging_table = self.config['staging_table']
         self.col_time = self.config['col_time']
         self.col_metric = self.config['col_metric']
         self.col_value = self.config['col_value']
+        self.batch_size = int(self.config['batch'])
+        self.batch_max_interval = float(self.config['batch_max_interval'])
+        self.max_pending = int(self.config['max_pending'])
+        self.staging_writer = (self.config['staging_writer'] or
+                               socket.gethostname())
+        self.staging_interval = float(self.config['staging_interval'])
+        self.staging_timestamp = time.time()
+
+        columns = '%s, %s, %s' % (self.col_metric, self.col_time,
+                                  self.col_value)
+        if self.staging_table:
+            col_writer = self.config['col_writer']
+            self.insert_sql = (
+                "INSERT INTO %s (%s, %s) VALUES (%%s, %%s, %%s, %%s)" % (
+                    self.staging_table, columns, col_writer))
+            self.move_sql = (
+                "INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s = %%s" % (
+                    self.table, columns, columns, self.staging_table,
+                    col_writer))
+            self.clear_sql = "DELETE FROM %s WHERE %s = %%s" % (
+                self.staging_table, col_writer)
+        else:
+            self.insert_sql = "INSERT INTO %s (%s) VALUES (%%s, %%s, %%s)" % (
+                self.table, columns)
+
+        # Rows not written yet
+        self.rows = []
+        self.batch_timestamp = time.time()
 
         # Connect
         self._connect()
@@ -42,6 +109,27 @@ class MySQLHandler(Handler):
         config = super(MySQLHandler, self).get_default_config_help()
 
         config.update({
+            'hostname': 'MySQL server host',
+            'port': 'MySQL server port',
+            'username': '',
+            'password': '',
+            'database': '',
+            'table': 'Table to insert the metrics into',
+            'staging_table': 'Table to bulk insert into before moving the '
+                             'rows into table, empty to insert directly',
+            'staging_writer': 'Value of col_writer for the staged rows of '
+                              'this agent, defaults to the hostname',
+            'staging_interval': 'Seconds between moves of the staged rows '
+                                'into table',
+            'col_writer': 'Column of the staging table identifying the '
+                          'agent',
+            'col_time': 'Column of the metric timestamp',
+            'col_metric': 'Column of the metric path',
+            'col_value': 'Column of the metric value',
+            'batch': 'How many rows to insert at once',
+            'batch_max_interval': 'Insert the pending rows when they are '
+                                  'this many seconds old',
+            'max_pending': 'How many rows to keep while the server is down',
         })
 
         return config
@@ -53,6 +141,22 @@ class MySQLHandler(Handler):
         config = super(MySQLHandler, self).get_default_config()
 
         config.update({
+            'hostname': 'localhost',
+            'port': 3306,
+            'username': '',
+            'password': '',
+            'database': 'diamond',
+            'table': 'metrics',
+            'staging_table': '',
+            'staging_writer': '',
+            'staging_interval': 60,
+            'col_writer': 'writer',
+            'col_time': 'timestamp',
+            'col_metric': 'metric',
+            'col_value': 'value',
+            'batch': 500,
+            'batch_max_interval': 10,
+            'max_pending': 100000,
         })
 
         return config
@@ -67,43 +171,112 @@ class MySQLHandler(Handler):
         """
         Process a metric
         """
-        # Just send the data
-        self._send(str(metric))
+        self.rows.append((metric.path, metric.timestamp, metric.value))
+        if (len(self.rows) >= self.batch_size or
+                time.time() - self.batch_timestamp >= self.batch_max_interval):
+            self._send()
 
-    def _send(self, data):
+    def flush(self):
         """
-        Insert the data
+        Insert the pending rows, and move the staged ones when due
         """
-        data = data.strip().split(' ')
+        self._send()
+        if (self.staging_table and
+                time.time() - self.staging_timestamp >= self.staging_interval):
+            self._move_staged()
+
+    def _send(self):
+        """
+        Insert the pending rows in a single transaction
+        """
+        if not self.rows:
+            return
+        if self.conn is None:
+            self._connect()
+        if self.conn is None:
+            self._trim()
+            return
+
         try:
             cursor = self.conn.cursor()
-            cursor.execute("INSERT INTO %s (%s, %s, %s) VALUES(%%s, %%s, %%s)"
-                           % (self.table, self.col_metric,
-                              self.col_time, self.col_value),
-                           (data[0], data[2], data[1]))
-            cursor.close()
+            try:
+                # MySQLdb turns this into a single multi-row INSERT
+                if self.staging_table:
+                    cursor.executemany(self.insert_sql, [
+                        row + (self.staging_writer,) for row in self.rows])
+                else:
+                    cursor.executemany(self.insert_sql, self.rows)
+            finally:
+                cursor.close()
             self.conn.commit()
-        except BaseException, e:
+        except MySQLdb.Error, e:
             # Log Error
-            self.log.error("MySQLHandler: Failed sending data. %s.", e)
-            # Attempt to restablish connection
+            self._throttle_error("MySQLHandler: Failed sending data. %s.", e)
+            # Keep the rows and restablish the connection at the next write
+            self._close()
+            self._trim()
+            return
+
+        self.rows = []
+        self.batch_timestamp = time.time()
+
+    def _move_staged(self):
+        """
+        Move the staged rows of this writer into table, in one transaction
+        """
+        if self.conn is None:
             self._connect()
+        if self.conn is None:
+            return
+
+        try:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(self.move_sql, (self.staging_writer,))
+                cursor.execute(self.clear_sql, (self.staging_writer,))
+            finally:
+                cursor.close()
+            self.conn.commit()
+        except MySQLdb.Error, e:
+            self._throttle_error("MySQLHandler: Failed moving staged rows. "
+                                 "%s.", e)
+            self._close()
+            return
+
+        self.staging_timestamp = time.time()
+
+    def _trim(self):
+        """
+        Drop the oldest pending rows beyond max_pending
+        """
+        dropped = len(self.rows) - self.max_pending
+        if dropped > 0:
+            self.log.warning("MySQLHandler: Dropping %d pending rows", dropped)
+            del self.rows[:dropped]
 
     def _connect(self):
         """
         Connect to the MySQL server
         """
         self._close()
-        self.conn = MySQLdb.Connect(host=self.hostname,
-                                    port=self.port,
-                                    user=self.username,
-                                    passwd=self.password,
-                                    db=self.database)
+        try:
+            self.conn = MySQLdb.Connect(host=self.hostname,
+                                        port=self.port,
+                                        user=self.username,
+                                        passwd=self.password,
+                                        db=self.database)
+        except MySQLdb.Error, e:
+            self._throttle_error("MySQLHandler: Failed to connect to "
+                                 "%s:%d. %s", self.hostname, self.port, e)
 
     def _close(self):
         """
         Close the connection
         """
         if self.conn:
-            self.conn.commit()
-            self.conn.close()
+            try:
+                self.conn.rollback()
+                self.conn.close()
+            except MySQLdb.Error:
+                pass
+        self.conn = None
@@ -13,10 +13,6 @@ This handler will only work with OpenTSDB servers version >=2 as it uses the
 HTTP API introduced in OpenTSDB2. If you are using an earlier version, you
 may try TSDBHandler.
 
-#### Dependencies
-
- * [requests](http://docs.python-requests.org/)
-
 #### Configuration
 
 Enable this Handler
@@ -59,11 +55,13 @@ Enable this Handler
 """
 
 from Handler import Handler
-import requests
+from httpclient import HTTPClient
+from httpclient import HTTPClientError
 import json
 import random
 import re
 
+
 class OpenTSDBHandler(Handler):
     """
     Implements the abstract Handler class, sending data to opentsdb 2
@@ -102,11 +100,15 @@ class OpenTSDBHandler(Handler):
         # Parse regexes
         self.tagsinmetric = [re.compile(t) for t in tagsinmetric]
 
-        self.session = requests.Session()
+        self.client = HTTPClient(timeout=self.timeout, retries=0,
+                                 headers={'Content-Type': 'application/json'},
+                                 log=self.log)
         self.endpoints = ["http://%s/api/put" % h for h in servers]
         # Select one at random to be the main server
         self.mainep = random.randint(0, len(self.endpoints) - 1)
         self.batch = []
+        # (metric name, tags) by (path, host, tags)
+        self.series = {}
 
     def get_default_config_help(self):
         """
@@ -150,7 +152,27 @@ class OpenTSDBHandler(Handler):
         """
         Convert metric to OpenTSDB2 HTTP API format and send
         """
+        key = (metric.path, metric.host, metric.tags)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = self._get_series(metric)
+        metricname, tags = series
+
+        data = {
+            u"metric": metricname,
+            u"timestamp": metric.timestamp,
+            u"value": metric.value,
+            u"tags": tags,
+        }
+        self.batch.append(data)
+        if len(self.batch) >= self.batchsize:
+            self._send(self.batch)
+            self.batch = []
 
+    def _get_series(self, metric):
+        """
+        Returns the OpenTSDB metric name and tags of a series
+        """
         tags = {}
         if metric.host is not None:
             tags.update({'hostname': metric.host})
@@ -159,6 +181,7 @@ class OpenTSDBHandler(Handler):
             tags.update({'instance': mpp[1]})
         if mpp[0] == 'devices':
             tags.update({'device': mpp[1]})
+        tags.update(metric.tags)
         tags.update(self.tags)
         metricname = u'.'.join(mpp[2:])
         for rgx in self.tagsinmetric:
@@ -173,18 +196,9 @@ class OpenTSDBHandler(Handler):
         metricname = self.COLONS.sub("_", metricname)
         # Normalize any double dots
         metricname = self.DOTS.sub(".", metricname)
-        data = {
-            u"metric": metricname,
-            u"timestamp": metric.timestamp,
-            u"value": metric.value,
-            u"tags": tags,
-        }
-        self.batch.append(data)
-        if len(self.batch) >= self.batchsize:
-            self._send(self.batch)
-            self.batch = []
+        return metricname, tags
 
-    def _send(self, data, to = -1):
+    def _send(self, data, to=-1):
         """
         Send data to OpenTSDB2 server. Will try next server if main fails.
         """
@@ -195,26 +209,21 @@ class OpenTSDBHandler(Handler):
             return
         url = self.endpoints[to]
         try:
-            res = self.session.post(
-                url,
-                data = json.dumps(data),
-                timeout = self.timeout)
-            if res.status_code >= 400:
-                self.log.warning("OpenTSDBHandler: Server returns %d: %s" % (
-                    res.status_code, res.content))
-            # release the connection
-            rc = res.close()
-        except requests.ConnectionError, e:
-            self.log.error("OpenTSDBHandler: Failed sending, trying next. %s", e)
+            self.client.post(json.dumps(data), url=url)
+        except HTTPClientError, e:
+            if e.status is not None and e.status < 500:
+                self.log.warning("OpenTSDBHandler: Server returns %d: %s",
+                                 e.status, e.body)
+                return
+            self.log.error("OpenTSDBHandler: Failed sending, trying next. %s",
+                           e)
             self._send(data, (to + 1) % len(self.endpoints))
 
     def _close(self):
         """
-        Send remaining data and close the session
+        Send remaining data and close the connections
         """
         if len(self.batch) > 0:
             self._send(self.batch)
             self.batch = []
-        if self.session is not None:
-            self.session.close()
-        self.session = None
+        self.client.close()
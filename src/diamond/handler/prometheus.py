@@ -0,0 +1,325 @@
+# coding=utf-8
+
+"""
+Serve the latest value of each metric to [Prometheus](http://prometheus.io/)
+scrapes, in the text exposition format.
+
+The metric name is the collector and metric path joined with underscores,
+e.g. `servers.www1.cpu.total.idle` is exposed as
+`cpu_total_idle{host="www1"}`. Metric tags become labels. Histograms are
+exposed as summaries with the percentiles of the collector configuration. A
+series is dropped when it has not been updated for its ttl, see
+`ttl_multiplier` in the collector configuration.
+
+The exposition lines are cached and only rebuilt for series whose value
+changed since the last scrape. Scrapes are served by a thread of the
+handler process, and only hold the table lock while collecting the lines.
+
+#### Configuration
+
+Add `diamond.handler.prometheus.PrometheusHandler` to your handlers.
+It has these options:
+
+ * `listen_address` - Address to listen on. (default: `0.0.0.0`)
+ * `port` - Port to serve `/metrics` on. (default: `9108`)
+ * `namespace` - Prefix of all metric names, e.g. `diamond`. (default: none)
+
+"""
+
+from Handler import Handler
+from array import array
+import BaseHTTPServer
+import os
+import re
+import threading
+import time
+
+_INVALID_NAME_CHARS = re.compile('[^a-zA-Z0-9_:]')
+_INVALID_LABEL_CHARS = re.compile('[^a-zA-Z0-9_]')
+
+
+def _metric_name(name):
+    name = _INVALID_NAME_CHARS.sub('_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def _label_name(name):
+    name = _INVALID_LABEL_CHARS.sub('_', name)
+    if name[:1].isdigit():
+        name = '_' + name
+    return name
+
+
+def _label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(value)
+
+
+class _ScrapeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        chunks = self.server.exposition.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', sum(len(c) for c in chunks))
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        self.server.exposition.log.debug('PrometheusHandler: ' + format,
+                                         *args)
+
+
+class PrometheusHandler(Handler):
+
+    native_histograms = True
+
+    def __init__(self, config=None):
+        """
+        Create a new instance of the PrometheusHandler class
+        """
+        # Initialize Handler
+        Handler.__init__(self, config)
+
+        self.listen_address = self.config['listen_address']
+        self.port = int(self.config['port'])
+        self.namespace = self.config['namespace']
+
+        # (path, tags) -> slot
+        self.slots = {}
+        # Columns indexed by slot
+        self.names = []
+        self.prefixes = []
+        self.values = array('d')
+        self.expires = array('d')
+        # Exposition line of each slot, None when the value changed
+        self.lines = []
+        # Metric name -> slots, as samples of a name are exposed together
+        self.families = {}
+        # Metric name -> type, for the names that are not gauges
+        self.types = {}
+        self.free = []
+        self.table_lock = threading.Lock()
+
+        # Scrape server, started in the process that handles the metrics
+        self.server = None
+        self.server_pid = None
+
+    def get_default_config_help(self):
+        """
+        Returns the help text for the configuration options for this handler
+        """
+        config = super(PrometheusHandler, self).get_default_config_help()
+
+        config.update({
+            'listen_address': 'Address to listen on',
+            'port': 'Port to serve /metrics on',
+            'namespace': 'Prefix of all metric names',
+        })
+
+        return config
+
+    def get_default_config(self):
+        """
+        Return the default config for the handler
+        """
+        config = super(PrometheusHandler, self).get_default_config()
+
+        config.update({
+            'listen_address': '0.0.0.0',
+            'port': 9108,
+            'namespace': '',
+        })
+
+        return config
+
+    def _start_server(self):
+        """
+        Start serving scrapes. Threads do not survive the fork of the
+        handler process, so this is done on the first metric.
+        """
+        self.server_pid = os.getpid()
+        try:
+            self.server = BaseHTTPServer.HTTPServer(
+                (self.listen_address, self.port), _ScrapeRequestHandler)
+        except Exception, e:
+            self.log.error("PrometheusHandler: Unable to listen on %s:%d: %s",
+                           self.listen_address, self.port, e)
+            return
+        self.server.exposition = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _close(self):
+        """
+        Stop serving scrapes
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _series(self, metric):
+        """
+        Returns the metric name and the labels of a metric
+        """
+        labels = []
+        try:
+            if metric.host is None:
+                raise ValueError
+            name = '%s.%s' % (metric.getCollectorPath(),
+                              metric.getMetricPath())
+            labels.append(('host', metric.host))
+        except ValueError:
+            name = metric.path
+        if self.namespace:
+            name = '%s.%s' % (self.namespace, name)
+        labels.extend(metric.tags)
+        return _metric_name(name), labels
+
+    def _prefix(self, name, labels):
+        """
+        Returns the exposition line of a sample up to its value
+        """
+        if not labels:
+            return name + ' '
+        return '%s{%s} ' % (name, ','.join(
+            '%s="%s"' % (_label_name(k), _label_value(v))
+            for k, v in labels))
+
+    def _add_series(self, key, name, prefix):
+        """
+        Returns the slot of a new series of the metric name
+        """
+        if self.free:
+            slot = self.free.pop()
+            self.names[slot] = name
+            self.prefixes[slot] = prefix
+            self.lines[slot] = None
+        else:
+            slot = len(self.names)
+            self.names.append(name)
+            self.prefixes.append(prefix)
+            self.lines.append(None)
+            self.values.append(0)
+            self.expires.append(0)
+        self.slots[key] = slot
+        self.families.setdefault(name, set()).add(slot)
+        return slot
+
+    def process(self, metric):
+        """
+        Store the value of a metric
+        """
+        if self.server_pid != os.getpid():
+            self._start_server()
+
+        expires = 0
+        if metric.ttl:
+            expires = metric.timestamp + metric.ttl
+
+        self.table_lock.acquire()
+        try:
+            if metric.metric_type == 'HISTOGRAM':
+                self._store_summary(metric, expires)
+                return
+            key = (metric.path, metric.tags)
+            slot = self.slots.get(key)
+            if slot is None:
+                name, labels = self._series(metric)
+                slot = self._add_series(key, name, self._prefix(name, labels))
+            self._store(slot, float(metric.value), expires)
+        finally:
+            self.table_lock.release()
+
+    def _store(self, slot, value, expires):
+        self.expires[slot] = expires
+        if value != self.values[slot] or self.lines[slot] is None:
+            self.values[slot] = value
+            self.lines[slot] = None
+
+    def _store_summary(self, metric, expires):
+        """
+        Store the quantile, sum and count samples of a histogram
+        """
+        sketch = metric.sketch
+        samples = [('_sum', None, sketch.sum), ('_count', None, sketch.count)]
+        if sketch.count:
+            samples.extend(('', percentile, sketch.quantile(percentile / 100))
+                           for percentile in metric.percentiles)
+
+        series = None
+        for suffix, percentile, value in samples:
+            key = (metric.path, metric.tags, suffix, percentile)
+            slot = self.slots.get(key)
+            if slot is None:
+                if series is None:
+                    series = self._series(metric)
+                name, labels = series
+                self.types[name] = 'summary'
+                sample_labels = labels
+                if percentile is not None:
+                    sample_labels = labels + [
+                        ('quantile', '%g' % (percentile / 100))]
+                slot = self._add_series(
+                    key, name, self._prefix(name + suffix, sample_labels))
+            self._store(slot, value, expires)
+
+    def _expire(self, now):
+        """
+        Drop the series that were not updated within their ttl
+        """
+        for key, slot in self.slots.items():
+            if 0 < self.expires[slot] < now:
+                del self.slots[key]
+                family = self.families[self.names[slot]]
+                family.discard(slot)
+                if not family:
+                    del self.families[self.names[slot]]
+                    self.types.pop(self.names[slot], None)
+                self.names[slot] = None
+                self.prefixes[slot] = None
+                self.lines[slot] = None
+                self.free.append(slot)
+
+    def render(self, now=None):
+        """
+        Returns the exposition text, as one chunk per metric name
+        """
+        if now is None:
+            now = time.time()
+        chunks = []
+        self.table_lock.acquire()
+        try:
+            self._expire(now)
+            for name, slots in self.families.iteritems():
+                lines = ['# TYPE %s %s\n' % (
+                    name, self.types.get(name, 'gauge'))]
+                for slot in slots:
+                    line = self.lines[slot]
+                    if line is None:
+                        line = self.lines[slot] = '%s%s\n' % (
+                            self.prefixes[slot],
+                            _format_value(self.values[slot]))
+                    lines.append(line)
+                chunks.append(''.join(lines))
+        finally:
+            self.table_lock.release()
+        return chunks
@@ -10,6 +10,9 @@ from Handler import Handler
 
 class QueueHandler(Handler):
 
+    # Histograms are expanded, if needed, by the handlers behind the queue
+    native_histograms = True
+
     def __init__(self, config=None, queue=None, log=None):
         # Initialize Handler
         Handler.__init__(self, config=config, log=log)
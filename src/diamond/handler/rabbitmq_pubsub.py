@@ -2,9 +2,16 @@
 
 """
 Output the collected values to RabitMQ pub/sub channel
+
+With `batch = True`, the metrics are published as newline delimited
+messages of up to `batch_max_bytes` bytes, when full and on flush, instead
+of one message per metric. With `confirm = True` each message is confirmed
+by the broker. Messages that could not be published are kept, up to
+`max_pending` per server, and published again after reconnecting.
 """
 
 from Handler import Handler
+from messagebatch import MessageBatch
 import time
 
 try:
@@ -52,6 +59,12 @@ class rmqHandler (Handler):
         self.rmq_exchange_type = 'fanout'
         self.rmq_durable = True
         self.rmq_heartbeat_interval = 300
+        self.batch_mode = str(self.config['batch']) == 'True'
+        self.batch = MessageBatch(self.config['batch_max_bytes'])
+        self.confirm = str(self.config['confirm']) == 'True'
+        self.max_pending = int(self.config['max_pending'])
+        # Messages not published yet, by server
+        self.pending = {}
 
         self.get_config()
         # Create rabbitMQ pub socket and bind
@@ -93,6 +106,11 @@ class rmqHandler (Handler):
         config.update({
             'server': '',
             'rmq_exchange': '',
+            'batch': 'Publish newline delimited messages of several metrics',
+            'batch_max_bytes': 'Maximum size of a batch message',
+            'confirm': 'Wait for the broker to confirm each message',
+            'max_pending': 'How many batch messages to keep per server '
+                           'while it is unreachable',
         })
         return config
 
@@ -105,6 +123,10 @@ class rmqHandler (Handler):
         config.update({
             'server': '127.0.0.1',
             'rmq_exchange': 'diamond',
+            'batch': False,
+            'batch_max_bytes': 131072,
+            'confirm': False,
+            'max_pending': 100,
         })
 
         return config
@@ -154,6 +176,8 @@ class rmqHandler (Handler):
                     exchange=self.rmq_exchange,
                     type=self.rmq_exchange_type,
                     durable=self.rmq_durable)
+                if self.confirm:
+                    self.channels[rmq_server].confirm_delivery()
                 # Reset reconnect_interval after a successful connection
                 self.reconnect_interval = 1
             except Exception, exception:
@@ -191,6 +215,12 @@ class rmqHandler (Handler):
         """
           Process a metric and send it to RMQ pub socket
         """
+        if self.batch_mode:
+            message = self.batch.add('', str(metric))
+            if message is not None:
+                self._publish_batch([message])
+            return
+
         for rmq_server in self.connections.keys():
             try:
                 if ((self.connections[rmq_server] is None or
@@ -207,3 +237,44 @@ class rmqHandler (Handler):
                 self.log.debug("Caught exception: %s", exception)
                 self._unbind(rmq_server)
                 self._bind(rmq_server)
+
+    def flush(self):
+        """
+          Publish the pending batch messages
+        """
+        if self.batch_mode:
+            self._publish_batch([message for key, message
+                                 in self.batch.drain()])
+
+    def _publish_batch(self, messages):
+        """
+          Publish messages to every server, keeping those that fail
+        """
+        for rmq_server in self.connections.keys():
+            pending = self.pending.get(rmq_server, []) + messages
+            while pending:
+                try:
+                    if ((self.connections[rmq_server] is None or
+                         self.connections[rmq_server].is_open is False)):
+                        self._bind(rmq_server)
+
+                    channel = self.channels[rmq_server]
+                    if channel.basic_publish(exchange=self.rmq_exchange,
+                                             routing_key='',
+                                             body=pending[0]) is False:
+                        raise pika.exceptions.AMQPError(
+                            'message was not confirmed')
+                    pending.pop(0)
+                except Exception, exception:
+                    self.log.error(
+                        "Failed publishing to %s, keeping %d messages",
+                        rmq_server, len(pending))
+                    self.log.debug("Caught exception: %s", exception)
+                    self._unbind(rmq_server)
+                    break
+
+            if len(pending) > self.max_pending:
+                self.log.warning("Dropping %d messages for %s",
+                                 len(pending) - self.max_pending, rmq_server)
+                del pending[:len(pending) - self.max_pending]
+            self.pending[rmq_server] = pending
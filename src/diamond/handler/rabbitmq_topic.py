@@ -4,9 +4,17 @@
 Output the collected values to RabitMQ Topic Exchange
 This allows for 'subscribing' to messages based on the routing key, which is
 the metric path
+
+With `batch = True`, the metrics of each routing key are published as
+newline delimited messages of up to `batch_max_bytes` bytes, when full and
+on flush. This is most useful with a routing key shared by many metrics,
+like `host` or `collector.path`. With `confirm = True` each message is
+confirmed by the broker. Messages that could not be published are kept, up
+to `max_pending`, and published again after reconnecting.
 """
 
 from Handler import Handler
+from messagebatch import MessageBatch
 
 try:
     import pika
@@ -45,6 +53,12 @@ class rmqHandler (Handler):
         self.routing_key = self.config.get('routing_key', 'metric')
         self.custom_routing_key = self.config.get(
             'custom_routing_key', 'diamond')
+        self.batch_mode = str(self.config['batch']) == 'True'
+        self.batch = MessageBatch(self.config['batch_max_bytes'])
+        self.confirm = str(self.config['confirm']) == 'True'
+        self.max_pending = int(self.config['max_pending'])
+        # (routing key, message) not published yet
+        self.pending = []
 
         if not pika:
             self.log.error('pika import failed. Handler disabled')
@@ -71,6 +85,12 @@ class rmqHandler (Handler):
             'password': '',
             'routing_key': '',
             'custom_routing_key': '',
+            'batch': 'Publish newline delimited messages of several metrics '
+                     'per routing key',
+            'batch_max_bytes': 'Maximum size of a batch message',
+            'confirm': 'Wait for the broker to confirm each message',
+            'max_pending': 'How many batch messages to keep while the '
+                           'server is unreachable',
         })
 
         return config
@@ -88,6 +108,10 @@ class rmqHandler (Handler):
             'user': 'guest',
             'password': 'guest',
             'port': '5672',
+            'batch': False,
+            'batch_max_bytes': 131072,
+            'confirm': False,
+            'max_pending': 100,
         })
 
         return config
@@ -110,6 +134,8 @@ class rmqHandler (Handler):
 
         self.channel.exchange_declare(exchange=self.topic_exchange,
                                       exchange_type="topic")
+        if self.confirm:
+            self.channel.confirm_delivery()
 
     def __del__(self):
         """
@@ -120,14 +146,10 @@ class rmqHandler (Handler):
         except AttributeError:
             pass
 
-    def process(self, metric):
+    def _routing_key(self, metric):
         """
-          Process a metric and send it to RabbitMQ topic exchange
+          Returns the routing key of a metric
         """
-        # Send the data as ......
-        if not pika:
-            return
-
         routingKeyDic = {
             'metric': lambda: metric.path,
             'custom': lambda: self.custom_routing_key,
@@ -142,14 +164,69 @@ class rmqHandler (Handler):
             'path.prefix': metric.getPathPrefix,
             'collector.path': metric.getCollectorPath,
         }
+        return routingKeyDic[self.routing_key]()
+
+    def process(self, metric):
+        """
+          Process a metric and send it to RabbitMQ topic exchange
+        """
+        # Send the data as ......
+        if not pika:
+            return
+
+        if self.batch_mode:
+            key = self._routing_key(metric)
+            message = self.batch.add(key, str(metric))
+            if message is not None:
+                self._publish_batch([(key, message)])
+            return
 
         try:
             self.channel.basic_publish(
                 exchange=self.topic_exchange,
-                routing_key=routingKeyDic[self.routing_key](),
+                routing_key=self._routing_key(metric),
                 body="%s" % metric)
 
         except Exception:  # Rough connection re-try logic.
             self.log.info(
                 "Failed publishing to rabbitMQ. Attempting reconnect")
             self._bind()
+
+    def flush(self):
+        """
+          Publish the pending batch messages
+        """
+        if pika and self.batch_mode:
+            self._publish_batch(self.batch.drain())
+
+    def _publish_batch(self, messages):
+        """
+          Publish (routing key, message) pairs, keeping those that fail
+        """
+        pending = self.pending + messages
+        while pending:
+            key, message = pending[0]
+            try:
+                if self.connection is None or not self.connection.is_open:
+                    self._bind()
+                if self.channel.basic_publish(exchange=self.topic_exchange,
+                                              routing_key=key,
+                                              body=message) is False:
+                    raise pika.exceptions.AMQPError(
+                        'message was not confirmed')
+                pending.pop(0)
+            except Exception, exception:
+                self.log.info("Failed publishing to rabbitMQ, keeping %d "
+                              "messages: %s", len(pending), exception)
+                try:
+                    self.connection.close()
+                except Exception:
+                    pass
+                self.connection = None
+                break
+
+        if len(pending) > self.max_pending:
+            self.log.warning("Dropping %d messages",
+                             len(pending) - self.max_pending)
+            del pending[:len(pending) - self.max_pending]
+        self.pending = pending
@@ -3,6 +3,12 @@
 """
 Send metrics to [Riemann](http://aphyr.github.com/riemann/).
 
+Events are sent in batches, several events per Riemann message. A batch is
+sent when it holds `batch` events or `batch_max_bytes` bytes, when it is
+older than `batch_max_interval` seconds, or when the handler is flushed.
+Over TCP, up to `max_in_flight` messages are written before waiting for
+their acknowledgements.
+
 #### Dependencies
 
  * [Bernhard](https://github.com/banjiewen/bernhard).
@@ -15,16 +21,29 @@ It has these options:
  * `host` - The Riemann host to connect to.
  * `port` - The port it's on.
  * `transport` - Either `tcp` or `udp`. (default: `tcp`)
+ * `batch` - Events per message. (default: `100`)
+ * `batch_max_bytes` - Approximate message size limit. (default: `65536`,
+   use less than 16384 with the udp transport)
+ * `batch_max_interval` - Seconds before sending a partial batch.
+   (default: `10`)
+ * `max_in_flight` - Messages sent before reading acknowledgements.
+   (default: `4`)
 
 """
 
 from Handler import Handler
 import logging
+import socket
+import struct
+import time
 try:
     import bernhard
 except ImportError:
     bernhard = None
 
+# Rough protobuf framing overhead of an event besides its strings
+EVENT_OVERHEAD = 32
+
 
 class RiemannHandler(Handler):
 
@@ -40,6 +59,10 @@ class RiemannHandler(Handler):
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.transport = self.config['transport']
+        self.batch_size = int(self.config['batch'])
+        self.batch_max_bytes = int(self.config['batch_max_bytes'])
+        self.batch_max_interval = float(self.config['batch_max_interval'])
+        self.max_in_flight = max(int(self.config['max_in_flight']), 1)
 
         # Initialize client
         if self.transport == 'tcp':
@@ -48,6 +71,15 @@ class RiemannHandler(Handler):
             transportCls = bernhard.UDPTransport
         self.client = bernhard.Client(self.host, self.port, transportCls)
 
+        # Riemann service names, by metric path
+        self.services = {}
+
+        # Messages written over tcp but not acknowledged yet
+        self.in_flight = 0
+
+        # Batch being built
+        self._reset_batch()
+
     def get_default_config_help(self):
         """
         Returns the help text for the configuration options for this handler
@@ -58,6 +90,12 @@ class RiemannHandler(Handler):
             'host': '',
             'port': '',
             'transport': 'tcp or udp',
+            'batch': 'How many events to send per message',
+            'batch_max_bytes': 'Send the batch when it reaches this size',
+            'batch_max_interval': 'Send the batch when it is this old, in '
+                                  'seconds',
+            'max_in_flight': 'How many messages to send over tcp before '
+                             'waiting for acknowledgements',
         })
 
         return config
@@ -72,46 +110,152 @@ class RiemannHandler(Handler):
             'host': '',
             'port': 123,
             'transport': 'tcp',
+            'batch': 100,
+            'batch_max_bytes': 65536,
+            'batch_max_interval': 10,
+            'max_in_flight': 4,
         })
 
         return config
 
+    def _reset_batch(self):
+        self.batch = bernhard.pb.Msg()
+        self.batch_count = 0
+        self.batch_bytes = 0
+        self.batch_timestamp = time.time()
+
     def process(self, metric):
         """
-        Send a metric to Riemann.
+        Add a metric to the batch of events for Riemann.
         """
-        event = self._metric_to_riemann_event(metric)
+        service = self._get_service(metric)
+
+        event = self.batch.events.add()
+        if metric.host is not None:
+            event.host = metric.host
+        event.service = service
+        event.time = metric.timestamp
+        event.metric_f = float(metric.value)
+        if metric.ttl is not None:
+            event.ttl = metric.ttl
+        for name, value in metric.tags:
+            attribute = event.attributes.add()
+            attribute.key = name
+            attribute.value = value
+            self.batch_bytes += len(name) + len(value) + 4
+
+        self.batch_count += 1
+        self.batch_bytes += len(service) + EVENT_OVERHEAD
+        if metric.host is not None:
+            self.batch_bytes += len(metric.host)
+
+        if (self.batch_count >= self.batch_size or
+                self.batch_bytes >= self.batch_max_bytes or
+                time.time() - self.batch_timestamp >= self.batch_max_interval):
+            self._send()
+
+    def flush(self):
+        """
+        Send the pending batch and wait for all acknowledgements.
+        """
+        self._send()
         try:
-            self.client.send(event)
-        except Exception, e:
-            self.log.error("RiemannHandler: Error sending event to Riemann: %s",
-                           e)
+            self._read_acks()
+        except (bernhard.TransportError, socket.error, struct.error), e:
+            self._disconnect()
+            self._throttle_error("RiemannHandler: Error reading "
+                                 "acknowledgements from Riemann: %s", e)
+
+    def _get_service(self, metric):
+        """
+        Returns the Riemann service name of a metric path
+        """
+        service = self.services.get(metric.path)
+        if service is None:
+            # Riemann has a separate "host" field, so remove from the path.
+            service = '%s.%s.%s' % (
+                metric.getPathPrefix(),
+                metric.getCollectorPath(),
+                metric.getMetricPath()
+            )
+            self.services[metric.path] = service
+        return service
 
     def _metric_to_riemann_event(self, metric):
         """
         Convert a metric to a dictionary representing a Riemann event.
         """
-        # Riemann has a separate "host" field, so remove from the path.
-        path = '%s.%s.%s' % (
-            metric.getPathPrefix(),
-            metric.getCollectorPath(),
-            metric.getMetricPath()
-        )
-
-        return {
+        event = {
             'host': metric.host,
-            'service': path,
+            'service': self._get_service(metric),
             'time': metric.timestamp,
             'metric': float(metric.value),
             'ttl': metric.ttl,
         }
+        if metric.tags:
+            event['attributes'] = dict(metric.tags)
+        return event
+
+    def _send(self):
+        """
+        Encode the batch once and send it to Riemann.
+        """
+        if self.batch_count == 0:
+            return
+
+        message = self.batch.SerializeToString()
+        count = self.batch_count
+        self._reset_batch()
+
+        try:
+            self._transmit(message)
+        except (bernhard.TransportError, socket.error, struct.error), e:
+            self._disconnect()
+            self._throttle_error("RiemannHandler: Error sending %d events to "
+                                 "Riemann: %s", count, e)
+
+    def _transmit(self, message):
+        """
+        Write a message, keeping up to max_in_flight unacknowledged
+        """
+        if not self.client.connection:
+            self.client.connect()
+        connection = self.client.connection
+
+        if self.transport != 'tcp':
+            connection.write(message)
+            return
+
+        connection.sock.sendall(struct.pack('!I', len(message)) + message)
+        self.in_flight += 1
+        if self.in_flight >= self.max_in_flight:
+            self._read_acks()
+
+    def _read_acks(self):
+        """
+        Read the acknowledgement of every message in flight
+        """
+        connection = self.client.connection
+        in_flight, self.in_flight = self.in_flight, 0
+        for i in range(in_flight):
+            header = connection.read_exactly(connection.sock, 4)
+            length = struct.unpack('!I', header)[0]
+            response = bernhard.pb.Msg.FromString(
+                connection.read_exactly(connection.sock, length))
+            if not response.ok:
+                self._throttle_error("RiemannHandler: Riemann rejected "
+                                     "events: %s", response.error)
+
+    def _disconnect(self):
+        self.in_flight = 0
+        self.client.disconnect()
 
     def _close(self):
         """
         Disconnect from Riemann.
         """
         try:
-            self.client.disconnect()
+            self._disconnect()
         except AttributeError:
             pass
 
@@ -0,0 +1,349 @@
+# coding=utf-8
+
+"""
+Keep the recent points of every metric on the box in a memory-mapped file,
+for on-host alerting and debugging without a round-trip to graphite. Read it
+with `diamond-query`:
+
+```
+diamond-query 'servers.*.cpu.total.idle' -5m
+diamond-query -a avg servers.host.loadavg.01 -1h
+```
+
+Each series gets a fixed-size ring buffer of `points` int32 timestamps and
+float64 values, so the file, and the memory it maps, is exactly
+`max_series * (name_size + 8 + 12 * points)` bytes plus a 64 bytes header.
+When all `max_series` buffers are used, the series that has not been
+written for longest is evicted. The file survives restarts of diamond; if
+its geometry no longer matches the configuration it is recreated.
+
+#### Configuration
+
+Add `diamond.handler.ringbuffer.RingBufferHandler` to your handlers.
+It has these options:
+
+ * `file` - The ring buffer file. (default: `/var/lib/diamond/ringbuffer`)
+ * `max_series` - Number of series kept. (default: `10000`)
+ * `points` - Points kept per series, e.g. 360 is an hour of 10s points.
+   (default: `360`)
+ * `name_size` - Longest path kept, longer paths are ignored.
+   (default: `200`)
+
+"""
+
+from Handler import Handler
+from array import array
+import fnmatch
+import heapq
+import mmap
+import os
+import struct
+
+MAGIC = 'DMDRING1'
+# magic, max_series, points, name_size
+_HEADER = struct.Struct('<8sIII')
+HEADER_SIZE = 64
+# head (index of the next write), count
+_POSITION = struct.Struct('<II')
+
+AGGREGATES = {
+    'avg': lambda values: sum(values) / len(values),
+    'min': min,
+    'max': max,
+    'sum': sum,
+    'count': len,
+    'first': lambda values: values[0],
+    'last': lambda values: values[-1],
+}
+
+
+def aggregate(points, name):
+    """
+    Returns an aggregate of the values of (timestamp, value) points, None if
+    there are none
+    """
+    if not points:
+        return None
+    return AGGREGATES[name]([value for timestamp, value in points])
+
+
+class RingStore(object):
+    """
+    Fixed-size ring buffers per series in a memory-mapped file
+    """
+
+    def __init__(self, filename, max_series=10000, points=360, name_size=200,
+                 readonly=False):
+        self.filename = filename
+        self.readonly = readonly
+
+        if readonly:
+            self.file = open(filename, 'rb')
+            header = self.file.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                raise ValueError('%s is not a ring buffer file' % filename)
+            magic, max_series, points, name_size = _HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError('%s is not a ring buffer file' % filename)
+        self.max_series = int(max_series)
+        self.points = int(points)
+        self.name_size = int(name_size)
+        self.timestamps_offset = self.name_size + _POSITION.size
+        self.values_offset = self.timestamps_offset + 4 * self.points
+        self.record_size = self.values_offset + 8 * self.points
+        self.size = HEADER_SIZE + self.max_series * self.record_size
+
+        if readonly:
+            self.map = mmap.mmap(self.file.fileno(), self.size,
+                                 access=mmap.ACCESS_READ)
+        else:
+            self._open_writable()
+
+        # path -> slot
+        self.slots = {}
+        # Last timestamp written to each slot, to pick the one to evict
+        self.last = array('l', [0] * self.max_series)
+        # (timestamp, slot) for each write, oldest first. Entries older than
+        # the last timestamp of their slot are stale and skipped
+        self.heap = []
+        self.free = []
+        self.evicted = 0
+        self.rejected = 0
+        self._load_index()
+
+    def _open_writable(self):
+        header = _HEADER.pack(MAGIC, self.max_series, self.points,
+                              self.name_size)
+        if os.path.exists(self.filename):
+            self.file = open(self.filename, 'r+b')
+            if (self.file.read(_HEADER.size) != header or
+                    os.path.getsize(self.filename) != self.size):
+                # Other geometry, start over
+                self.file.seek(0)
+                self.file.truncate(0)
+        else:
+            directory = os.path.dirname(self.filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.file = open(self.filename, 'w+b')
+
+        if os.path.getsize(self.filename) != self.size:
+            self.file.seek(0)
+            self.file.write(header)
+            self.file.truncate(self.size)
+            self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+    def _offset(self, slot):
+        return HEADER_SIZE + slot * self.record_size
+
+    def _load_index(self):
+        for slot in xrange(self.max_series):
+            offset = self._offset(slot)
+            name = self.map[offset:offset + self.name_size].rstrip('\0')
+            if not name:
+                self.free.append(slot)
+                continue
+            self.slots[name] = slot
+            head, count = _POSITION.unpack_from(
+                self.map, offset + self.name_size)
+            if count:
+                self.last[slot] = struct.unpack_from(
+                    '<i', self.map, offset + self.timestamps_offset +
+                    4 * ((head - 1) % self.points))[0]
+        # Fill the file from the start
+        self.free.reverse()
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        """
+        Rebuild the eviction heap from the last timestamps, dropping the
+        stale entries
+        """
+        self.heap = [(self.last[slot], slot)
+                     for slot in self.slots.itervalues()]
+        heapq.heapify(self.heap)
+
+    def _oldest_slot(self):
+        """
+        Returns the used slot written the longest ago
+        """
+        while True:
+            timestamp, slot = heapq.heappop(self.heap)
+            if self.last[slot] == timestamp:
+                return slot
+
+    def _allocate(self, path):
+        """
+        Returns a slot for a new series, evicting the least recently written
+        one when all are used
+        """
+        if len(path) > self.name_size or '\0' in path:
+            self.rejected += 1
+            return None
+
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = self._oldest_slot()
+            offset = self._offset(slot)
+            del self.slots[self.map[offset:offset + self.name_size]
+                           .rstrip('\0')]
+            self.evicted += 1
+
+        offset = self._offset(slot)
+        self.map[offset:offset + self.name_size] = path.ljust(
+            self.name_size, '\0')
+        _POSITION.pack_into(self.map, offset + self.name_size, 0, 0)
+        self.slots[path] = slot
+        return slot
+
+    def write(self, path, timestamp, value):
+        """
+        Append a point to the buffer of a series
+        """
+        slot = self.slots.get(path)
+        if slot is None:
+            slot = self._allocate(path)
+            if slot is None:
+                return
+        offset = self._offset(slot)
+        head, count = _POSITION.unpack_from(self.map, offset + self.name_size)
+        struct.pack_into('<i', self.map,
+                         offset + self.timestamps_offset + 4 * head,
+                         timestamp)
+        struct.pack_into('<d', self.map,
+                         offset + self.values_offset + 8 * head, value)
+        _POSITION.pack_into(self.map, offset + self.name_size,
+                            (head + 1) % self.points,
+                            min(count + 1, self.points))
+        self.last[slot] = timestamp
+        heapq.heappush(self.heap, (timestamp, slot))
+        if len(self.heap) > 4 * self.max_series:
+            self._rebuild_heap()
+
+    def read(self, path, start=None, end=None):
+        """
+        Returns the (timestamp, value) points of a series with
+        start <= timestamp <= end, oldest first
+        """
+        slot = self.slots.get(path)
+        if slot is None:
+            return []
+        offset = self._offset(slot)
+        head, count = _POSITION.unpack_from(self.map, offset + self.name_size)
+        timestamps = struct.unpack_from(
+            '<%di' % self.points, self.map, offset + self.timestamps_offset)
+        values = struct.unpack_from(
+            '<%dd' % self.points, self.map, offset + self.values_offset)
+
+        points = []
+        first = (head - count) % self.points
+        for i in xrange(count):
+            index = (first + i) % self.points
+            timestamp = timestamps[index]
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end:
+                continue
+            points.append((timestamp, values[index]))
+        return points
+
+    def names(self, pattern=None):
+        """
+        Returns the sorted paths of the stored series, optionally only those
+        matching a shell-style pattern
+        """
+        names = self.slots.keys()
+        if pattern is not None:
+            names = fnmatch.filter(names, pattern)
+        return sorted(names)
+
+    def query(self, pattern, start=None, end=None):
+        """
+        Yields (path, points) for the series matching a pattern
+        """
+        for name in self.names(pattern):
+            points = self.read(name, start, end)
+            if points:
+                yield name, points
+
+    def close(self):
+        if self.map is not None:
+            if not self.readonly:
+                self.map.flush()
+            self.map.close()
+            self.map = None
+            self.file.close()
+
+
+class RingBufferHandler(Handler):
+    """
+    Implements the abstract Handler class, keeping recent points in a
+    RingStore
+    """
+
+    def __init__(self, config=None):
+        """
+        Create a new instance of the RingBufferHandler class
+        """
+        # Initialize Handler
+        Handler.__init__(self, config)
+
+        self.store = None
+        try:
+            self.store = RingStore(self.config['file'],
+                                   int(self.config['max_series']),
+                                   int(self.config['points']),
+                                   int(self.config['name_size']))
+        except (IOError, OSError, ValueError), e:
+            self.log.error("RingBufferHandler: Unable to open %s: %s",
+                           self.config['file'], e)
+            self.enabled = False
+
+    def get_default_config_help(self):
+        """
+        Returns the help text for the configuration options for this handler
+        """
+        config = super(RingBufferHandler, self).get_default_config_help()
+
+        config.update({
+            'file': 'The ring buffer file',
+            'max_series': 'Number of series kept',
+            'points': 'Points kept per series',
+            'name_size': 'Longest path kept',
+        })
+
+        return config
+
+    def get_default_config(self):
+        """
+        Return the default config for the handler
+        """
+        config = super(RingBufferHandler, self).get_default_config()
+
+        config.update({
+            'file': '/var/lib/diamond/ringbuffer',
+            'max_series': 10000,
+            'points': 360,
+            'name_size': 200,
+        })
+
+        return config
+
+    def __del__(self):
+        """
+        Destroy instance of the RingBufferHandler class
+        """
+        self._close()
+
+    def process(self, metric):
+        """
+        Store a point
+        """
+        self.store.write(metric.path, metric.timestamp, float(metric.value))
+
+    def _close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
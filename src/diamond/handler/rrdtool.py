@@ -2,15 +2,36 @@
 
 """
 Save stats in RRD files using rrdtool.
+
+Updates are written, in order of preference:
+
+ * through a running rrdcached, if `daemon` is set, as a single `BATCH`
+   over one persistent connection per flush
+ * with the python-rrdtool bindings, if they are installed
+ * by running `rrdupdate`, one process per RRD file and flush
+
+With `daemon` set, the updates of every file are queued until the handler
+is flushed, after each group of metrics taken off the queue, and `batch`
+is ignored. Otherwise a file is updated as soon as it has `batch` updates
+queued, and on flush.
+
+#### Configuration
+
+ * daemon = unix:/var/run/rrdcached.sock or hostname:port
 """
 
 import os
 import re
+import socket
 import subprocess
-import Queue
 
 from Handler import Handler
 
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None
+
 #
 # Constants for RRD file creation.
 #
@@ -24,6 +45,8 @@ BASEDIR = '/var/lib/collectd/rrd'
 
 METRIC_STEP = 10
 
+RRDCACHED_PORT = 42217
+
 BATCH_SIZE = 1
 
 # NOTE: We don't really have a rigorous defition
@@ -74,17 +97,23 @@ class RRDHandler(Handler):
         super(RRDHandler, self).__init__(*args, **kwargs)
         self._exists_cache = dict()
         self._basedir = self.config['basedir']
-        self._batch = self.config['batch']
-        self._step = self.config['step']
+        self._batch = int(self.config['batch'])
+        self._step = int(self.config['step'])
+        self._daemon = self.config['daemon']
         self._queues = {}
         self._last_update = {}
+        self._socket = None
+        self._reader = None
 
     def get_default_config_help(self):
         config = super(RRDHandler, self).get_default_config_help()
         config.update({
             'basedir': 'The base directory for all RRD files.',
-            'batch': 'Wait for this many updates before saving to the RRD file',
+            'batch': 'Wait for this many updates before saving to the RRD '
+                     'file. Ignored with daemon, which saves on flush',
             'step': 'The minimum interval represented in generated RRD files.',
+            'daemon': 'Address of rrdcached, unix:/path/to/socket or '
+                      'host[:port]. Leave empty to update the files directly.',
         })
         return config
 
@@ -94,9 +123,13 @@ class RRDHandler(Handler):
             'basedir': BASEDIR,
             'batch': BATCH_SIZE,
             'step': METRIC_STEP,
+            'daemon': '',
         })
         return config
 
+    def __del__(self):
+        self._close()
+
     def _ensure_exists(self, filename, metric_name, metric_type):
         # We're good to go!
         if filename in self._exists_cache:
@@ -131,14 +164,18 @@ class RRDHandler(Handler):
 
         ds_spec = "DS:%s:%s:%d:U:U" % (
             metric_name, metric_type, self._step * 2)
-        rrd_create_cmd = [
-            "rrdtool", "create", filename,
+        rrd_create_args = [
+            filename,
             "--no-overwrite",
             "--step", str(self._step),
             ds_spec
         ]
-        rrd_create_cmd.extend(RRA_SPECS)
-        subprocess.check_call(rrd_create_cmd, close_fds=True)
+        rrd_create_args.extend(RRA_SPECS)
+        if rrdtool is not None:
+            rrdtool.create(*rrd_create_args)
+        else:
+            subprocess.check_call(["rrdtool", "create"] + rrd_create_args,
+                                  close_fds=True)
 
     def process(self, metric):
         # Extract the filename given the metric.
@@ -155,69 +192,143 @@ class RRDHandler(Handler):
         # we would like to have exceptions related to creating
         # the RRD file raised in the main thread.
         self._ensure_exists(filename, metric_name, metric.metric_type)
-        if self._queue(filename, metric.timestamp, metric.value) >= self._batch:
+        queued = self._queue(filename, metric.timestamp, metric.value)
+        # rrdcached gets the updates of all files in one BATCH on flush
+        if not self._daemon and queued >= self._batch:
             self._flush_queue(filename)
 
     def _queue(self, filename, timestamp, value):
-        if filename not in self._queues:
-            queue = Queue.Queue()
-            self._queues[filename] = queue
-        else:
-            queue = self._queues[filename]
-        queue.put((timestamp, value))
-        return queue.qsize()
+        queue = self._queues.get(filename)
+        if queue is None:
+            queue = self._queues[filename] = []
+        queue.append((timestamp, value))
+        return len(queue)
 
     def flush(self):
         # Grab all current queues.
+        updates = []
         for filename in self._queues.keys():
-            self._flush_queue(filename)
+            data_points = self._collect_updates(filename)
+            if data_points:
+                updates.append((filename, data_points))
+        self._write_updates(updates)
 
     def _flush_queue(self, filename):
+        data_points = self._collect_updates(filename)
+        if data_points:
+            self._write_updates([(filename, data_points)])
+
+    def _collect_updates(self, filename):
         queue = self._queues[filename]
+        self._queues[filename] = []
 
         # Collect all pending updates.
         updates = {}
-        max_timestamp = 0
-        while True:
-            try:
-                (timestamp, value) = queue.get(block=False)
-                # RRD only supports granularity at a
-                # per-second level (not milliseconds, etc.).
-                timestamp = int(timestamp)
-
-                # Remember the latest update done.
-                last_update = self._last_update.get(filename, 0)
-                if last_update >= timestamp:
-                    # Yikes. RRDtool won't let us do this.
-                    # We need to drop this update and log a warning.
-                    self.log.warning(
-                        "Dropping update to %s. Too frequent!" % filename)
-                    continue
-                max_timestamp = max(timestamp, max_timestamp)
-
-                # Add this update.
-                if timestamp not in updates:
-                    updates[timestamp] = []
-                updates[timestamp].append(value)
-            except Queue.Empty:
-                break
+        max_timestamp = last_update = self._last_update.get(filename, 0)
+        for (timestamp, value) in queue:
+            # RRD only supports granularity at a
+            # per-second level (not milliseconds, etc.).
+            timestamp = int(timestamp)
+
+            # Remember the latest update done.
+            if last_update >= timestamp:
+                # Yikes. RRDtool won't let us do this.
+                # We need to drop this update and log a warning.
+                self.log.warning(
+                    "Dropping update to %s. Too frequent!" % filename)
+                continue
+            max_timestamp = max(timestamp, max_timestamp)
+
+            # Add this update.
+            if timestamp not in updates:
+                updates[timestamp] = []
+            updates[timestamp].append(value)
 
         # Save the last update time.
         self._last_update[filename] = max_timestamp
 
-        if len(updates) > 0:
-            # Construct our command line.
-            # This will look like <time>:<value1>[:<value2>...]
-            # The timestamps must be sorted, and we each of the
-            # <time> values must be unique (like a snowflake).
-            data_points = map(
-                lambda (timestamp, values): "%d:%s" %
-                (timestamp, ":".join(map(str, values))),
-                sorted(updates.items()))
-
-            # Optimisticly update.
-            # Nothing can really be done if we fail.
-            rrd_update_cmd = ["rrdupdate", filename, "--"]
-            rrd_update_cmd.extend(data_points)
-            self.log.info("update: %s" % str(rrd_update_cmd))
-            subprocess.call(rrd_update_cmd)
+        # Construct our data points.
+        # This will look like <time>:<value1>[:<value2>...]
+        # The timestamps must be sorted, and we each of the
+        # <time> values must be unique (like a snowflake).
+        return ["%d:%s" % (update_time, ":".join(map(str, values)))
+                for update_time, values in sorted(updates.items())]
+
+    def _write_updates(self, updates):
+        if not updates:
+            return
+
+        if self._daemon:
+            try:
+                self._write_rrdcached(updates)
+                return
+            except (socket.error, IOError), e:
+                self._close()
+                self._throttle_error(
+                    "RRDHandler: rrdcached at %s failed, updating files "
+                    "directly. %s", self._daemon, e)
+
+        # Optimisticly update.
+        # Nothing can really be done if we fail.
+        for filename, data_points in updates:
+            if rrdtool is not None:
+                try:
+                    rrdtool.update(filename, "--", *data_points)
+                except rrdtool.error, e:
+                    self.log.error("RRDHandler: update of %s failed: %s",
+                                   filename, e)
+            else:
+                rrd_update_cmd = ["rrdupdate", filename, "--"]
+                rrd_update_cmd.extend(data_points)
+                self.log.info("update: %s" % str(rrd_update_cmd))
+                subprocess.call(rrd_update_cmd)
+
+    def _connect(self):
+        if self._daemon.startswith('unix:'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self._daemon[len('unix:'):]
+        elif self._daemon.startswith('/'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self._daemon
+        else:
+            host, _, port = self._daemon.partition(':')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (host, int(port or RRDCACHED_PORT))
+        sock.connect(address)
+        self._socket = sock
+        self._reader = sock.makefile('rb')
+
+    def _close(self):
+        if self._reader is not None:
+            self._reader.close()
+        if self._socket is not None:
+            self._socket.close()
+        self._reader = None
+        self._socket = None
+
+    def _read_status(self):
+        line = self._reader.readline()
+        if not line:
+            raise IOError("rrdcached closed the connection")
+        status, _, message = line.strip().partition(' ')
+        status = int(status)
+        if status < 0:
+            raise IOError("rrdcached: %s" % message)
+        # A positive status is the number of lines that follow
+        return [self._reader.readline().strip() for i in range(status)]
+
+    def _write_rrdcached(self, updates):
+        if self._socket is None:
+            self._connect()
+
+        lines = ["BATCH\n"]
+        for filename, data_points in updates:
+            lines.append("UPDATE %s %s\n" % (filename, " ".join(data_points)))
+        lines.append(".\n")
+
+        # BATCH answers once to go ahead and once with the errors, if any
+        self._socket.sendall(lines[0])
+        self._read_status()
+        self._socket.sendall("".join(lines[1:]))
+        for error in self._read_status():
+            self.log.error("RRDHandler: rrdcached update failed: %s", error)
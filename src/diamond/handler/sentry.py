@@ -26,10 +26,16 @@ max = 8.5
 name = Free Memory
 path = memory.MemFree
 min = 66020000
+
+Each metric path is matched against the rules once and the result cached.
+Rules are indexed by the literal end of their path expression, so only the
+few rules that can match a path are tried. An alert is sent at most once
+every `alert_interval` seconds per rule and metric path.
 """
 
 import logging
 import re
+import time
 
 from Handler import Handler
 from diamond.collector import get_hostname
@@ -67,12 +73,6 @@ class BaseResult(object):
         self.value = value
         self.threshold = threshold
 
-        if not raven:
-            self.log.error('raven.handlers.logging import failed. '
-                           'Handler disabled')
-            self.enabled = False
-            return
-
     @property
     def verbose_message(self):
         """return more complete message"""
@@ -136,7 +136,7 @@ class Rule(object):
     Alert rule
     """
 
-    def __init__(self, name, path, min=None, max=None):
+    def __init__(self, name, path, min=None, max=None, alert_interval=0):
         """
         @type name: string
         @param name: rule name, used to identify this rule in Sentry
@@ -148,11 +148,22 @@ class Rule(object):
         @type max: string of float/int, int or float. will be convert to float
         @param max: optional maximal value that if value goes over it send
             an alert to Sentry
+        @type alert_interval: float
+        @param alert_interval: minimum seconds between two alerts of a
+            metric path
         """
         self.name = name
+        self.path = path
         # counters that can be used to debug rule
         self.counter_errors = 0
         self.counter_pass = 0
+        self.counter_suppressed = 0
+
+        # time of the last alert, by metric path, pruned of the alerts older
+        # than alert_interval when it reaches prune_size entries
+        self.alert_interval = float(alert_interval)
+        self.last_alerts = {}
+        self.prune_size = 1024
 
         # force min and max to be float
         try:
@@ -176,22 +187,54 @@ class Rule(object):
         # compile path regular expression
         self.regexp = re.compile(r'(?P<prefix>.*)\.(?P<path>%s)$' % path)
 
-    def process(self, metric, handler):
+    def match(self, path):
+        """
+        match a metric path against the rule
+        @type path: string
+        @rtype re.MatchObject or None
+        """
+        return self.regexp.match(path)
+
+    def _record_alert(self, path, now):
+        """
+        Remember the time of an alert, forgetting the expired ones
+        """
+        if (path not in self.last_alerts and
+                len(self.last_alerts) >= self.prune_size):
+            oldest = now - self.alert_interval
+            self.last_alerts = dict(
+                (key, last) for key, last in self.last_alerts.iteritems()
+                if last > oldest)
+            self.prune_size = max(1024, 2 * len(self.last_alerts))
+        self.last_alerts[path] = now
+
+    def process(self, metric, handler, match=None):
         """
         process a single diamond metric
         @type metric: diamond.metric.Metric
         @param metric: metric to process
         @type handler: diamond.handler.sentry.SentryHandler
         @param handler: configured Sentry graphite handler
+        @type match: re.MatchObject
+        @param match: optional result of match(metric.path)
         @rtype None
         """
-        match = self.regexp.match(metric.path)
+        if match is None:
+            match = self.match(metric.path)
         if match:
             minimum = Minimum(metric.value, self.min)
             maximum = Maximum(metric.value, self.max)
 
             if minimum.is_error or maximum.is_error:
                 self.counter_errors += 1
+                now = time.time()
+                last_alert = self.last_alerts.get(metric.path)
+                if (last_alert is not None and
+                        now - last_alert < self.alert_interval):
+                    self.counter_suppressed += 1
+                    return
+                if self.alert_interval > 0:
+                    self._record_alert(metric.path, now)
                 message = "%s Warning on %s: %.1f" % (self.name,
                                                       handler.hostname,
                                                       metric.value)
@@ -212,6 +255,7 @@ class Rule(object):
                         'path regular expression': self.regexp.pattern,
                         'total errors': self.counter_errors,
                         'total pass': self.counter_pass,
+                        'total suppressed': self.counter_suppressed,
                         'hostname': handler.hostname
                     }
                 }
@@ -224,6 +268,86 @@ class Rule(object):
                                          self.regexp.pattern)
 
 
+class RuleSet(object):
+    """
+    Rules indexed by the literal end of their path expression, with the
+    rules matching each metric path cached
+    """
+
+    # characters of a path expression that always match themselves
+    LITERAL = re.compile(r'[A-Za-z0-9_\-]*$')
+
+    def __init__(self, rules, cache_size=100000):
+        """
+        @type rules: list of Rule
+        @type cache_size: int
+        @param cache_size: how many metric paths to remember the matching
+            rules of
+        """
+        self.rules = list(rules)
+        self.cache_size = cache_size
+        self.cache = {}
+
+        # rules by literal suffix, and rules without one
+        self.by_suffix = {}
+        self.unindexed = []
+        for position, rule in enumerate(self.rules):
+            suffix = self.literal_suffix(rule.path)
+            if suffix:
+                self.by_suffix.setdefault(suffix, []).append((position, rule))
+            else:
+                self.unindexed.append((position, rule))
+        self.suffix_lengths = sorted(set(len(k) for k in self.by_suffix))
+
+    @classmethod
+    def literal_suffix(cls, pattern):
+        """
+        returns the string every path matched by a path expression ends
+        with, or an empty string if it is not known
+        """
+        if '|' in pattern or '(?' in pattern:
+            return ''
+        suffix = cls.LITERAL.search(pattern).group()
+        start = len(pattern) - len(suffix)
+        if suffix and start > 0 and pattern[start - 1] == '\\':
+            # the suffix starts inside an escape sequence like \d, \x41 or
+            # \101, which may span any number of its characters
+            return ''
+        return suffix
+
+    def candidates(self, path):
+        """
+        returns the rules that may match a metric path, in rule order
+        """
+        candidates = list(self.unindexed)
+        for length in self.suffix_lengths:
+            if length > len(path):
+                break
+            candidates.extend(self.by_suffix.get(path[-length:], ()))
+        if len(candidates) > 1:
+            candidates.sort()
+        return [rule for position, rule in candidates]
+
+    def match(self, path):
+        """
+        returns a list of (rule, match) of the rules matching a metric path
+        """
+        matches = self.cache.get(path)
+        if matches is None:
+            matches = []
+            for rule in self.candidates(path):
+                match = rule.match(path)
+                if match:
+                    matches.append((rule, match))
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[path] = matches
+        return matches
+
+    def __len__(self):
+        return len(self.rules)
+
+
 class SentryHandler(Handler):
     """
     Diamond handler that check if a metric goes too low or too high
@@ -238,6 +362,9 @@ class SentryHandler(Handler):
         """
         Handler.__init__(self, config)
         if not raven:
+            self.log.error('raven.handlers.logging import failed. '
+                           'Handler disabled')
+            self.enabled = False
             return
         # init sentry/raven
         self.sentry_log_handler = raven.handlers.logging.SentryHandler(
@@ -245,7 +372,8 @@ class SentryHandler(Handler):
         self.raven_logger = logging.getLogger(self.__class__.__name__)
         self.raven_logger.addHandler(self.sentry_log_handler)
         self.configure_sentry_errors()
-        self.rules = self.compile_rules()
+        self.rules = RuleSet(self.compile_rules(),
+                             int(self.config['match_cache_size']))
         self.hostname = get_hostname(self.config)
         if not len(self.rules):
             self.log.warning("No rules, this graphite handler is unused")
@@ -258,6 +386,10 @@ class SentryHandler(Handler):
 
         config.update({
             'dsn': '',
+            'alert_interval': 'Minimum seconds between two alerts of a rule '
+                              'for the same metric',
+            'match_cache_size': 'How many metric paths to remember the '
+                                'matching rules of',
         })
 
         return config
@@ -270,6 +402,8 @@ class SentryHandler(Handler):
 
         config.update({
             'dsn': '',
+            'alert_interval': 300,
+            'match_cache_size': 100000,
         })
 
         return config
@@ -322,7 +456,8 @@ class SentryHandler(Handler):
         # add rule to the list
         kwargs = {
             'name': section['name'],
-            'path': section['path']
+            'path': section['path'],
+            'alert_interval': self.config['alert_interval'],
         }
         for argument in ('min', 'max'):
             try:
@@ -353,8 +488,8 @@ class SentryHandler(Handler):
         @param metric: metric to process
         @rtype None
         """
-        for rule in self.rules:
-            rule.process(metric, self)
+        for rule, match in self.rules.match(metric.path):
+            rule.process(metric, self, match)
 
     def __repr__(self):
         return "SentryHandler '%s' %d rules" % (
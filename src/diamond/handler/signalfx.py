@@ -3,10 +3,12 @@
 """
 Send metrics to signalfx
 
-#### Dependencies
-
- * urllib2
-
+Datapoints are json encoded as they arrive, straight into a gzip compressed
+buffer per metric type, so a batch is held in memory only in its compressed
+form. The dimensions of each metric path are encoded once and reused. A
+batch is sent when it holds `batch` datapoints or `max_payload_size`
+uncompressed bytes, and a timer sends partial batches every
+`batch_max_interval` seconds.
 
 #### Configuration
 Enable this handler
@@ -18,31 +20,101 @@ Enable this handler
      posting
 """
 
-from Handler import Handler
+from Handler import BatchingHandler
+from httpclient import HTTPClient
 from diamond.util import get_diamond_version
 import json
 import logging
-import time
-import urllib2
+import zlib
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+class SignalfxPayload(object):
+    """
+    Incrementally encoded {"<metric type>": [datapoint, ...]} request body
+    """
+
+    def __init__(self, metric_type, compress):
+        self.metric_type = metric_type
+        self.compress = compress
+        self.reset()
+
+    def reset(self):
+        self.buffer = StringIO()
+        if self.compress:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        else:
+            self.compressor = None
+        self.count = 0
+        self.size = 0
+        self._write('{"%s":[' % self.metric_type)
+
+    def _write(self, data):
+        self.size += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.buffer.write(data)
+
+    def add(self, datapoint):
+        """
+        Append an encoded datapoint
+        """
+        if self.count:
+            self._write(',')
+        self._write(datapoint)
+        self.count += 1
+
+    def finish(self):
+        """
+        Returns the complete body and starts a new payload
+        """
+        self._write(']}')
+        if self.compressor is not None:
+            self.buffer.write(self.compressor.flush())
+        body = self.buffer.getvalue()
+        self.reset()
+        return body
 
 
-class SignalfxHandler(Handler):
+class SignalfxHandler(BatchingHandler):
 
     # Inititalize Handler with url and batch size
     def __init__(self, config=None):
-        Handler.__init__(self, config)
-        self.metrics = []
-        self.batch_size = int(self.config['batch'])
+        BatchingHandler.__init__(self, config)
         self.url = self.config['url']
         self.auth_token = self.config['auth_token']
-        self.batch_max_interval = self.config['batch_max_interval']
-        self.resetBatchTimeout()
+        self.batch_max_bytes = int(self.config['max_payload_size'])
+        self.compress = str(self.config['compress']) == 'True'
+
+        # Payloads being built, by metric type
+        self.payloads = {}
+
+        # Encoded datapoint up to the value, by (path, host)
+        self.prefixes = {}
+
+        self.client = None
         if self.auth_token == "":
-            logging.error("Failed to load Signalfx module")
+            self.log.error("SignalfxHandler: auth_token is not set. "
+                           "Handler disabled")
+            self.enabled = False
             return
-
-    def resetBatchTimeout(self):
-        self.batch_max_timestamp = int(time.time() + self.batch_max_interval)
+        headers = {"Content-type": "application/json",
+                   "X-SF-TOKEN": self.auth_token,
+                   "User-Agent": self.user_agent()}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        # Bodies are compressed as they are encoded, not by the client
+        self.client = HTTPClient(
+            self.url,
+            timeout=self.config['timeout'],
+            retries=self.config['retries'],
+            max_in_flight=self.config['max_in_flight'],
+            headers=headers,
+            log=self.log)
 
     def get_default_config_help(self):
         """
@@ -53,7 +125,13 @@ class SignalfxHandler(Handler):
         config.update({
             'url': 'Where to send metrics',
             'batch': 'How many to store before sending',
+            'max_payload_size': 'Send a payload when its uncompressed size '
+                                'reaches this many bytes',
             'auth_token': 'Org API token to use when sending metrics',
+            'timeout': 'HTTP timeout in seconds',
+            'compress': 'gzip request bodies',
+            'retries': 'How many times to retry a failed request',
+            'max_in_flight': 'How many requests to send concurrently',
         })
 
         return config
@@ -69,22 +147,51 @@ class SignalfxHandler(Handler):
             'batch': 300,
             # Don't wait more than 10 sec between pushes
             'batch_max_interval': 10,
+            'max_payload_size': 1000000,
             'auth_token': '',
+            'timeout': 15,
+            'compress': True,
+            'retries': 2,
+            'max_in_flight': 1,
         })
 
         return config
 
-    def process(self, metric):
+    def add(self, metric):
+        """
+        Encode a metric into the payload of its type
         """
-        Queue a metric.  Flushing queue if batch size reached
+        payload = self.payloads.get(metric.metric_type)
+        if payload is None:
+            payload = SignalfxPayload(metric.metric_type.lower(),
+                                      self.compress)
+            self.payloads[metric.metric_type] = payload
+        datapoint = self._encode(metric)
+        payload.add(datapoint)
+        return len(datapoint)
+
+    def take(self):
         """
-        self.metrics.append(metric)
-        if self.should_flush():
-            self._send()
+        Returns the bodies of the payloads
+        """
+        return [payload.finish() for payload in self.payloads.values()
+                if payload.count]
 
-    def should_flush(self):
-        return len(self.metrics) >= self.batch_size or \
-            time.time() >= self.batch_max_timestamp
+    def _encode(self, metric):
+        """
+        Returns the json encoded signalfx datapoint of a metric
+        """
+        key = (metric.path, metric.host, metric.tags)
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            point = self.into_signalfx_point(metric)
+            prefix = '{"metric":%s,"dimensions":%s,"value":' % (
+                json.dumps(point['metric']),
+                json.dumps(point['dimensions'], separators=(',', ':')))
+            self.prefixes[key] = prefix
+        # We expect ms timestamps
+        return '%s%s,"timestamp":%d}' % (prefix, json.dumps(metric.value),
+                                         metric.timestamp * 1000)
 
     def into_signalfx_point(self, metric):
         """
@@ -96,6 +203,7 @@ class SignalfxHandler(Handler):
         }
         if metric.host is not None and metric.host != "":
             dims["host"] = metric.host
+        dims.update(metric.tags)
 
         return {
             "metric": metric.getMetricPath(),
@@ -105,35 +213,17 @@ class SignalfxHandler(Handler):
             "timestamp": metric.timestamp * 1000,
         }
 
-    def flush(self):
-        """Flush metrics in queue"""
-        self._send()
-
     def user_agent(self):
         """
         HTTP user agent
         """
         return "Diamond: %s" % get_diamond_version()
 
-    def _send(self):
-        # Potentially use protobufs in the future
-        postDictionary = {}
-        for metric in self.metrics:
-            t = metric.metric_type.lower()
-            if t not in postDictionary:
-                postDictionary[t] = []
-            postDictionary[t].append(self.into_signalfx_point(metric))
-
-        self.metrics = []
-        postBody = json.dumps(postDictionary)
-        logging.debug("Body is %s", postBody)
-        req = urllib2.Request(self.url, postBody,
-                              {"Content-type": "application/json",
-                               "X-SF-TOKEN": self.auth_token,
-                               "User-Agent": self.user_agent()})
-        self.resetBatchTimeout()
-        try:
-            urllib2.urlopen(req)
-        except urllib2.URLError:
-            logging.exception("Unable to post signalfx metrics")
-            return
+    def send(self, body):
+        logging.debug("SignalfxHandler: posting %d bytes", len(body))
+        self.client.submit(body)
+
+    def __del__(self):
+        self.timer_stop.set()
+        if getattr(self, 'client', None) is not None:
+            self.client.close()
@@ -5,10 +5,14 @@ Implements the abstract Handler class, sending data to statsd.
 This is a UDP service, sending datagrams.  They may be lost.
 It's OK.
 
+Metrics are packed as `name:value|type` lines, several per datagram, up to
+`mtu` bytes. The default of 1432 fits a 1500 byte ethernet frame. Use 512
+when sending over the internet, or 8932 on jumbo frame networks.
+
 #### Dependencies
 
- * [python-statsd](http://pypi.python.org/pypi/python-statsd/)
- * [statsd](https://github.com/etsy/statsd) v0.1.1 or newer.
+ * [statsd](https://github.com/etsy/statsd) v0.1.1 or newer, or any server
+   accepting multi-metric packets.
 
 #### Configuration
 
@@ -28,11 +32,8 @@ of this handler.
 """
 
 from Handler import Handler
-import logging
-try:
-    import statsd
-except ImportError:
-    statsd = None
+import errno
+import socket
 
 
 class StatsdHandler(Handler):
@@ -43,19 +44,29 @@ class StatsdHandler(Handler):
         """
         # Initialize Handler
         Handler.__init__(self, config)
-        logging.debug("Initialized statsd handler.")
-
-        if not statsd:
-            self.log.error('statsd import failed. Handler disabled')
-            self.enabled = False
-            return
 
         # Initialize Options
         self.host = self.config['host']
         self.port = int(self.config['port'])
         self.batch_size = int(self.config['batch'])
+        self.mtu = int(self.config['mtu'])
+        self.max_counters = int(self.config['max_counters'])
         self.metrics = []
+        # Last raw values in two generations, the older one is dropped
+        # when the current one holds max_counters / 2 paths
         self.old_values = {}
+        self.older_values = {}
+
+        # Packet being built
+        self.packet = []
+        self.packet_size = 0
+
+        # Statistics
+        self.datagrams = 0
+        self.dropped = 0
+
+        self.socket = None
+        self.address = None
 
         # Connect
         self._connect()
@@ -70,6 +81,9 @@ class StatsdHandler(Handler):
             'host': '',
             'port': '',
             'batch': '',
+            'mtu': 'Maximum datagram payload size in bytes',
+            'max_counters': 'How many counters to remember the last raw '
+                            'value of, to send deltas',
         })
 
         return config
@@ -84,10 +98,15 @@ class StatsdHandler(Handler):
             'host': '',
             'port': 1234,
             'batch': 1,
+            'mtu': 1432,
+            'max_counters': 100000,
         })
 
         return config
 
+    def __del__(self):
+        self._close()
+
     def process(self, metric):
         """
         Process a metric by sending it to statsd
@@ -98,42 +117,87 @@ class StatsdHandler(Handler):
         if len(self.metrics) >= self.batch_size:
             self._send()
 
+    def _counter_delta(self, metric):
+        """
+        Returns the change of a counter's raw value since it was last sent
+        """
+        value = metric.raw_value
+        if value is None:
+            return metric.value
+        old_value = self.old_values.get(metric.path)
+        if old_value is None:
+            old_value = self.older_values.pop(metric.path, None)
+            if len(self.old_values) * 2 >= self.max_counters:
+                self.older_values = self.old_values
+                self.old_values = {}
+        self.old_values[metric.path] = value
+        if old_value is None:
+            return value
+        return value - old_value
+
+    def _format(self, metric):
+        """
+        Returns the statsd line(s) for a metric
+        """
+        fstring = '%%s:%%0.%if|%%s' % metric.precision
+
+        if metric.metric_type == 'GAUGE':
+            if metric.value < 0:
+                # A signed gauge value is a delta to statsd, so reset the
+                # gauge first
+                return [metric.path + ':0|g',
+                        fstring % (metric.path, metric.value, 'g')]
+            return [fstring % (metric.path, metric.value, 'g')]
+
+        # To send a counter, we need to just send the delta
+        # but without any time delta changes
+        return [fstring % (metric.path, self._counter_delta(metric), 'c')]
+
+    def _add_line(self, line):
+        """
+        Add a line to the packet, sending the packet first if it is full
+        """
+        size = len(line)
+        if self.packet and self.packet_size + 1 + size > self.mtu:
+            self._send_packet()
+        if self.packet:
+            self.packet_size += 1
+        self.packet.append(line)
+        self.packet_size += size
+
+    def _send_packet(self):
+        """
+        Send the packet being built. Fire and forget.
+        """
+        if not self.packet:
+            return
+        data = '\n'.join(self.packet)
+        self.packet = []
+        self.packet_size = 0
+
+        if self.socket is None:
+            self._connect()
+            if self.socket is None:
+                self.dropped += 1
+                return
+        try:
+            self.socket.sendto(data, self.address)
+            self.datagrams += 1
+        except socket.error, e:
+            # A full send buffer drops the packet rather than block
+            self.dropped += 1
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._throttle_error("StatsdHandler: Failed to send to "
+                                     "%s:%d. %s", self.host, self.port, e)
+
     def _send(self):
         """
         Send data to statsd. Fire and forget.  Cross fingers and it'll arrive.
         """
-        if not statsd:
-            return
         for metric in self.metrics:
-
-            # Split the path into a prefix and a name
-            # to work with the statsd module's view of the world.
-            # It will get re-joined by the python-statsd module.
-            #
-            # For the statsd module, you specify prefix in the constructor
-            # so we just use the full metric path.
-            (prefix, name) = metric.path.rsplit(".", 1)
-            logging.debug("Sending %s %s|g", name, metric.value)
-
-            if metric.metric_type == 'GAUGE':
-                if hasattr(statsd, 'StatsClient'):
-                    self.connection.gauge(metric.path, metric.value)
-                else:
-                    statsd.Gauge(prefix, self.connection).send(
-                        name, metric.value)
-            else:
-                # To send a counter, we need to just send the delta
-                # but without any time delta changes
-                value = metric.raw_value
-                if metric.path in self.old_values:
-                    value = value - self.old_values[metric.path]
-                self.old_values[metric.path] = metric.raw_value
-
-                if hasattr(statsd, 'StatsClient'):
-                    self.connection.incr(metric.path, value)
-                else:
-                    statsd.Counter(prefix, self.connection).increment(
-                        name, value)
+            for line in self._format(metric):
+                self._add_line(line)
+        self._send_packet()
 
         self.metrics = []
 
@@ -143,20 +207,24 @@ class StatsdHandler(Handler):
 
     def _connect(self):
         """
-        Connect to the statsd server
+        Create a non-blocking socket to the statsd server
         """
-        if not statsd:
+        try:
+            addrinfo = socket.getaddrinfo(self.host, self.port, 0,
+                                          socket.SOCK_DGRAM)
+        except socket.gaierror, ex:
+            self._throttle_error("StatsdHandler: Error looking up statsd host"
+                                 " '%s' - %s", self.host, ex)
             return
 
-        if hasattr(statsd, 'StatsClient'):
-            self.connection = statsd.StatsClient(
-                host=self.host,
-                port=self.port
-            )
-        else:
-            # Create socket
-            self.connection = statsd.Connection(
-                host=self.host,
-                port=self.port,
-                sample_rate=1.0
-            )
+        family, socktype, proto, _, self.address = addrinfo[0]
+        self.socket = socket.socket(family, socktype, proto)
+        self.socket.setblocking(0)
+
+    def _close(self):
+        """
+        Close the socket
+        """
+        if getattr(self, 'socket', None) is not None:
+            self.socket.close()
+        self.socket = None
@@ -146,11 +146,13 @@ class StatsiteHandler(Handler):
                 data = data.split()
                 data = data[0] + ":" + data[1] + "|kv\n"
                 self.socket.sendall(data)
+                self._record_success()
                 # Done
                 break
             except socket.error, e:
                 # Log Error
                 self.log.error("StatsiteHandler: Failed sending data. %s.", e)
+                self._record_failure()
                 # Attempt to restablish connection
                 self._close()
                 # Decrement retry
@@ -187,6 +189,7 @@ class StatsiteHandler(Handler):
             # Log Error
             self.log.error("StatsiteHandler: Failed to connect to %s:%i. %s",
                            self.host, self.port, ex)
+            self._record_failure()
             # Close Socket
             self._close()
             return
@@ -0,0 +1,104 @@
+# coding=utf-8
+##########################################################################
+
+"""
+A local HTTP stand-in for testing HTTP based handlers. It records every
+request it receives and answers with a configurable status code.
+"""
+
+import BaseHTTPServer
+import gzip
+import SocketServer
+import threading
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+class RecordedRequest(object):
+
+    def __init__(self, method, path, headers, body, client_address):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.raw_body = body
+        self.client_address = client_address
+
+    @property
+    def body(self):
+        """
+        The request body, decompressed if it was sent gzip encoded
+        """
+        if self.headers.get('content-encoding') == 'gzip':
+            return gzip.GzipFile(fileobj=StringIO(self.raw_body)).read()
+        return self.raw_body
+
+
+class _RecordingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _record(self):
+        length = int(self.headers.get('content-length', 0))
+        body = self.rfile.read(length)
+        self.server.requests.append(RecordedRequest(
+            self.command, self.path, dict(self.headers.items()), body,
+            self.client_address))
+
+        status = self.server.status
+        if self.server.statuses:
+            status = self.server.statuses.pop(0)
+        response = self.server.response_body
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(response)))
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(response)
+        if self.server.close_idle:
+            # Like a server timing out idle keep-alive connections
+            self.close_connection = 1
+
+    do_GET = _record
+    do_POST = _record
+    do_PUT = _record
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHTTPServer(SocketServer.ThreadingMixIn,
+                      BaseHTTPServer.HTTPServer):
+    """
+    Serves on an ephemeral port of localhost from a background thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self, status=200, response_body='{}'):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _RecordingHandler)
+        self.requests = []
+        self.status = status
+        self.statuses = []
+        self.response_body = response_body
+        self.close_idle = False
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
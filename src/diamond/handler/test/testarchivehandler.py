@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import gzip
+import os
+import shutil
+import tempfile
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.archive import ArchiveHandler
+from diamond.handler.archive import read_archive
+from diamond.handler.archive import read_index
+from diamond.metric import Metric
+
+
+class TestArchiveHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmpdir, 'archive.log')
+
+        config = configobj.ConfigObj()
+        config['log_file'] = self.log_file
+        config['batch'] = 2
+        config['days'] = 0
+        self.handler = ArchiveHandler(config)
+
+    def tearDown(self):
+        self.handler.writer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_batched_writes(self):
+        self.handler.process(Metric('servers.www.cpu.idle', 1,
+                                    timestamp=100))
+        self.handler.writer.flush()
+        self.assertFalse(os.path.exists(self.log_file))
+
+        self.handler.process(Metric('servers.www.cpu.user', 2.5,
+                                    timestamp=100, precision=1))
+        self.handler.process(Metric('servers.www.cpu.idle', -3,
+                                    timestamp=110))
+        self.handler.flush()
+
+        with open(self.log_file) as f:
+            self.assertEqual(f.read(),
+                             'servers.www.cpu.idle 1 100\n'
+                             'servers.www.cpu.user 2.5 100\n'
+                             'servers.www.cpu.idle -3 110\n')
+
+    def test_rotate_compress_and_read(self):
+        for timestamp in (100, 110, 120):
+            self.handler.process(Metric('servers.www.cpu.idle', timestamp,
+                                        timestamp=timestamp))
+        self.handler.flush()
+        self.handler.writer.rotate()
+        self.handler.writer.join()
+
+        for timestamp in (130, 140):
+            self.handler.process(Metric('servers.www.cpu.idle', timestamp,
+                                        timestamp=timestamp))
+        self.handler.flush()
+
+        segments = read_index(self.log_file)
+        self.assertEqual(len(segments), 1)
+        path, first, last, count = segments[0]
+        self.assertTrue(path.endswith('.gz'))
+        self.assertEqual((first, last, count), (100, 120, 3))
+        self.assertEqual(gzip.open(path).read().count('\n'), 3)
+
+        timestamps = [m.timestamp for m in read_archive(self.log_file)]
+        self.assertEqual(timestamps, [100, 110, 120, 130, 140])
+
+        metrics = list(read_archive(self.log_file, start=110, end=130))
+        self.assertEqual([m.timestamp for m in metrics], [110, 120, 130])
+        self.assertEqual(metrics[0].value, 110)
+
+        # Only the current file overlaps, the segment is not opened
+        with open(path, 'w') as f:
+            f.write('not gzip')
+        timestamps = [m.timestamp for m in read_archive(self.log_file,
+                                                        start=125)]
+        self.assertEqual(timestamps, [130, 140])
+
+    def test_restart_keeps_counting_the_current_file(self):
+        for timestamp in (100, 110):
+            self.handler.process(Metric('servers.www.cpu.idle', 1,
+                                        timestamp=timestamp))
+        self.handler.flush()
+        self.handler.writer.close()
+
+        config = configobj.ConfigObj()
+        config['log_file'] = self.log_file
+        config['batch'] = 1
+        config['days'] = 0
+        config['encoding'] = 'utf-8'
+        self.handler = ArchiveHandler(config)
+        self.assertTrue(self.handler.writer.inherited)
+        self.handler.process(Metric('servers.www.cpu.idle', 1,
+                                    timestamp=120))
+        self.handler.writer.rotate()
+        self.handler.writer.join()
+
+        path, first, last, count = read_index(self.log_file)[0]
+        self.assertEqual((first, last, count), (100, 120, 3))
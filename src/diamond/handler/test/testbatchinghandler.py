@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import time
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.Handler import BatchingHandler
+from diamond.metric import Metric
+
+
+class RecordingHandler(BatchingHandler):
+
+    def __init__(self, config=None, failures=0):
+        BatchingHandler.__init__(self, config)
+        self.payloads = []
+        self.failures = failures
+
+    def send(self, payload):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('unreachable')
+        self.payloads.append(payload)
+
+
+class TestBatchingHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.config = configobj.ConfigObj()
+
+    def metric(self, i):
+        return Metric('servers.www1.cpu.total.idle', i, timestamp=1234567)
+
+    def test_batches_are_sent_when_full(self):
+        self.config['batch'] = 2
+        handler = RecordingHandler(self.config)
+        for i in range(5):
+            handler.process(self.metric(i))
+        self.assertEqual(len(handler.payloads), 2)
+        handler.flush()
+
+        self.assertEqual(handler.payloads, [
+            'servers.www1.cpu.total.idle 0 1234567\n'
+            'servers.www1.cpu.total.idle 1 1234567\n',
+            'servers.www1.cpu.total.idle 2 1234567\n'
+            'servers.www1.cpu.total.idle 3 1234567\n',
+            'servers.www1.cpu.total.idle 4 1234567\n'])
+        self.assertEqual(handler.batch_sizes, {1: 1, 2: 2})
+        self.assertEqual(handler.batches_sent, 3)
+
+    def test_batches_are_sent_by_size(self):
+        self.config['batch'] = 100
+        self.config['batch_max_bytes'] = 100
+        handler = RecordingHandler(self.config)
+        for i in range(5):
+            handler.process(self.metric(i))
+
+        # 38 bytes per line
+        self.assertEqual([len(p) for p in handler.payloads], [114])
+
+    def test_failed_batches_are_retried(self):
+        self.config['batch_retries'] = 2
+        self.config['batch_retry_backoff'] = 0
+        handler = RecordingHandler(self.config, failures=2)
+        handler.process(self.metric(0))
+
+        self.assertEqual(len(handler.payloads), 1)
+        self.assertEqual(handler.batches_failed, 0)
+
+        handler.failures = 3
+        handler.process(self.metric(1))
+        self.assertEqual(len(handler.payloads), 1)
+        self.assertEqual(handler.batches_failed, 1)
+        self.assertEqual(handler.batches_sent, 1)
+
+    def test_stats(self):
+        self.config['batch'] = 2
+        handler = RecordingHandler(self.config, failures=1)
+        for i in range(5):
+            handler.process(self.metric(i))
+        handler.flush()
+
+        stats = handler.get_stats()
+        self.assertEqual(stats['batches_sent'], 2)
+        self.assertEqual(stats['batches_failed'], 1)
+        self.assertEqual(stats['batch_size_1'], 1)
+        self.assertEqual(stats['batch_size_2'], 2)
+        self.assertEqual(stats['total_flush_seconds'],
+                         handler.total_flush_seconds)
+
+    def test_due_batches_are_sent_by_the_timer(self):
+        self.config['batch'] = 100
+        self.config['batch_max_interval'] = 0.1
+        handler = RecordingHandler(self.config)
+        handler.process(self.metric(0))
+
+        deadline = time.time() + 5
+        while not handler.payloads and time.time() < deadline:
+            time.sleep(0.05)
+        handler.timer_stop.set()
+
+        self.assertEqual(handler.payloads,
+                         ['servers.www1.cpu.total.idle 0 1234567\n'])
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import urlparse
+
+from test import unittest
+from mock import patch
+
+import configobj
+
+from diamond.handler.cloudwatch import cloudwatchHandler
+from diamond.metric import Metric
+from localhttp import LocalHTTPServer
+
+try:
+    import boto
+    import boto.ec2.cloudwatch
+    import boto.utils
+    from boto.regioninfo import RegionInfo
+except ImportError:
+    boto = None
+
+RESPONSE = ('<PutMetricDataResponse '
+            'xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">'
+            '<ResponseMetadata><RequestId>1</RequestId></ResponseMetadata>'
+            '</PutMetricDataResponse>')
+
+
+@unittest.skipIf(boto is None, 'boto is not installed')
+class TestCloudwatchHandler(unittest.TestCase):
+
+    def setUp(self):
+        # A local stand-in for the CloudWatch endpoint
+        self.server = LocalHTTPServer(response_body=RESPONSE).start()
+        connection = boto.ec2.cloudwatch.CloudWatchConnection(
+            aws_access_key_id='key', aws_secret_access_key='secret',
+            region=RegionInfo(name='local', endpoint='127.0.0.1'),
+            port=self.server.port, is_secure=False)
+
+        patchers = [
+            patch.object(boto.utils, 'get_instance_metadata',
+                         return_value={'instance-id': 'i-1234'}),
+            patch.object(boto.ec2.cloudwatch, 'connect_to_region',
+                         return_value=connection),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.config = configobj.ConfigObj()
+        self.config['region'] = 'local'
+        self.config['LoadAvg01'] = {'collector': 'loadavg', 'metric': '01',
+                                    'namespace': 'MachineLoad',
+                                    'name': 'Avg01', 'unit': 'None'}
+        self.config['MemFree'] = {'collector': 'memory', 'metric': 'MemFree',
+                                  'namespace': 'Memory', 'name': 'Free',
+                                  'unit': 'Bytes'}
+
+    def tearDown(self):
+        self.server.stop()
+
+    def params(self):
+        return [dict(urlparse.parse_qsl(r.body))
+                for r in self.server.requests]
+
+    def test_values_are_aggregated_per_period(self):
+        handler = cloudwatchHandler(self.config)
+        for i, value in enumerate((1, 3, 2)):
+            handler.process(Metric('servers.host.loadavg.01', value,
+                                   timestamp=1200 + i))
+        handler.process(Metric('servers.host.loadavg.05', 9,
+                               timestamp=1200))
+        handler.process(Metric('servers.host.memory.MemFree', 1024,
+                               timestamp=1260))
+        handler.flush()
+
+        params = sorted(self.params(), key=lambda p: p['Namespace'])
+        self.assertEqual(len(params), 2)
+        load = params[0]
+        self.assertEqual(load['Namespace'], 'MachineLoad')
+        self.assertEqual(load['MetricData.member.1.MetricName'], 'Avg01')
+        self.assertEqual(load['MetricData.member.1.Timestamp'],
+                         '1970-01-01T00:20:00')
+        self.assertEqual(
+            load['MetricData.member.1.Dimensions.member.1.Value'], 'i-1234')
+        self.assertEqual(
+            load['MetricData.member.1.StatisticValues.SampleCount'], '3')
+        self.assertEqual(load['MetricData.member.1.StatisticValues.Sum'],
+                         '6.0')
+        self.assertEqual(
+            load['MetricData.member.1.StatisticValues.Maximum'], '3.0')
+        self.assertEqual(
+            load['MetricData.member.1.StatisticValues.Minimum'], '1.0')
+        self.assertFalse('MetricData.member.2.MetricName' in load)
+        self.assertEqual(params[1]['MetricData.member.1.Unit'], 'Bytes')
+
+    def test_datums_are_sent_in_chunks(self):
+        self.config['max_datums'] = 20
+        handler = cloudwatchHandler(self.config)
+        for i in range(45):
+            handler.process(Metric('servers.host.loadavg.01', i,
+                                   timestamp=60 * i))
+        handler.flush()
+
+        sizes = [len([k for k in p if k.endswith('.MetricName')])
+                 for p in self.params()]
+        self.assertEqual(sizes, [20, 20, 5])
+        handler.flush()
+        self.assertEqual(len(self.server.requests), 3)
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import json
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.datadog import DatadogHandler
+from diamond.metric import Metric
+from localhttp import LocalHTTPServer
+
+
+class TestDatadogHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalHTTPServer(status=202).start()
+
+        self.config = configobj.ConfigObj()
+        self.config['api_key'] = 'KEY'
+        self.config['url'] = self.server.url + '/api/v1/series'
+        self.config['queue_size'] = 1000
+
+    def tearDown(self):
+        self.server.stop()
+
+    def metrics(self, count, hosts=('www1', 'www2')):
+        for i in range(count):
+            for host in hosts:
+                yield Metric('servers.%s.cpu.total.idle' % host, i,
+                             timestamp=1234567 + i, host=host)
+
+    def test_one_request_per_flush(self):
+        handler = DatadogHandler(self.config)
+        for metric in self.metrics(3):
+            handler.process(metric)
+        handler.flush()
+        handler.client.close()
+
+        self.assertEqual(len(self.server.requests), 1)
+        request = self.server.requests[0]
+        self.assertEqual(request.path, '/api/v1/series?api_key=KEY')
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertEqual(json.loads(request.body), {'series': [
+            {'metric': 'servers.cpu.total.idle', 'host': 'www1',
+             'type': 'gauge',
+             'points': [[1234567, 0], [1234568, 1], [1234569, 2]]},
+            {'metric': 'servers.cpu.total.idle', 'host': 'www2',
+             'type': 'gauge',
+             'points': [[1234567, 0], [1234568, 1], [1234569, 2]]},
+        ]})
+
+    def test_tags_are_sent(self):
+        handler = DatadogHandler(self.config)
+        for device in ('sda', 'sdb'):
+            handler.process(Metric('servers.www1.diskspace.free', 1,
+                                   timestamp=1234567, host='www1',
+                                   tags={'device': device, 'mount': '/'}))
+        handler.flush()
+        handler.client.close()
+
+        series = json.loads(self.server.requests[0].body)['series']
+        self.assertEqual([s['tags'] for s in series],
+                         [['device:sda', 'mount:/'],
+                          ['device:sdb', 'mount:/']])
+        self.assertEqual(set(s['metric'] for s in series),
+                         set(['servers.diskspace.free']))
+
+    def test_payloads_are_split_by_size(self):
+        self.config['max_payload_size'] = 2000
+        handler = DatadogHandler(self.config)
+        hosts = ['www%d' % i for i in range(100)]
+        for metric in self.metrics(1, hosts):
+            handler.process(metric)
+        handler.flush()
+        handler.client.close()
+
+        self.assertTrue(len(self.server.requests) > 1)
+        series = []
+        for request in self.server.requests:
+            self.assertTrue(len(request.body) <= 2000)
+            series.extend(json.loads(request.body)['series'])
+        self.assertEqual([s['host'] for s in series], hosts)
+
+        clients = set(r.client_address for r in self.server.requests)
+        self.assertEqual(len(clients), 1)
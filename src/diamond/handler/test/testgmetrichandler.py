@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import socket
+
+from test import unittest
+
+import configobj
+
+from diamond import gmetric
+from diamond.handler.g_metric import GmetricHandler
+from diamond.metric import Metric
+
+
+class TestGmetricHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(1)
+
+        self.config = configobj.ConfigObj()
+        self.config['host'] = '127.0.0.1'
+        self.config['port'] = self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+
+    def receive(self, count):
+        return [self.server.recv(65536) for i in range(count)]
+
+    def test_metadata_is_sent_once_per_interval(self):
+        handler = GmetricHandler(self.config)
+        for value in (1, 2):
+            handler.process(Metric('servers.www1.cpu.total.idle', value))
+        handler.process(Metric('servers.www1.cpu.total.user', 3))
+        handler.flush()
+
+        expected = []
+        for name, value in (('servers.www1.cpu.total.idle', 1),
+                            ('servers.www1.cpu.total.user', 3)):
+            expected.append(gmetric.gmetric_write(
+                name, value, 'double', '', 'both', 60, 0, ''))
+        self.assertEqual(self.receive(5), [
+            expected[0][0], expected[0][1],
+            gmetric.gmetric_write('servers.www1.cpu.total.idle', 2, 'double',
+                                  '', 'both', 60, 0, '')[1],
+            expected[1][0], expected[1][1]])
+
+    def test_metadata_is_resent(self):
+        self.config['metadata_interval'] = 0
+        handler = GmetricHandler(self.config)
+        for value in (1, 2):
+            handler.process(Metric('servers.www1.cpu.total.idle', value))
+        handler.flush()
+
+        self.assertEqual(len(self.receive(4)), 4)
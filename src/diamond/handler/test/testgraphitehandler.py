@@ -218,3 +218,27 @@ class TestGraphiteHandler(unittest.TestCase):
 
 if __name__ == "__main__":
     unittest.main()
+
+    def test_tags_template(self):
+        config = configobj.ConfigObj()
+        config['tags_template'] = '{path}{tags}'
+        handler = mod.GraphiteHandler(config)
+        handler._send = Mock()
+
+        handler.process(Metric('servers.www1.network.eth0.rx_byte', 1,
+                               timestamp=1234567, tags={'device': 'eth0'}))
+        handler.process(Metric('servers.www1.cpu.total.idle', 1,
+                               timestamp=1234567))
+
+        self.assertEqual(handler.metrics, [
+            'servers.www1.network.eth0.rx_byte;device=eth0 1 1234567\n',
+            'servers.www1.cpu.total.idle 1 1234567\n'])
+
+    def test_tags_template_missing_tag(self):
+        config = configobj.ConfigObj()
+        config['tags_template'] = 'devices.{device}.{path}'
+        handler = mod.GraphiteHandler(config)
+
+        metric = Metric('servers.www1.cpu.total.idle', 1,
+                        tags={'instance': 'vm1'})
+        self.assertEqual(handler._get_path(metric), metric.path)
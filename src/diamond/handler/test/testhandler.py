@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import time
+
+from test import unittest
+
+import configobj
+from mock import patch
+
+from diamond.handler.Handler import Handler
+from diamond.metric import HistogramMetric
+from diamond.metric import Metric
+from diamond.sketch import QuantileSketch
+
+
+class FlakyHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.up = False
+        self.calls = 0
+        self.processed = []
+
+    def process(self, metric):
+        self.calls += 1
+        if not self.up:
+            self._record_failure()
+            return
+        self.processed.append(metric.value)
+        self._record_success()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.config = configobj.ConfigObj()
+        self.config['breaker_failures'] = 3
+        self.config['breaker_delay'] = 60
+
+    def metric(self, i):
+        return Metric('servers.www1.cpu.total.idle', i, timestamp=1234567)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        handler = FlakyHandler(self.config)
+        for i in range(10):
+            handler._process(self.metric(i))
+
+        self.assertEqual(handler.calls, 3)
+        self.assertEqual(handler.breaker_state, 'open')
+        self.assertEqual(handler.get_stats()['breaker_dropped'], 7)
+
+    def test_probe_delay_doubles(self):
+        handler = FlakyHandler(self.config)
+        for i in range(3):
+            handler._process(self.metric(i))
+
+        handler.breaker_probe_time = time.time()
+        handler._process(self.metric(3))
+        self.assertEqual(handler.calls, 4)
+        self.assertEqual(handler.breaker_state, 'open')
+        self.assertEqual(handler.breaker_delay, 120)
+
+        handler.up = True
+        handler.breaker_probe_time = time.time()
+        handler._process(self.metric(4))
+        self.assertEqual(handler.breaker_state, 'closed')
+        self.assertEqual(handler.breaker_delay, 60)
+
+    def test_spilled_metrics_are_replayed(self):
+        self.config['breaker_spill_size'] = 2
+        handler = FlakyHandler(self.config)
+        for i in range(6):
+            handler._process(self.metric(i))
+        self.assertEqual(handler.get_stats()['breaker_spilled'], 2)
+        self.assertEqual(handler.get_stats()['breaker_dropped'], 1)
+
+        handler.up = True
+        handler.breaker_probe_time = time.time()
+        handler._process(self.metric(6))
+        self.assertEqual(handler.processed, [6, 4, 5])
+
+    def test_exceptions_are_failures(self):
+        handler = FlakyHandler(self.config)
+        handler.process = None
+        for i in range(3):
+            handler._process(self.metric(i))
+        self.assertEqual(handler.breaker_state, 'open')
+
+    def test_calls_without_exceptions_are_successes(self):
+        def process(metric):
+            if metric.value % 2 == 0:
+                raise IOError('unreachable')
+
+        handler = FlakyHandler(self.config)
+        handler.process = process
+        for i in range(20):
+            handler._process(self.metric(i))
+        self.assertEqual(handler.breaker_state, 'closed')
+        self.assertEqual(handler.consecutive_failures, 0)
+
+    def test_open_breaker_does_not_update_dedup(self):
+        self.config['dedup'] = True
+        handler = FlakyHandler(self.config)
+        for i in range(3):
+            handler._process(self.metric(i))
+        handler._process(self.metric(7))
+        self.assertEqual(handler.breaker_dropped, 1)
+
+        handler.up = True
+        handler.breaker_probe_time = time.time()
+        handler._process(self.metric(7))
+        self.assertEqual(handler.processed, [7])
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.config = configobj.ConfigObj()
+        self.config['dedup'] = True
+        self.config['dedup_heartbeat'] = 3
+
+    def test_unchanged_values_are_suppressed(self):
+        handler = FlakyHandler(self.config)
+        handler.up = True
+        for value in (1, 1, 1, 1, 2, 2, 1):
+            handler._process(Metric('servers.www1.disk.total', value))
+
+        self.assertEqual(handler.processed, [1, 1, 2, 1])
+        stats = handler.get_stats()
+        self.assertEqual((stats['dedup_sent'], stats['dedup_suppressed'],
+                          stats['dedup_paths']), (4, 3, 1))
+
+    def test_paths_are_evicted(self):
+        self.config['dedup_max_paths'] = 4
+        handler = FlakyHandler(self.config)
+        handler.up = True
+        for i in range(3):
+            handler._process(Metric('servers.www1.disk.%d' % i, 0))
+        handler._process(Metric('servers.www1.disk.0', 0))
+        self.assertEqual(handler.dedup_suppressed, 1)
+
+        for i in range(3, 7):
+            handler._process(Metric('servers.www1.disk.%d' % i, 0))
+        self.assertTrue(handler.get_stats()['dedup_paths'] <= 4)
+        handler._process(Metric('servers.www1.disk.1', 0))
+        self.assertEqual(handler.dedup_suppressed, 1)
+
+    @patch('diamond.handler.Handler.hash', create=True, return_value=1)
+    def test_paths_with_the_same_hash_are_kept_apart(self, hash_mock):
+        handler = FlakyHandler(self.config)
+        handler.up = True
+        handler._process(Metric('servers.www1.disk.0', 0))
+        handler._process(Metric('servers.www1.disk.1', 0))
+
+        self.assertEqual(handler.processed, [0, 0])
+
+    def test_series_differing_by_tags_are_kept_apart(self):
+        handler = FlakyHandler(self.config)
+        handler.up = True
+        for mode in ('idle', 'user', 'idle', 'user'):
+            handler._process(Metric('servers.www1.go.cpu', 0,
+                                    tags={'mode': mode}))
+
+        self.assertEqual(handler.processed, [0, 0])
+        self.assertEqual(handler.dedup_suppressed, 2)
+
+    def test_histograms_are_expanded(self):
+        handler = FlakyHandler(self.config)
+        handler.up = True
+        sketch = QuantileSketch()
+        sketch.add(5)
+        for i in range(2):
+            handler._process(HistogramMetric('servers.www1.http.latency',
+                                             sketch, percentiles=['50']))
+
+        # count, sum and p50, deduplicated the second time
+        self.assertEqual(handler.processed, [1, 5, 5])
+        self.assertEqual(handler.dedup_suppressed, 3)
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import socket
+
+from test import unittest
+
+from diamond.handler.httpclient import HTTPClient
+from diamond.handler.httpclient import HTTPClientError
+from localhttp import LocalHTTPServer
+
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalHTTPServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connections_are_kept_alive(self):
+        client = HTTPClient(self.server.url + '/write?db=graphite')
+        for i in range(3):
+            client.post('line %d' % i)
+        client.close()
+
+        self.assertEqual([r.body for r in self.server.requests],
+                         ['line 0', 'line 1', 'line 2'])
+        self.assertEqual(
+            len(set(r.client_address for r in self.server.requests)), 1)
+        self.assertEqual(self.server.requests[0].path, '/write?db=graphite')
+
+    def test_compression_and_auth(self):
+        client = HTTPClient(self.server.url, compress=True,
+                            username='root', password='secret')
+        client.post('x' * 1000)
+        client.close()
+
+        request = self.server.requests[0]
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertTrue(len(request.raw_body) < 100)
+        self.assertEqual(request.body, 'x' * 1000)
+        self.assertEqual(request.headers['authorization'],
+                         'Basic cm9vdDpzZWNyZXQ=')
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses = [503, 500]
+        client = HTTPClient(self.server.url, retries=2, backoff=0)
+        self.assertEqual(client.post('data').status, 200)
+        client.close()
+
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_raised(self):
+        self.server.statuses = [400]
+        client = HTTPClient(self.server.url, retries=2, backoff=0)
+        try:
+            client.post('data')
+            self.fail('HTTPClientError not raised')
+        except HTTPClientError, e:
+            self.assertEqual(e.status, 400)
+        client.close()
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_concurrent_requests(self):
+        client = HTTPClient(self.server.url, max_in_flight=4)
+        for i in range(20):
+            client.submit(str(i))
+        client.join()
+        client.close()
+
+        self.assertEqual(sorted(int(r.body) for r in self.server.requests),
+                         range(20))
+
+    def test_workers_survive_unexpected_errors(self):
+        client = HTTPClient(self.server.url, max_in_flight=2)
+        post = client.post
+        calls = []
+
+        def flaky_post(body, url=None, headers=None):
+            calls.append(body)
+            if len(calls) <= 2:
+                raise ValueError('unexpected')
+            return post(body, url, headers)
+        client.post = flaky_post
+
+        for i in range(6):
+            client.submit(str(i))
+        client.join()
+        client.close()
+
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_closed_idle_connections_are_retried(self):
+        self.server.close_idle = True
+        client = HTTPClient(self.server.url, retries=0)
+        for i in range(3):
+            client.post('line %d' % i)
+        client.close()
+
+        self.assertEqual([r.body for r in self.server.requests],
+                         ['line 0', 'line 1', 'line 2'])
+
+    def test_stale_connections_are_retried_once(self):
+        class StaleConnection(object):
+            def request(self, *args):
+                raise socket.error('connection reset')
+
+            def close(self):
+                pass
+
+        client = HTTPClient(self.server.url, retries=2, backoff=0)
+        attempts = []
+
+        def get_connection(scheme, netloc, pooled=True):
+            attempts.append(pooled)
+            return StaleConnection(), pooled
+        client._get_connection = get_connection
+
+        self.assertRaises(HTTPClientError, client.post, 'data')
+        self.assertEqual(attempts, [True, False, False, False])
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from mock import patch
+
+import configobj
+
+from diamond.handler.influxdbHandler import InfluxdbHandler
+from diamond.handler.influxdbHandler import InfluxdbTemplate
+from diamond.metric import Metric
+from localhttp import LocalHTTPServer
+
+
+class TestInfluxdbTemplate(unittest.TestCase):
+
+    def test_filter(self):
+        template = InfluxdbTemplate('.host.measurement*', filter='servers.*')
+        self.assertTrue(template.match(['servers', 'www', 'cpu']))
+        self.assertFalse(template.match(['instances', 'www', 'cpu']))
+        self.assertFalse(template.match(['servers']))
+
+    def test_apply(self):
+        template = InfluxdbTemplate('.host.measurement.cpu.field*')
+        self.assertEqual(
+            template.apply('servers.www.cpu.total.idle'.split('.')),
+            ('cpu', [('cpu', 'total'), ('host', 'www')], 'idle'))
+
+    def test_apply_defaults(self):
+        template = InfluxdbTemplate('.host')
+        self.assertEqual(
+            template.apply('servers.www.cpu.total.idle'.split('.')),
+            ('servers.www.cpu.total.idle', [('host', 'www')], 'value'))
+
+
+class TestInfluxdbHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalHTTPServer(status=204, response_body='').start()
+
+        self.config = configobj.ConfigObj()
+        self.config['hostname'] = '127.0.0.1'
+        self.config['port'] = self.server.port
+        self.config['protocol'] = 'line'
+        self.config['database'] = 'diamond'
+        self.config['batch_size'] = 2
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_line_protocol(self):
+        self.config['templates'] = ['servers.* .host.measurement*']
+        handler = InfluxdbHandler(self.config)
+
+        handler.process(Metric('servers.www.cpu.total.idle', 5,
+                               timestamp=1234567))
+        handler.process(Metric('other.www.cpu total', 1.5,
+                               timestamp=1234567))
+        handler._close()
+
+        self.assertEqual(len(self.server.requests), 1)
+        request = self.server.requests[0]
+        self.assertEqual(request.path, '/write?db=diamond&precision=s')
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertEqual(request.body,
+                         'cpu.total.idle,host=www value=5.0 1234567\n'
+                         'other.www.cpu\\ total value=1.5 1234567\n')
+
+    def test_metric_tags(self):
+        self.config['templates'] = ['servers.* .host.measurement*']
+        handler = InfluxdbHandler(self.config)
+
+        handler.process(Metric('servers.www.network.eth0.rx_byte', 5,
+                               timestamp=1234567, tags={'device': 'eth0'}))
+        handler.process(Metric('servers.www.network.eth1.rx_byte', 1,
+                               timestamp=1234567, tags={'device': 'eth1'}))
+        handler._close()
+
+        self.assertEqual(self.server.requests[0].body,
+                         'network.eth0.rx_byte,device=eth0,host=www '
+                         'value=5.0 1234567\n'
+                         'network.eth1.rx_byte,device=eth1,host=www '
+                         'value=1.0 1234567\n')
+
+    def test_connection_is_reused(self):
+        handler = InfluxdbHandler(self.config)
+
+        for i in range(6):
+            handler.process(Metric('servers.www.cpu.total.idle', i,
+                                   timestamp=1234567 + i))
+        handler._close()
+
+        self.assertEqual(len(self.server.requests), 3)
+        clients = set(r.client_address for r in self.server.requests)
+        self.assertEqual(len(clients), 1)
+
+    def test_time_based_flush(self):
+        self.config['batch_size'] = 100
+        self.config['batch_interval'] = 10
+        handler = InfluxdbHandler(self.config)
+
+        with patch('time.time') as mock_time:
+            mock_time.return_value = handler.batch_timestamp + 1
+            handler.process(Metric('servers.www.cpu.total.idle', 0,
+                                   timestamp=1234567))
+            handler.flush()
+            self.assertEqual(len(self.server.requests), 0)
+
+            mock_time.return_value = handler.batch_timestamp + 11
+            handler.flush()
+        handler._close()
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(handler.batch_count, 0)
+
+    def test_failed_send_keeps_batch(self):
+        self.server.status = 500
+        handler = InfluxdbHandler(self.config)
+
+        handler.process(Metric('servers.www.cpu.total.idle', 0,
+                               timestamp=1234567))
+        self.assertRaises(Exception, handler.process,
+                          Metric('servers.www.cpu.total.idle', 1,
+                                 timestamp=1234568))
+        self.assertEqual(handler.batch_count, 2)
+
+        # backing off, nothing is sent
+        handler.process(Metric('servers.www.cpu.total.idle', 2,
+                               timestamp=1234569))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(handler.batch_count, 3)
+
+    def test_non_finite_values_are_skipped(self):
+        handler = InfluxdbHandler(self.config)
+
+        handler.process(Metric('servers.www.cpu.total.idle', float('nan'),
+                               timestamp=1234567))
+        handler.process(Metric('servers.www.cpu.total.user', float('inf'),
+                               timestamp=1234567))
+        self.assertEqual(handler.batch_count, 0)
+        handler.process(Metric('servers.www.cpu.total.idle', 1,
+                               timestamp=1234567))
+        handler.process(Metric('servers.www.cpu.total.user', 2,
+                               timestamp=1234567))
+        handler._close()
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_failed_reconnect_backs_off(self):
+        handler = InfluxdbHandler(self.config)
+        handler._close()
+
+        with patch.object(InfluxdbHandler, '_connect') as connect:
+            for i in range(3):
+                handler.process(Metric('servers.www.cpu.total.idle', i,
+                                       timestamp=1234567 + i))
+        # The second metric fills the batch, the third waits
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(handler.time_multiplier, 2)
+        self.assertTrue(handler.retry_timestamp > 0)
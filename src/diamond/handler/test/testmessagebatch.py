@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from mock import patch
+
+import configobj
+
+import diamond.handler.rabbitmq_topic as rabbitmq_topic
+import diamond.handler.zmq_pubsub as zmq_pubsub
+from diamond.handler.messagebatch import MessageBatch
+from diamond.metric import Metric
+
+
+def metric(i, host='www1'):
+    return Metric('servers.%s.cpu.total.idle' % host, i,
+                  timestamp=1234567, host=host)
+
+
+class TestMessageBatch(unittest.TestCase):
+
+    def test_messages_are_capped(self):
+        batch = MessageBatch(10)
+        self.assertEqual(batch.add('a', 'abcd\n'), None)
+        self.assertEqual(batch.add('b', 'xyz\n'), None)
+        self.assertEqual(batch.add('a', 'efgh\n'), None)
+        self.assertEqual(batch.add('a', 'ijkl\n'), 'abcd\nefgh\n')
+        self.assertEqual(batch.drain(), [('a', 'ijkl\n'), ('b', 'xyz\n')])
+        self.assertEqual(len(batch), 0)
+
+
+class TestZmqBatch(unittest.TestCase):
+
+    @patch.object(zmq_pubsub, 'zmq')
+    def test_one_message_per_flush(self, zmq):
+        config = configobj.ConfigObj()
+        config['batch'] = True
+        handler = zmq_pubsub.zmqHandler(config)
+        for i in range(3):
+            handler.process(metric(i))
+        handler.flush()
+
+        socket = zmq.Context.return_value.socket.return_value
+        self.assertEqual([c[0][0] for c in socket.send.call_args_list], [
+            'servers.www1.cpu.total.idle 0 1234567\n'
+            'servers.www1.cpu.total.idle 1 1234567\n'
+            'servers.www1.cpu.total.idle 2 1234567\n'])
+
+
+class TestRabbitMQTopicBatch(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(rabbitmq_topic, 'pika')
+        self.pika = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel = self.pika.BlockingConnection.return_value.channel()
+
+        self.config = configobj.ConfigObj()
+        self.config['batch'] = True
+        self.config['routing_key'] = 'host'
+
+    def published(self):
+        return [(c[1]['routing_key'], c[1]['body'].count('\n'))
+                for c in self.channel.basic_publish.call_args_list]
+
+    def test_one_message_per_routing_key(self):
+        handler = rabbitmq_topic.rmqHandler(self.config)
+        for i in range(3):
+            handler.process(metric(i, 'www1'))
+            handler.process(metric(i, 'www2'))
+        handler.flush()
+
+        self.assertEqual(self.published(), [('www1', 3), ('www2', 3)])
+
+    def test_failed_messages_are_kept(self):
+        handler = rabbitmq_topic.rmqHandler(self.config)
+        self.channel.basic_publish.side_effect = [Exception('closed'),
+                                                  None, None]
+        handler.process(metric(0, 'www1'))
+        handler.flush()
+        self.assertEqual(len(handler.pending), 1)
+
+        handler.process(metric(1, 'www2'))
+        handler.flush()
+        self.assertEqual(handler.pending, [])
+        self.assertEqual(self.published(),
+                         [('www1', 1), ('www1', 1), ('www2', 1)])
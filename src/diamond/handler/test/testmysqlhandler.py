@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+import configobj
+
+import diamond.handler.mysql as mysql
+from diamond.handler.mysql import MySQLHandler
+from diamond.metric import Metric
+
+
+class FakeMySQLdb(object):
+
+    class Error(Exception):
+        pass
+
+    def __init__(self):
+        self.conn = Mock()
+        self.cursor = self.conn.cursor.return_value
+        self.Connect = Mock(return_value=self.conn)
+
+
+class TestMySQLHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.mysqldb = FakeMySQLdb()
+        patcher = patch.object(mysql, 'MySQLdb', self.mysqldb)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.config = configobj.ConfigObj()
+        self.config['batch'] = 3
+
+    def metrics(self, count):
+        for i in range(count):
+            yield Metric('servers.www1.cpu.total.idle', i,
+                         timestamp=1234567 + i)
+
+    def test_rows_are_inserted_in_batches(self):
+        handler = MySQLHandler(self.config)
+        for metric in self.metrics(4):
+            handler.process(metric)
+        handler.flush()
+
+        self.assertEqual(self.mysqldb.cursor.executemany.call_args_list, [
+            (('INSERT INTO metrics (metric, timestamp, value) '
+              'VALUES (%s, %s, %s)',
+              [('servers.www1.cpu.total.idle', 1234567, 0),
+               ('servers.www1.cpu.total.idle', 1234568, 1),
+               ('servers.www1.cpu.total.idle', 1234569, 2)]),),
+            (('INSERT INTO metrics (metric, timestamp, value) '
+              'VALUES (%s, %s, %s)',
+              [('servers.www1.cpu.total.idle', 1234570, 3)]),),
+        ])
+        self.assertEqual(self.mysqldb.conn.commit.call_count, 2)
+
+    def test_rows_are_kept_while_disconnected(self):
+        handler = MySQLHandler(self.config)
+        self.mysqldb.cursor.executemany.side_effect = self.mysqldb.Error(
+            'gone away')
+        for metric in self.metrics(3):
+            handler.process(metric)
+        self.assertEqual(len(handler.rows), 3)
+        self.assertTrue(handler.conn is None)
+
+        self.mysqldb.cursor.executemany.side_effect = None
+        handler.flush()
+        self.assertEqual(handler.rows, [])
+        self.assertEqual(self.mysqldb.Connect.call_count, 2)
+        self.assertEqual(
+            len(self.mysqldb.cursor.executemany.call_args[0][1]), 3)
+
+    def test_staging_table(self):
+        self.config['staging_table'] = 'metrics_staging'
+        self.config['staging_writer'] = 'www1'
+        self.config['staging_interval'] = 60
+        handler = MySQLHandler(self.config)
+        for metric in self.metrics(3):
+            handler.process(metric)
+
+        self.assertEqual(
+            self.mysqldb.cursor.executemany.call_args[0],
+            ('INSERT INTO metrics_staging (metric, timestamp, value, writer) '
+             'VALUES (%s, %s, %s, %s)',
+             [('servers.www1.cpu.total.idle', 1234567 + i, i, 'www1')
+              for i in range(3)]))
+        # Staged rows are moved on their own schedule
+        handler.flush()
+        self.assertFalse(self.mysqldb.cursor.execute.called)
+
+        handler.staging_timestamp -= 60
+        handler.flush()
+        self.assertEqual([c[0] for c in
+                          self.mysqldb.cursor.execute.call_args_list], [
+            ('INSERT INTO metrics (metric, timestamp, value) '
+             'SELECT metric, timestamp, value FROM metrics_staging '
+             'WHERE writer = %s', ('www1',)),
+            ('DELETE FROM metrics_staging WHERE writer = %s', ('www1',)),
+        ])
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import json
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.opentsdb import OpenTSDBHandler
+from diamond.metric import Metric
+from localhttp import LocalHTTPServer
+
+
+class TestOpenTSDBHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalHTTPServer(status=204).start()
+
+        self.config = configobj.ConfigObj()
+        self.config['servers'] = ['127.0.0.1:%d' % self.server.port]
+        self.config['batchsize'] = 3
+        self.config['tags'] = ['dc=eu']
+        self.config['tagsinmetric'] = [r'cpu\.(?P<core>\w+)\..+']
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_tags_are_sent(self):
+        handler = OpenTSDBHandler(self.config)
+        handler.process(Metric('servers.www1.cpu.cpu0.idle', 1,
+                               timestamp=1234567, host='www1'))
+        for device in ('sda', 'sdb'):
+            handler.process(Metric('servers.www1.diskspace.free', 2,
+                                   timestamp=1234567, host='www1',
+                                   tags={'device': device}))
+        handler._close()
+
+        points = json.loads(self.server.requests[0].body)
+        self.assertEqual([(p['metric'], p['tags']) for p in points], [
+            ('cpu.idle', {'hostname': 'www1', 'dc': 'eu', 'core': 'cpu0'}),
+            ('diskspace.free', {'hostname': 'www1', 'dc': 'eu',
+                                'device': 'sda'}),
+            ('diskspace.free', {'hostname': 'www1', 'dc': 'eu',
+                                'device': 'sdb'}),
+        ])
+        self.assertEqual(len(handler.series), 3)
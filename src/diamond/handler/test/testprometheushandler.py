@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import urllib2
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.prometheus import PrometheusHandler
+from diamond.metric import HistogramMetric
+from diamond.metric import Metric
+from diamond.sketch import QuantileSketch
+
+
+class TestPrometheusHandler(unittest.TestCase):
+
+    def setUp(self):
+        config = configobj.ConfigObj()
+        config['listen_address'] = '127.0.0.1'
+        config['port'] = 0
+        self.handler = PrometheusHandler(config)
+
+    def tearDown(self):
+        self.handler._close()
+
+    def metric(self, path, value, host='www1', ttl=None, tags=None):
+        return Metric(path, value, timestamp=1000, host=host, ttl=ttl,
+                      tags=tags)
+
+    def test_scrape(self):
+        self.handler.process(self.metric('servers.www1.cpu.total.idle', 5))
+        self.handler.process(self.metric('servers.www2.cpu.total.idle', 7,
+                                         host='www2'))
+        self.handler.process(self.metric(
+            'servers.www1.network.eth0.rx_byte', 1.5,
+            tags={'device': 'eth0'}))
+
+        port = self.handler.server.server_address[1]
+        body = urllib2.urlopen('http://127.0.0.1:%d/metrics' % port).read()
+
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines.index('# TYPE cpu_total_idle gauge') in (0, 3))
+        self.assertEqual(sorted(lines), [
+            '# TYPE cpu_total_idle gauge',
+            '# TYPE network_eth0_rx_byte gauge',
+            'cpu_total_idle{host="www1"} 5.0',
+            'cpu_total_idle{host="www2"} 7.0',
+            'network_eth0_rx_byte{host="www1",device="eth0"} 1.5'])
+
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen,
+                          'http://127.0.0.1:%d/' % port)
+
+    def test_lines_are_rebuilt_on_change(self):
+        self.handler.process(self.metric('servers.www1.cpu.total.idle', 5))
+        self.handler.render(now=1000)
+        line = self.handler.lines[0]
+
+        self.handler.process(self.metric('servers.www1.cpu.total.idle', 5))
+        self.assertTrue(self.handler.lines[0] is line)
+
+        self.handler.process(self.metric('servers.www1.cpu.total.idle', 6))
+        self.assertEqual(self.handler.render(now=1000), [
+            '# TYPE cpu_total_idle gauge\n'
+            'cpu_total_idle{host="www1"} 6.0\n'])
+
+    def test_stale_series_expire(self):
+        self.handler.process(self.metric('servers.www1.cpu.total.idle', 5,
+                                         ttl=60))
+        self.handler.process(self.metric('servers.www1.cpu.total.user', 5))
+        self.assertEqual(len(self.handler.render(now=1059)), 2)
+        self.assertEqual(len(self.handler.render(now=1061)), 1)
+
+        # The slot of the expired series is reused
+        self.handler.process(self.metric('servers.www1.cpu.total.system', 1,
+                                         ttl=120))
+        self.assertEqual(len(self.handler.names), 2)
+        self.assertEqual(len(self.handler.render(now=1061)), 2)
+
+    def test_names_without_host(self):
+        self.handler.namespace = 'diamond'
+        self.handler.process(Metric('1min.load-avg', 0.5, timestamp=1000))
+        self.assertEqual(self.handler.render(now=1000), [
+            '# TYPE diamond_1min_load_avg gauge\n'
+            'diamond_1min_load_avg 0.5\n'])
+
+    def test_histograms_are_summaries(self):
+        sketch = QuantileSketch()
+        for value in (1, 2, 3, 4):
+            sketch.add(value)
+        self.handler.process(HistogramMetric(
+            'servers.www1.http.latency', sketch, timestamp=1000, host='www1',
+            percentiles=['50', '99.9']))
+
+        chunks = self.handler.render(now=1000)
+        self.assertEqual(len(chunks), 1)
+        lines = chunks[0].splitlines()
+        self.assertEqual(lines[0], '# TYPE http_latency summary')
+        self.assertEqual(sorted(line.split(' ')[0] for line in lines[1:]), [
+            'http_latency_count{host="www1"}',
+            'http_latency_sum{host="www1"}',
+            'http_latency{host="www1",quantile="0.5"}',
+            'http_latency{host="www1",quantile="0.999"}'])
+        self.assertTrue('http_latency_sum{host="www1"} 10.0' in lines)
@@ -2,6 +2,10 @@
 # coding=utf-8
 ##########################################################################
 
+import socket
+import struct
+import threading
+
 from test import unittest
 from test import run_only
 import configobj
@@ -42,3 +46,92 @@ class TestRiemannHandler(unittest.TestCase):
             'metric': 0.0,
             'ttl': None
         })
+
+    @run_only_if_bernhard_is_available
+    def test_tags_are_attributes(self):
+        server = FakeRiemann()
+        server.start()
+
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = server.port
+        config['batch'] = 2
+
+        handler = RiemannHandler(config)
+        metric = Metric('servers.www.network.rx_bytes', 1,
+                        timestamp=1234567, host='www',
+                        tags={'device': 'eth0', 'speed': '1000'})
+        self.assertEqual(handler._metric_to_riemann_event(metric)
+                         ['attributes'], {'device': 'eth0', 'speed': '1000'})
+        handler.process(metric)
+        handler.process(Metric('servers.www.network.rx_bytes', 2,
+                               timestamp=1234567, host='www'))
+        handler.flush()
+        handler._close()
+        server.join(5)
+
+        events = server.messages[0].events
+        self.assertEqual([(a.key, a.value) for a in events[0].attributes],
+                         [('device', 'eth0'), ('speed', '1000')])
+        self.assertEqual(len(events[1].attributes), 0)
+
+    @run_only_if_bernhard_is_available
+    def test_events_are_batched(self):
+        server = FakeRiemann()
+        server.start()
+
+        config = configobj.ConfigObj()
+        config['host'] = '127.0.0.1'
+        config['port'] = server.port
+        config['batch'] = 100
+        config['max_in_flight'] = 2
+
+        handler = RiemannHandler(config)
+        for i in range(250):
+            handler.process(Metric('servers.com.example.www.cpu.total.idle',
+                                   i, timestamp=1234567 + i,
+                                   host='com.example.www', ttl=20))
+        self.assertEqual(handler.in_flight, 0)
+        handler.flush()
+        handler._close()
+        server.join(5)
+
+        self.assertEqual([len(m.events) for m in server.messages],
+                         [100, 100, 50])
+        event = server.messages[2].events[49]
+        self.assertEqual(event.host, 'com.example.www')
+        self.assertEqual(event.service, 'servers.cpu.total.idle')
+        self.assertEqual(event.time, 1234567 + 249)
+        self.assertEqual(event.metric_f, 249.0)
+        self.assertEqual(event.ttl, 20.0)
+
+
+class FakeRiemann(threading.Thread):
+    """
+    Acknowledges every message received on a local tcp port
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.messages = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        import bernhard
+        conn, _ = self.listener.accept()
+        reader = conn.makefile('rb')
+        while True:
+            header = reader.read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('!I', header)[0]
+            self.messages.append(bernhard.pb.Msg.FromString(
+                reader.read(length)))
+            ack = bernhard.pb.Msg(ok=True).SerializeToString()
+            conn.sendall(struct.pack('!I', len(ack)) + ack)
+        conn.close()
+        self.listener.close()
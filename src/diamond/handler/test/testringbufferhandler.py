@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import os
+import shutil
+import tempfile
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.ringbuffer import RingBufferHandler
+from diamond.handler.ringbuffer import RingStore
+from diamond.handler.ringbuffer import aggregate
+from diamond.metric import Metric
+
+
+class TestRingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'ring')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ring_wraps(self):
+        store = RingStore(self.filename, max_series=2, points=3)
+        for i in range(5):
+            store.write('a', 100 + i, i)
+
+        self.assertEqual(store.read('a'), [(102, 2), (103, 3), (104, 4)])
+        self.assertEqual(store.read('a', 103), [(103, 3), (104, 4)])
+        self.assertEqual(store.read('a', 102, 103), [(102, 2), (103, 3)])
+        self.assertEqual(store.read('b'), [])
+        store.close()
+
+    def test_file_size_is_bounded(self):
+        store = RingStore(self.filename, max_series=2, points=3,
+                          name_size=10)
+        store.write('a', 100, 1)
+        store.write('b', 101, 1)
+        store.write('c', 102, 1)
+        store.write('x' * 11, 103, 1)
+
+        self.assertEqual(os.path.getsize(self.filename),
+                         64 + 2 * (10 + 8 + 12 * 3))
+        self.assertEqual(store.names(), ['b', 'c'])
+        self.assertEqual((store.evicted, store.rejected), (1, 1))
+        store.close()
+
+    def test_least_recently_written_is_evicted(self):
+        store = RingStore(self.filename, max_series=3, points=3)
+        for i in range(20):
+            store.write('a', 100 + i, i)
+            store.write('b', 90 + i, i)
+            store.write('c', 110 + i, i)
+        self.assertTrue(len(store.heap) <= 4 * 3)
+
+        store.write('d', 200, 1)
+        store.write('e', 201, 1)
+        self.assertEqual(store.names(), ['c', 'd', 'e'])
+        self.assertEqual(store.evicted, 2)
+        store.close()
+
+    def test_survives_reopen(self):
+        store = RingStore(self.filename, max_series=2, points=3)
+        store.write('servers.www1.cpu.total.idle', 100, 1.5)
+        store.close()
+
+        store = RingStore(self.filename, max_series=2, points=3)
+        store.write('servers.www1.cpu.total.idle', 110, 2.5)
+        store.close()
+
+        store = RingStore(self.filename, readonly=True)
+        self.assertEqual(list(store.query('servers.*.idle')), [
+            ('servers.www1.cpu.total.idle', [(100, 1.5), (110, 2.5)])])
+        store.close()
+
+        # Another geometry starts over
+        store = RingStore(self.filename, max_series=4, points=3)
+        self.assertEqual(store.names(), [])
+        store.close()
+
+    def test_aggregate(self):
+        points = [(100, 1.0), (110, 3.0), (120, 2.0)]
+        self.assertEqual(aggregate(points, 'avg'), 2.0)
+        self.assertEqual(aggregate(points, 'max'), 3.0)
+        self.assertEqual(aggregate(points, 'last'), 2.0)
+        self.assertEqual(aggregate([], 'avg'), None)
+
+
+class TestRingBufferHandler(unittest.TestCase):
+
+    def test_process(self):
+        directory = tempfile.mkdtemp()
+        try:
+            config = configobj.ConfigObj()
+            config['file'] = os.path.join(directory, 'sub', 'ring')
+            handler = RingBufferHandler(config)
+            handler.process(Metric('servers.www1.cpu.total.idle', 5,
+                                   timestamp=100))
+            self.assertEqual(
+                handler.store.read('servers.www1.cpu.total.idle'),
+                [(100, 5.0)])
+            handler._close()
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+from test import unittest
+from mock import patch
+
+import configobj
+
+import diamond.handler.rrdtool as mod
+from diamond.metric import Metric
+
+
+class FakeRRDCached(threading.Thread):
+    """
+    Answers the rrdcached BATCH protocol on a unix socket and records the
+    commands it receives
+    """
+
+    def __init__(self, path, errors=()):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.errors = list(errors)
+        self.commands = []
+        self.connections = 0
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            reader = conn.makefile('rb')
+            for line in iter(reader.readline, ''):
+                line = line.rstrip('\n')
+                self.commands.append(line)
+                if line == 'BATCH':
+                    conn.sendall("0 Go ahead.  End with dot '.' on its own "
+                                 "line.\n")
+                elif line == '.':
+                    conn.sendall('%d errors\n' % len(self.errors))
+                    for error in self.errors:
+                        conn.sendall(error + '\n')
+            conn.close()
+
+    def stop(self):
+        self.listener.close()
+
+
+class TestRRDHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'rrdcached.sock')
+        self.daemon = FakeRRDCached(self.socket_path)
+        self.daemon.start()
+
+        config = configobj.ConfigObj()
+        config['basedir'] = self.tmpdir
+        config['daemon'] = 'unix:%s' % self.socket_path
+        self.handler = mod.RRDHandler(config)
+        self.handler._ensure_exists = lambda *args: True
+
+    def tearDown(self):
+        self.handler._close()
+        self.daemon.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def filename(self, name):
+        return os.path.join(self.tmpdir, 'www', 'cpu', name + '.rrd')
+
+    def test_flush_sends_one_batch(self):
+        self.handler.process(Metric('servers.www.cpu.total.idle', 1,
+                                    timestamp=100, host='www'))
+        self.handler.process(Metric('servers.www.cpu.total.idle', 2,
+                                    timestamp=110, host='www'))
+        self.handler.process(Metric('servers.www.cpu.total.user', 3,
+                                    timestamp=100, host='www'))
+        self.handler.flush()
+        self.handler.flush()
+        self.handler.process(Metric('servers.www.cpu.total.user', 4,
+                                    timestamp=110, host='www'))
+        self.handler.flush()
+
+        self.assertEqual(self.daemon.connections, 1)
+        self.assertEqual(sorted(self.daemon.commands[:4]), sorted([
+            'BATCH',
+            'UPDATE %s 100:1 110:2' % self.filename('total_idle'),
+            'UPDATE %s 100:3' % self.filename('total_user'),
+            '.',
+        ]))
+        self.assertEqual(self.daemon.commands[4:], [
+            'BATCH',
+            'UPDATE %s 110:4' % self.filename('total_user'),
+            '.',
+        ])
+
+    def test_too_frequent_updates_are_dropped(self):
+        self.handler.process(Metric('servers.www.cpu.total.idle', 1,
+                                    timestamp=100, host='www'))
+        self.handler.flush()
+        self.handler.process(Metric('servers.www.cpu.total.idle', 2,
+                                    timestamp=100, host='www'))
+        self.handler.flush()
+
+        self.assertEqual(self.daemon.commands, [
+            'BATCH',
+            'UPDATE %s 100:1' % self.filename('total_idle'),
+            '.',
+        ])
+
+    @patch.object(mod, 'rrdtool', None)
+    @patch.object(mod.subprocess, 'call')
+    def test_fallback_without_daemon(self, call_mock):
+        self.daemon.stop()
+        os.unlink(self.socket_path)
+
+        self.handler.process(Metric('servers.www.cpu.total.idle', 1,
+                                    timestamp=100, host='www'))
+        self.handler.flush()
+
+        call_mock.assert_called_once_with(
+            ['rrdupdate', self.filename('total_idle'), '--', '100:1'])
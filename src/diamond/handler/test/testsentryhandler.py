@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+from mock import Mock
+from mock import patch
+
+from diamond.handler.sentry import Rule
+from diamond.handler.sentry import RuleSet
+from diamond.metric import Metric
+
+
+class TestRuleSet(unittest.TestCase):
+
+    def test_literal_suffix(self):
+        for pattern, suffix in (('loadavg.15', '15'),
+                                ('memory.MemFree', 'MemFree'),
+                                ('cpu.cpu[0-9]+.idle', 'idle'),
+                                (r'cpu\.total\.idle', 'idle'),
+                                (r'diskspace.*\d', ''),
+                                (r'network.eth0.rx_\w-x', ''),
+                                (r'memory.MemFree\x41', ''),
+                                (r'memory.MemFree\101', ''),
+                                ('cpu.*', ''),
+                                ('loadavg.(01|05)', ''),
+                                ('loadavg.01|loadavg.05', ''),
+                                ('(?i)memory.memfree', '')):
+            self.assertEqual(RuleSet.literal_suffix(pattern), suffix,
+                             pattern)
+
+    def test_match_is_the_same_as_trying_every_rule(self):
+        rules = [Rule('load', 'loadavg.15', max=1),
+                 Rule('cpu', r'cpu\.cpu[0-9]+\.idle', min=1),
+                 Rule('disk', r'diskspace\..*_percentage', min=1),
+                 Rule('any', r'.*\.MemFree', min=1),
+                 Rule('free', 'memory.MemFree', min=1)]
+        rule_set = RuleSet(rules)
+
+        for path in ('servers.h.loadavg.15', 'servers.h.loadavg.01',
+                     'servers.h.cpu.cpu3.idle', 'servers.h.cpu.total.idle',
+                     'servers.h.diskspace.root.byte_percentage',
+                     'servers.h.memory.MemFree', 'MemFree'):
+            expected = [r for r in rules if r.match(path)]
+            self.assertEqual([r for r, m in rule_set.match(path)], expected,
+                             path)
+            self.assertEqual([r for r, m in rule_set.match(path)], expected,
+                             path)
+
+    def test_cache_is_bounded(self):
+        rule_set = RuleSet([Rule('load', 'loadavg.15', max=1)], cache_size=2)
+        for path in ('a.loadavg.15', 'b.loadavg.15', 'c.loadavg.15'):
+            rule_set.match(path)
+        self.assertEqual(rule_set.cache.keys(), ['c.loadavg.15'])
+
+
+class TestRule(unittest.TestCase):
+
+    def test_alerts_are_rate_limited_per_path(self):
+        handler = Mock(hostname='host')
+        rule = Rule('load', 'loadavg.15', max=1, alert_interval=300)
+        for path in ('servers.a.loadavg.15', 'servers.a.loadavg.15',
+                     'servers.b.loadavg.15'):
+            rule.process(Metric(path, 5, timestamp=1234567), handler)
+
+        self.assertEqual(handler.raven_logger.error.call_count, 2)
+        self.assertEqual(rule.counter_errors, 3)
+        self.assertEqual(rule.counter_suppressed, 1)
+
+    def test_expired_alerts_are_forgotten(self):
+        handler = Mock(hostname='host')
+        rule = Rule('load', 'loadavg.15', max=1, alert_interval=300)
+        rule.prune_size = 4
+        with patch('time.time') as mock_time:
+            mock_time.return_value = 1000
+            for host in 'abcd':
+                rule.process(Metric('servers.%s.loadavg.15' % host, 5),
+                             handler)
+            mock_time.return_value = 1400
+            rule.process(Metric('servers.e.loadavg.15', 5), handler)
+
+        self.assertEqual(rule.last_alerts.keys(), ['servers.e.loadavg.15'])
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import json
+import time
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.signalfx import SignalfxHandler
+from diamond.metric import Metric
+from localhttp import LocalHTTPServer
+
+
+class TestSignalfxHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalHTTPServer().start()
+
+        self.config = configobj.ConfigObj()
+        self.config['auth_token'] = 'TOKEN'
+        self.config['url'] = self.server.url + '/v2/datapoint'
+
+    def tearDown(self):
+        self.server.stop()
+
+    def metric(self, i, metric_type='GAUGE'):
+        return Metric('servers.www1.cpu.total.idle', i, timestamp=1234567 + i,
+                      host='www1', metric_type=metric_type)
+
+    def test_datapoints_are_grouped_by_type(self):
+        handler = SignalfxHandler(self.config)
+        handler.process(self.metric(0))
+        handler.process(self.metric(1, 'COUNTER'))
+        handler.process(self.metric(2))
+        handler.flush()
+        handler.client.close()
+
+        bodies = [json.loads(r.body) for r in self.server.requests]
+        self.assertEqual(sorted(bodies), sorted([
+            {'gauge': [
+                {'metric': 'total.idle', 'value': 0,
+                 'timestamp': 1234567000,
+                 'dimensions': {'collector': 'cpu', 'prefix': 'servers',
+                                'host': 'www1'}},
+                {'metric': 'total.idle', 'value': 2,
+                 'timestamp': 1234569000,
+                 'dimensions': {'collector': 'cpu', 'prefix': 'servers',
+                                'host': 'www1'}}]},
+            {'counter': [
+                {'metric': 'total.idle', 'value': 1,
+                 'timestamp': 1234568000,
+                 'dimensions': {'collector': 'cpu', 'prefix': 'servers',
+                                'host': 'www1'}}]},
+        ]))
+        request = self.server.requests[0]
+        self.assertEqual(request.headers['content-encoding'], 'gzip')
+        self.assertEqual(request.headers['x-sf-token'], 'TOKEN')
+
+    def test_tags_are_dimensions(self):
+        handler = SignalfxHandler(self.config)
+        for device in ('eth0', 'eth1'):
+            handler.process(Metric('servers.www1.network.rx_bytes', 1,
+                                   timestamp=1234567, host='www1',
+                                   metric_type='GAUGE',
+                                   tags={'device': device}))
+        handler.flush()
+        handler.client.close()
+
+        points = json.loads(self.server.requests[0].body)['gauge']
+        self.assertEqual([p['dimensions'] for p in points], [
+            {'collector': 'network', 'prefix': 'servers', 'host': 'www1',
+             'device': 'eth0'},
+            {'collector': 'network', 'prefix': 'servers', 'host': 'www1',
+             'device': 'eth1'}])
+
+    def test_payloads_are_split_by_size(self):
+        self.config['batch'] = 1000
+        self.config['max_payload_size'] = 2000
+        handler = SignalfxHandler(self.config)
+        for i in range(100):
+            handler.process(self.metric(i))
+        handler.flush()
+        handler.client.close()
+
+        self.assertTrue(len(self.server.requests) > 1)
+        points = []
+        for request in self.server.requests:
+            self.assertTrue(len(request.body) < 2200)
+            points.extend(json.loads(request.body)['gauge'])
+        self.assertEqual([p['value'] for p in points], range(100))
+
+    def test_partial_batches_are_sent_by_the_timer(self):
+        self.config['batch_max_interval'] = '0.1'
+        handler = SignalfxHandler(self.config)
+        handler.process(self.metric(0))
+
+        deadline = time.time() + 5
+        while not self.server.requests and time.time() < deadline:
+            time.sleep(0.05)
+        handler.timer_stop.set()
+        handler.client.close()
+
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_missing_auth_token_disables_handler(self):
+        self.config['auth_token'] = ''
+        handler = SignalfxHandler(self.config)
+        self.assertFalse(handler.enabled)
+
+        handler._process(self.metric(0))
+        handler._flush()
+        self.assertEqual(len(self.server.requests), 0)
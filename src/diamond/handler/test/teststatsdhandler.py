@@ -2,10 +2,9 @@
 # coding=utf-8
 ##########################################################################
 
+import socket
+
 from test import unittest
-from test import run_only
-from mock import patch
-from mock import ANY
 
 import configobj
 
@@ -13,74 +12,56 @@ from diamond.handler.stats_d import StatsdHandler
 from diamond.metric import Metric
 
 
-def run_only_if_statsd_is_available(func):
-    try:
-        import statsd
-    except ImportError:
-        statsd = None
-    pred = lambda: statsd is not None
-    return run_only(func, pred)
+class TestStatsdHandler(unittest.TestCase):
 
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(1)
 
-class TestStatsdHandler(unittest.TestCase):
+        self.config = configobj.ConfigObj()
+        self.config['host'] = '127.0.0.1'
+        self.config['port'] = self.server.getsockname()[1]
+        self.config['batch'] = 1
 
-    @run_only_if_statsd_is_available
-    @patch('statsd.Client')
-    def test_single_gauge(self, mock_client):
-        instance = mock_client.return_value
-        instance._send.return_value = 1
+    def tearDown(self):
+        self.server.close()
 
-        config = configobj.ConfigObj()
-        config['host'] = 'localhost'
-        config['port'] = '9999'
-        config['batch'] = 1
+    def receive(self, count=1):
+        return [self.server.recv(65536) for i in range(count)]
 
+    def test_single_gauge(self):
         metric = Metric('servers.com.example.www.cpu.total.idle',
                         123, raw_value=123, timestamp=1234567,
                         host='will-be-ignored', metric_type='GAUGE')
 
-        expected_data = {
-            'servers.com.example.www.cpu.total.idle': '123|g'
-        }
-
-        handler = StatsdHandler(config)
+        handler = StatsdHandler(self.config)
         handler.process(metric)
-        mock_client._send.assert_called_with(ANY, expected_data)
+        self.assertEqual(self.receive(),
+                         ['servers.com.example.www.cpu.total.idle:123|g'])
 
-    @run_only_if_statsd_is_available
-    @patch('statsd.Client')
-    def test_single_counter(self, mock_client):
-        instance = mock_client.return_value
-        instance._send.return_value = 1
+    def test_negative_gauge(self):
+        metric = Metric('servers.com.example.www.cpu.total.idle',
+                        -1.5, timestamp=1234567, precision=1,
+                        metric_type='GAUGE')
 
-        config = configobj.ConfigObj()
-        config['host'] = 'localhost'
-        config['port'] = '9999'
-        config['batch'] = 1
+        handler = StatsdHandler(self.config)
+        handler.process(metric)
+        self.assertEqual(self.receive(),
+                         ['servers.com.example.www.cpu.total.idle:0|g\n'
+                          'servers.com.example.www.cpu.total.idle:-1.5|g'])
 
+    def test_single_counter(self):
         metric = Metric('servers.com.example.www.cpu.total.idle',
                         5, raw_value=123, timestamp=1234567,
                         host='will-be-ignored', metric_type='COUNTER')
 
-        expected_data = {
-            'servers.com.example.www.cpu.total.idle': '123|c'
-        }
-
-        handler = StatsdHandler(config)
+        handler = StatsdHandler(self.config)
         handler.process(metric)
-        mock_client._send.assert_called_with(ANY, expected_data)
-
-    @run_only_if_statsd_is_available
-    @patch('statsd.Client')
-    def test_multiple_counter(self, mock_client):
-        instance = mock_client.return_value
-        instance._send.return_value = 1
-
-        config = configobj.ConfigObj()
-        config['host'] = 'localhost'
-        config['port'] = '9999'
-        config['batch'] = 1
+        self.assertEqual(self.receive(),
+                         ['servers.com.example.www.cpu.total.idle:123|c'])
 
+    def test_multiple_counter(self):
         metric1 = Metric('servers.com.example.www.cpu.total.idle',
                          5, raw_value=123, timestamp=1234567,
                          host='will-be-ignored', metric_type='COUNTER')
@@ -89,17 +70,42 @@ class TestStatsdHandler(unittest.TestCase):
                          7, raw_value=128, timestamp=1234567,
                          host='will-be-ignored', metric_type='COUNTER')
 
-        expected_data1 = {
-            'servers.com.example.www.cpu.total.idle': '123|c'
-        }
-
-        expected_data2 = {
-            'servers.com.example.www.cpu.total.idle': '5|c'
-        }
-
-        handler = StatsdHandler(config)
+        handler = StatsdHandler(self.config)
         handler.process(metric1)
-        mock_client._send.assert_called_with(ANY, expected_data1)
+        self.assertEqual(self.receive(),
+                         ['servers.com.example.www.cpu.total.idle:123|c'])
 
         handler.process(metric2)
-        mock_client._send.assert_called_with(ANY, expected_data2)
+        self.assertEqual(self.receive(),
+                         ['servers.com.example.www.cpu.total.idle:5|c'])
+
+    def test_packets_are_coalesced_up_to_mtu(self):
+        self.config['batch'] = 2000
+        handler = StatsdHandler(self.config)
+
+        lines = []
+        for i in range(2000):
+            metric = Metric('servers.www.cpu.cpu%d.idle' % i, i,
+                            timestamp=1234567, metric_type='GAUGE')
+            lines.append('servers.www.cpu.cpu%d.idle:%d|g' % (i, i))
+            handler.process(metric)
+
+        minimum = len('\n'.join(lines)) / 1432.0
+        self.assertTrue(minimum <= handler.datagrams < minimum * 1.05)
+        self.assertEqual(handler.dropped, 0)
+
+        received = self.receive(handler.datagrams)
+        self.assertTrue(max(len(d) for d in received) <= 1432)
+        self.assertEqual('\n'.join(received).split('\n'), lines)
+
+    def test_counter_values_are_bounded(self):
+        self.config['max_counters'] = 2
+        handler = StatsdHandler(self.config)
+
+        for name in ('a', 'b', 'c', 'b'):
+            handler.process(Metric('servers.www.net.%s' % name, 0,
+                                   raw_value=1, metric_type='COUNTER'))
+
+        kept = dict(handler.older_values, **handler.old_values)
+        self.assertEqual(sorted(kept),
+                         ['servers.www.net.b', 'servers.www.net.c'])
@@ -142,11 +142,13 @@ class TSDBHandler(Handler):
             try:
                 # Send data to socket
                 self.socket.sendall(data)
+                self._record_success()
                 # Done
                 break
             except socket.error, e:
                 # Log Error
                 self.log.error("TSDBHandler: Failed sending data. %s.", e)
+                self._record_failure()
                 # Attempt to restablish connection
                 self._close()
                 # Decrement retry
@@ -178,6 +180,7 @@ class TSDBHandler(Handler):
             # Log Error
             self.log.error("TSDBHandler: Failed to connect to %s:%i. %s",
                            self.host, self.port, ex)
+            self._record_failure()
             # Close Socket
             self._close()
             return
@@ -2,9 +2,14 @@
 
 """
 Output the collected values to a Zer0MQ pub/sub channel
+
+With `batch = True`, the metrics are sent as newline delimited messages of
+up to `batch_max_bytes` bytes, when full and on flush, instead of one
+message per metric.
 """
 
 from Handler import Handler
+from messagebatch import MessageBatch
 
 try:
     import zmq
@@ -38,6 +43,8 @@ class zmqHandler (Handler):
 
         # Initialize Options
         self.port = int(self.config['port'])
+        self.batch_mode = str(self.config['batch']) == 'True'
+        self.batch = MessageBatch(self.config['batch_max_bytes'])
 
         # Create ZMQ pub socket and bind
         self._bind()
@@ -50,6 +57,8 @@ class zmqHandler (Handler):
 
         config.update({
             'port': '',
+            'batch': 'Send newline delimited messages of several metrics',
+            'batch_max_bytes': 'Maximum size of a batch message',
         })
 
         return config
@@ -62,6 +71,8 @@ class zmqHandler (Handler):
 
         config.update({
             'port': 1234,
+            'batch': False,
+            'batch_max_bytes': 131072,
         })
 
         return config
@@ -88,5 +99,18 @@ class zmqHandler (Handler):
         """
         if not zmq:
             return
+        if self.batch_mode:
+            message = self.batch.add('', str(metric))
+            if message is not None:
+                self.socket.send(message)
+            return
         # Send the data as ......
         self.socket.send("%s" % str(metric))
+
+    def flush(self):
+        """
+          Send the pending batch message
+        """
+        if zmq and self.batch_mode:
+            for key, message in self.batch.drain():
+                self.socket.send(message)
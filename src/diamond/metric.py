@@ -1,17 +1,46 @@
 # coding=utf-8
 
 import time
-import re
+import string
 import logging
+from array import array
 from error import DiamondException
 
+# Characters of the paths of graphite plaintext lines
+_PATH_CHARS = string.ascii_letters + string.digits + '.-_'
+
+# Interned tag sets, shared by the metrics of a series
+_tag_sets = {}
+_MAX_TAG_SETS = 100000
+
+
+def intern_tags(tags):
+    """
+    Returns the shared, sorted tuple of (name, value) pairs for a dict or a
+    sequence of pairs
+    """
+    if not tags:
+        return ()
+    interned = _tag_sets.get(tags) if isinstance(tags, tuple) else None
+    if interned is not None:
+        return interned
+    if hasattr(tags, 'items'):
+        tags = tags.items()
+    tags = tuple(sorted((str(name), str(value)) for name, value in tags))
+    interned = _tag_sets.get(tags)
+    if interned is None:
+        if len(_tag_sets) >= _MAX_TAG_SETS:
+            _tag_sets.clear()
+        interned = _tag_sets[tags] = tags
+    return interned
+
 
 class Metric(object):
 
-    _METRIC_TYPES = ['COUNTER', 'GAUGE']
+    _METRIC_TYPES = ['COUNTER', 'GAUGE', 'HISTOGRAM']
 
     def __init__(self, path, value, raw_value=None, timestamp=None, precision=0,
-                 host=None, metric_type='COUNTER', ttl=None):
+                 host=None, metric_type='COUNTER', ttl=None, tags=None):
         """
         Create new instance of the Metric class
 
@@ -21,10 +50,13 @@ class Metric(object):
             timestamp=[float|int]: the timestamp, in seconds since the epoch
             (as from time.time()) precision=int: the precision to apply.
             Generally the default (2) should work fine.
+            tags=[dict|tuple]: dimensions of the series, such as device or
+            instance. Stored as an interned tuple of (name, value) pairs.
         """
 
         # Validate the path, value and metric_type submitted
-        if (None in [path, value] or metric_type not in self._METRIC_TYPES):
+        if (path is None or value is None or
+                metric_type not in self._METRIC_TYPES):
             raise DiamondException(("Invalid parameter when creating new "
                                     "Metric with path: %r value: %r "
                                     "metric_type: %r")
@@ -63,6 +95,14 @@ class Metric(object):
         self.host = host
         self.metric_type = metric_type
         self.ttl = ttl
+        self.tags = intern_tags(tags)
+
+    def __setstate__(self, state):
+        """
+        Share the tags of unpickled metrics again
+        """
+        self.__dict__.update(state)
+        self.tags = intern_tags(state.get('tags'))
 
     def __repr__(self):
         """
@@ -80,23 +120,46 @@ class Metric(object):
         return fstring % (self.path, self.value, self.timestamp)
 
     @classmethod
-    def parse(cls, string):
+    def parse(cls, line):
         """
-        Parse a string and create a metric
+        Parse a "path value timestamp" line and create a metric, with the
+        precision of the value
         """
-        match = re.match(r'^(?P<name>[A-Za-z0-9\.\-_]+)\s+' +
-                         '(?P<value>[0-9\.]+)\s+' +
-                         '(?P<timestamp>[0-9\.]+)(\n?)$',
-                         string)
         try:
-            groups = match.groupdict()
-            # TODO: get precision from value string
-            return Metric(groups['name'],
-                          groups['value'],
-                          float(groups['timestamp']))
-        except:
+            path, value, timestamp, precision = _split_line(line)
+        except ValueError:
             raise DiamondException(
-                "Metric could not be parsed from string: %s." % string)
+                "Metric could not be parsed from string: %s." % line)
+        return cls(path, value, timestamp=timestamp, precision=precision)
+
+    @classmethod
+    def parse_many(cls, lines):
+        """
+        Parse a buffer of "path value timestamp" lines, or an iterable of
+        lines, into a MetricBatch. Lines that can not be parsed are listed
+        in the errors of the batch instead of raising.
+        """
+        if isinstance(lines, basestring):
+            lines = lines.split('\n')
+        batch = MetricBatch()
+        paths = batch.paths
+        values = batch.values
+        timestamps = batch.timestamps
+        precisions = batch.precisions
+        errors = batch.errors
+        for number, line in enumerate(lines, 1):
+            if not line or line.isspace():
+                continue
+            try:
+                path, value, timestamp, precision = _split_line(line)
+                timestamps.append(timestamp)
+            except (ValueError, OverflowError), e:
+                errors.append((number, line, str(e)))
+                continue
+            paths.append(path)
+            values.append(value)
+            precisions.append(min(precision, 255))
+        return batch
 
     def getPathPrefix(self):
         """
@@ -145,3 +208,100 @@ class Metric(object):
 
         offset = len(prefix) + 1
         return self.path[offset:]
+
+
+def _split_line(line):
+    """
+    Returns the path, value, timestamp and precision of a graphite plaintext
+    line, raises ValueError if it is not one
+    """
+    try:
+        path, value, timestamp = line.split()
+    except ValueError:
+        raise ValueError('expected "path value timestamp"')
+    try:
+        invalid = path.translate(None, _PATH_CHARS)
+    except TypeError:
+        # unicode
+        path = path.encode('ascii')
+        invalid = path.translate(None, _PATH_CHARS)
+    if invalid:
+        raise ValueError('invalid path %r' % path)
+    number = float(value)
+    seconds = float(timestamp)
+    # x - x is 0.0 unless x is NaN or infinite
+    if number - number or seconds - seconds:
+        raise ValueError('invalid value %r or timestamp %r' % (value,
+                                                               timestamp))
+    # Decimals of the mantissa, shifted by the exponent: 1.5e-05 has 6
+    mantissa, e, exponent = value.lower().partition('e')
+    dot = mantissa.find('.')
+    precision = 0
+    if dot >= 0:
+        precision = len(mantissa) - dot - 1
+    if e:
+        precision = max(0, precision - int(exponent))
+    return path, number, int(seconds), precision
+
+
+class MetricBatch(object):
+    """
+    Metrics parsed by Metric.parse_many, stored as columns. errors holds the
+    (line number, line, reason) of the lines that could not be parsed.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.values = array('d')
+        self.timestamps = array('l')
+        self.precisions = array('B')
+        self.errors = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return Metric(self.paths[index], self.values[index],
+                      timestamp=self.timestamps[index],
+                      precision=self.precisions[index])
+
+    def __iter__(self):
+        for index in xrange(len(self.paths)):
+            yield self[index]
+
+
+def percentile_name(percentile):
+    """
+    Returns the path suffix of a percentile, e.g. p99 or p99_9
+    """
+    return 'p%s' % ('%g' % float(percentile)).replace('.', '_')
+
+
+class HistogramMetric(Metric):
+    """
+    A QuantileSketch of the observations of an interval. The value is the
+    observation count. Handlers that do not support histograms get the
+    metrics of expand() instead.
+    """
+
+    def __init__(self, path, sketch, timestamp=None, precision=0, host=None,
+                 ttl=None, tags=None, percentiles=(50, 90, 99)):
+        Metric.__init__(self, path, sketch.count, timestamp=timestamp,
+                        precision=precision, host=host,
+                        metric_type='HISTOGRAM', ttl=ttl, tags=tags)
+        self.sketch = sketch
+        self.percentiles = [float(p) for p in percentiles]
+
+    def expand(self):
+        """
+        Returns the count, sum and percentile gauges of the histogram
+        """
+        values = [('count', self.sketch.count), ('sum', self.sketch.sum)]
+        if self.sketch.count:
+            values.extend((percentile_name(p), self.sketch.quantile(p / 100))
+                          for p in self.percentiles)
+        return [Metric('%s.%s' % (self.path, name), value,
+                       timestamp=self.timestamp, precision=self.precision,
+                       host=self.host, metric_type='GAUGE', ttl=self.ttl,
+                       tags=self.tags)
+                for name, value in values]
@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""
+Dispatch of the metrics of the handler process to the handlers.
+
+Metrics first go through the server wide metric rules, see
+diamond.relabel, which may drop, rename or route them to some handlers.
+
+Handlers with a rollup_interval get the aggregates of each metric over
+windows of that length instead of every point. Handlers with the same
+rollup_interval and rollup_aggregates share one Rollup, the others get
+the raw points. Histograms are rolled up as their count, sum and percentile
+gauges.
+
+With a stats_interval, the counters of each handler, see
+Handler.get_stats, are published every stats_interval seconds as
+<stats_prefix>.<handler name>.<counter> gauges, through the same rules.
+"""
+
+import time
+
+from diamond.metric import Metric
+from diamond.relabel import MetricRelabel
+from diamond.rollup import Rollup
+
+
+class HandlerPipeline(object):
+
+    def __init__(self, handlers, log=None, rules=None, stats_interval=0,
+                 stats_prefix='diamond.handlers'):
+        self.handlers = handlers
+        self.log = log
+        self.stats_interval = float(stats_interval or 0)
+        self.stats_prefix = stats_prefix
+        self.stats_time = time.time() + self.stats_interval
+        self.relabel = None
+        if rules:
+            self.relabel = MetricRelabel(rules, log=log)
+        routed = self.relabel is not None and self.relabel.route_names()
+        # (handler name, handler) pairs getting every point
+        self.raw = []
+        # (Rollup, handler name, handlers) triples
+        self.rollups = []
+
+        if routed and self.log is not None:
+            names = set(h.__class__.__name__ for h in handlers)
+            for name in routed - names:
+                self.log.warning('Metric rules route to %s, which is not '
+                                 'loaded', name)
+
+        groups = {}
+        for handler in handlers:
+            name = handler.__class__.__name__
+            config = getattr(handler, 'config', None) or {}
+            interval = int(config.get('rollup_interval', 0) or 0)
+            if interval <= 0:
+                self.raw.append((name, handler))
+                continue
+
+            aggregates = config.get('rollup_aggregates', 'avg')
+            if isinstance(aggregates, basestring):
+                aggregates = aggregates.split()
+            key = (interval, tuple(aggregates))
+            if routed:
+                # Routes are per handler, so are the rollups
+                key += (id(handler),)
+            if key not in groups:
+                groups[key] = (Rollup(interval, aggregates), name, [])
+                self.rollups.append(groups[key])
+            groups[key][2].append(handler)
+            if self.log is not None:
+                self.log.info('%s: sending %s over %ss windows', name,
+                              ', '.join(aggregates), interval)
+
+    def _dispatch(self, metrics, handlers):
+        for metric in metrics:
+            for handler in handlers:
+                handler._process(metric)
+
+    def process(self, metrics):
+        """
+        Send a list of metrics to the raw handlers and the rollups
+        """
+        for metric in metrics:
+            routes = None
+            if self.relabel is not None:
+                routes = self.relabel.apply(metric)
+                if routes is False:
+                    continue
+
+            for name, handler in self.raw:
+                if routes is None or name in routes:
+                    handler._process(metric)
+            parts = None
+            for rollup, name, handlers in self.rollups:
+                if routes is not None and name not in routes:
+                    continue
+                if parts is None:
+                    parts = [metric]
+                    if metric.metric_type == 'HISTOGRAM':
+                        parts = metric.expand()
+                output = []
+                for part in parts:
+                    rollup.add(part, output)
+                if output:
+                    self._dispatch(output, handlers)
+
+    def stats(self, now=None):
+        """
+        Returns the counters of the handlers as metrics
+        """
+        if now is None:
+            now = time.time()
+        metrics = []
+        for handler in self.handlers:
+            name = handler.__class__.__name__
+            try:
+                stats = handler.get_stats()
+            except Exception:
+                if self.log is not None:
+                    self.log.exception('%s: Failed to get the stats', name)
+                continue
+            for key, value in sorted(stats.iteritems()):
+                metrics.append(Metric(
+                    '%s.%s.%s' % (self.stats_prefix, name, key), value,
+                    timestamp=now, precision=3, metric_type='GAUGE'))
+        return metrics
+
+    def flush(self, now=None):
+        """
+        Send the windows that have ended and flush all handlers, with the
+        handler counters when they are due
+        """
+        if self.stats_interval > 0:
+            if now is None:
+                now = time.time()
+            if now >= self.stats_time:
+                self.stats_time = now + self.stats_interval
+                self.process(self.stats(now))
+
+        for rollup, name, handlers in self.rollups:
+            output = []
+            rollup.expire(output, now)
+            self._dispatch(output, handlers)
+
+        for handler in self.handlers:
+            handler._flush()
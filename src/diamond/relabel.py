@@ -0,0 +1,150 @@
+# coding=utf-8
+
+"""
+Server wide metric filtering, renaming and routing.
+
+Rules are read from the [[metric_rules]] subsection of [server] and applied
+in order to the path of every metric reaching the handler process:
+
+```
+[server]
+[[metric_rules]]
+[[[no_loopback]]]
+action = drop
+match = ^servers\.[^.]+\.network\.lo\.
+
+[[[cpu_all]]]
+action = rename
+match = \.cpu\.total\.
+replace = .cpu.all.
+
+[[[disks_long_term]]]
+action = route
+match = \.diskspace\.
+handlers = GraphiteHandler
+```
+
+ * drop: drop the metrics matching match
+ * keep: drop the metrics not matching match
+ * rename: replace match with replace in the path, as re.sub does
+ * route: only send the metrics matching match to the handlers named in
+   handlers (class names). The first matching route rule wins.
+
+Invalid rules are logged and skipped, the other rules still apply.
+
+The outcome of the rules only depends on the path, so it is computed once
+per path and cached.
+"""
+
+import logging
+import re
+
+ACTIONS = ('drop', 'keep', 'rename', 'route')
+
+
+class RelabelRule(object):
+
+    def __init__(self, name, action, match, replace=None, handlers=None):
+        if action not in ACTIONS:
+            raise ValueError('metric rule %s: unknown action %r'
+                             % (name, action))
+        if action == 'rename' and replace is None:
+            raise ValueError('metric rule %s: rename needs replace' % name)
+        if action == 'route' and not handlers:
+            raise ValueError('metric rule %s: route needs handlers' % name)
+        if isinstance(handlers, basestring):
+            handlers = [handlers]
+
+        try:
+            self.match = re.compile(match)
+        except (re.error, TypeError), e:
+            raise ValueError('metric rule %s: invalid match %r: %s'
+                             % (name, match, e))
+
+        self.name = name
+        self.action = action
+        self.replace = replace
+        self.handlers = handlers
+
+
+class MetricRelabel(object):
+
+    def __init__(self, rules, cache_size=100000, log=None):
+        """
+        rules: RelabelRule list, or a config section of rule sections
+        """
+        if log is None:
+            log = logging.getLogger('diamond')
+        self.log = log
+
+        if hasattr(rules, 'items'):
+            sections = rules
+            rules = []
+            for name, section in sections.items():
+                if not hasattr(section, 'items'):
+                    continue
+                try:
+                    rules.append(RelabelRule(name, section.get('action'),
+                                             section.get('match', ''),
+                                             section.get('replace'),
+                                             section.get('handlers')))
+                except (ValueError, re.error), e:
+                    self.log.error('Skipping metric rule %s: %s', name, e)
+        self.rules = rules
+        self.cache_size = cache_size
+        # path -> (new path or None if dropped, handler names or None)
+        self.cache = {}
+        self.dropped = 0
+
+    def route_names(self):
+        """
+        Returns the handler names used by route rules
+        """
+        names = set()
+        for rule in self.rules:
+            if rule.action == 'route':
+                names.update(rule.handlers)
+        return names
+
+    def decide(self, path):
+        """
+        Returns (new path or None if dropped, handler names or None for all
+        handlers) for a path
+        """
+        decision = self.cache.get(path)
+        if decision is not None:
+            return decision
+
+        new_path = path
+        handlers = None
+        for rule in self.rules:
+            if rule.action == 'rename':
+                new_path = rule.match.sub(rule.replace, new_path)
+            elif rule.action == 'drop':
+                if rule.match.search(new_path):
+                    new_path = None
+                    break
+            elif rule.action == 'keep':
+                if not rule.match.search(new_path):
+                    new_path = None
+                    break
+            elif handlers is None and rule.match.search(new_path):
+                handlers = frozenset(rule.handlers)
+
+        decision = (new_path, handlers)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[path] = decision
+        return decision
+
+    def apply(self, metric):
+        """
+        Rename the metric in place and returns the handler names it goes to,
+        None for all handlers, or False if it is dropped
+        """
+        path, handlers = self.decide(metric.path)
+        if path is None:
+            self.dropped += 1
+            return False
+        metric.path = path
+        return handlers
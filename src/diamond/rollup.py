@@ -0,0 +1,159 @@
+# coding=utf-8
+
+"""
+Streaming rollup of metrics over fixed time windows.
+
+The aggregates of each metric path are kept in parallel arrays indexed by a
+slot number, so a path costs a few machine words instead of a list of
+points. When a point of a later window arrives, or the window has ended at
+flush time, the aggregates of the finished window are emitted as metrics.
+"""
+
+from array import array
+import time
+
+from diamond.metric import Metric
+
+AGGREGATES = ('avg', 'min', 'max', 'sum', 'count', 'last')
+
+
+class Rollup(object):
+
+    def __init__(self, interval, aggregates=('avg',)):
+        """
+        interval: window length in seconds
+        aggregates: aggregates to emit per window. A single aggregate keeps
+            the metric path, several add the aggregate name to the path.
+        """
+        self.interval = int(interval)
+        if self.interval <= 0:
+            raise ValueError('rollup interval must be positive')
+        if isinstance(aggregates, basestring):
+            aggregates = [aggregates]
+        for aggregate in aggregates:
+            if aggregate not in AGGREGATES:
+                raise ValueError('unknown rollup aggregate %r' % aggregate)
+        self.aggregates = list(aggregates)
+        self.suffixed = len(self.aggregates) > 1
+
+        # Slot of each (path, tags) series
+        self.slots = {}
+        # (path, host, metric_type, precision, ttl, tags) of each slot
+        self.series = []
+        # Aggregates of the current window of each slot
+        self.windows = array('l')
+        self.counts = array('l')
+        self.sums = array('d')
+        self.mins = array('d')
+        self.maxs = array('d')
+        self.lasts = array('d')
+        # Slots of paths that stopped reporting
+        self.free = []
+
+        # Statistics
+        self.points = 0
+        self.emitted = 0
+
+    def _emit(self, slot, output):
+        """
+        Append the metrics of the window of a slot to output
+        """
+        path, host, metric_type, precision, ttl, tags = self.series[slot]
+        count = self.counts[slot]
+        values = {
+            'count': count,
+            'sum': self.sums[slot],
+            'min': self.mins[slot],
+            'max': self.maxs[slot],
+            'last': self.lasts[slot],
+            'avg': self.sums[slot] / count,
+        }
+        timestamp = self.windows[slot]
+        for aggregate in self.aggregates:
+            name = path
+            if self.suffixed:
+                name = '%s.%s' % (path, aggregate)
+            digits = precision
+            if aggregate == 'avg':
+                # The average of integer points is usually fractional
+                digits = max(precision, 2)
+            output.append(Metric(name, values[aggregate],
+                                 timestamp=timestamp, precision=digits,
+                                 host=host, metric_type=metric_type,
+                                 ttl=ttl, tags=tags))
+        self.emitted += len(self.aggregates)
+
+    def add(self, metric, output):
+        """
+        Add a point, appending the metrics of a finished window to output
+        """
+        value = float(metric.value)
+        window = metric.timestamp - metric.timestamp % self.interval
+        self.points += 1
+
+        key = (metric.path, metric.tags)
+        slot = self.slots.get(key)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+                self.series[slot] = (metric.path, metric.host,
+                                     metric.metric_type, metric.precision,
+                                     metric.ttl, metric.tags)
+                self.windows[slot] = window
+            else:
+                slot = len(self.series)
+                self.series.append((metric.path, metric.host,
+                                    metric.metric_type, metric.precision,
+                                    metric.ttl, metric.tags))
+                self.windows.append(window)
+                for column in (self.counts, self.sums, self.mins, self.maxs,
+                               self.lasts):
+                    column.append(0)
+            self.slots[key] = slot
+        elif window > self.windows[slot]:
+            if self.counts[slot]:
+                self._emit(slot, output)
+            self.windows[slot] = window
+            self.counts[slot] = 0
+        elif window < self.windows[slot]:
+            # A late point of an emitted window
+            return
+        elif self.counts[slot]:
+            self.counts[slot] += 1
+            self.sums[slot] += value
+            if value < self.mins[slot]:
+                self.mins[slot] = value
+            if value > self.maxs[slot]:
+                self.maxs[slot] = value
+            self.lasts[slot] = value
+            return
+
+        self.counts[slot] = 1
+        self.sums[slot] = value
+        self.mins[slot] = value
+        self.maxs[slot] = value
+        self.lasts[slot] = value
+
+    def expire(self, output, now=None):
+        """
+        Emit the windows that have ended, and free the slots of series that
+        did not report for a whole window
+        """
+        if now is None:
+            now = time.time()
+        current = int(now) - int(now) % self.interval
+        for key, slot in self.slots.items():
+            if self.windows[slot] >= current:
+                continue
+            if self.counts[slot]:
+                self._emit(slot, output)
+                self.counts[slot] = 0
+                # Later points of the emitted window are dropped as late
+                self.windows[slot] += self.interval
+            elif self.windows[slot] < current - self.interval:
+                del self.slots[key]
+                self.series[slot] = None
+                self.free.append(slot)
+
+    def __len__(self):
+        return len(self.slots)
@@ -18,6 +18,8 @@ sys.path.append(
         os.path.join(
             os.path.dirname(__file__), "../")))
 
+from diamond.collector import get_hostname
+
 from diamond.utils.classes import initialize_collector
 from diamond.utils.classes import load_collectors
 from diamond.utils.classes import load_dynamic_class
@@ -111,10 +113,22 @@ class Server(object):
         self.handler_queue = QueueHandler(
             config=self.config, queue=self.metric_queue, log=self.log)
 
+        # Handler counters are published under the path of this host
+        stats_interval = float(
+            self.config['server'].get('handler_stats_interval', 0))
+        stats_prefix = None
+        if stats_interval > 0:
+            defaults = self.config['collectors'].get('default', {})
+            stats_prefix = '.'.join([defaults.get('path_prefix', 'servers'),
+                                     get_hostname(defaults),
+                                     'diamond', 'handlers'])
+
         process = multiprocessing.Process(
             name="Handlers",
             target=handler_process,
-            args=(self.handlers, self.metric_queue, self.log),
+            args=(self.handlers, self.metric_queue, self.log,
+                  self.config['server'].get('metric_rules'),
+                  stats_interval, stats_prefix),
         )
 
         process.daemon = True
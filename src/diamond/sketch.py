@@ -0,0 +1,141 @@
+# coding=utf-8
+
+"""
+Mergeable quantile sketch with a bounded relative error.
+
+Values are counted in logarithmic buckets: bucket i holds the values in
+(gamma^(i-1), gamma^i], with gamma = (1 + accuracy) / (1 - accuracy), so any
+quantile is returned within `accuracy` of the true value, relative to it.
+Sketches with the same accuracy merge by adding their bucket counts, which
+makes them suitable to accumulate observations across flushes and hosts.
+"""
+
+import math
+
+
+class QuantileSketch(object):
+
+    def __init__(self, accuracy=0.01, max_buckets=2048):
+        """
+        accuracy: relative error of the quantiles
+        max_buckets: buckets kept per sign, the lowest ones are collapsed
+            beyond it, losing accuracy only for the smallest values
+        """
+        if not 0 < accuracy < 1:
+            raise ValueError('sketch accuracy must be between 0 and 1')
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+
+        # bucket index -> count, of the positive and negated negative values
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _collapse(self, buckets):
+        """
+        Merge the lowest buckets until max_buckets are left
+        """
+        indexes = sorted(buckets)
+        excess = len(indexes) - self.max_buckets
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            buckets[target] += buckets.pop(index)
+
+    def add(self, value, count=1):
+        """
+        Add an observation, raises ValueError if it is NaN or infinite
+        """
+        value = float(value)
+        # x - x is 0.0 unless x is NaN or infinite
+        if value - value:
+            raise ValueError('invalid observation %r' % value)
+        if value > 0:
+            buckets = self.positive
+            index = self._index(value)
+        elif value < 0:
+            buckets = self.negative
+            index = self._index(-value)
+        else:
+            buckets = None
+            self.zero += count
+
+        if buckets is not None:
+            buckets[index] = buckets.get(index, 0) + count
+            if len(buckets) > self.max_buckets:
+                self._collapse(buckets)
+
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Add the observations of another sketch of the same accuracy
+        """
+        if other.gamma != self.gamma:
+            raise ValueError('can not merge sketches of different accuracy')
+        for mine, theirs in ((self.positive, other.positive),
+                             (self.negative, other.negative)):
+            for index, count in theirs.iteritems():
+                mine[index] = mine.get(index, 0) + count
+            if len(mine) > self.max_buckets:
+                self._collapse(mine)
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def quantile(self, q):
+        """
+        Returns the q quantile, 0 <= q <= 1, None if the sketch is empty
+        """
+        if not self.count:
+            return None
+        # The extremes are known exactly
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+
+        value = self.max
+        seen = 0
+        # Most negative values first
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                value = -self._value(index)
+                break
+        else:
+            seen += self.zero
+            if seen > rank:
+                return 0.0
+            for index in sorted(self.positive):
+                seen += self.positive[index]
+                if seen > rank:
+                    value = self._value(index)
+                    break
+        return min(max(value, self.min), self.max)
+
+    def __len__(self):
+        return self.count
@@ -2,8 +2,11 @@
 # coding=utf-8
 ##########################################################################
 
+import pickle
+
 from test import unittest
 
+from diamond.error import DiamondException
 from diamond.metric import Metric
 
 
@@ -111,3 +114,49 @@ class TestMetric(unittest.TestCase):
                 message = 'Actual %s, expected %s' % (actual_value,
                                                       expected_value)
                 self.assertEqual(actual_value, expected_value, message)
+
+    def test_tags_are_interned(self):
+        a = Metric('servers.www1.diskspace.root.byte_free', 1,
+                   tags={'mount': '/', 'device': '/dev/sda1'})
+        b = Metric('servers.www1.diskspace.root.byte_used', 1,
+                   tags=(('device', '/dev/sda1'), ('mount', '/')))
+
+        self.assertEqual(a.tags, (('device', '/dev/sda1'), ('mount', '/')))
+        self.assertTrue(a.tags is b.tags)
+        self.assertTrue(pickle.loads(pickle.dumps(a)).tags is a.tags)
+        self.assertEqual(Metric('test', 1).tags, ())
+
+    def test_parse_keeps_precision(self):
+        metric = Metric.parse('servers.www1.cpu.total.idle -12.50 1400000000\n')
+
+        self.assertEqual(metric.path, 'servers.www1.cpu.total.idle')
+        self.assertEqual(metric.value, -12.5)
+        self.assertEqual(metric.precision, 2)
+        self.assertEqual(metric.timestamp, 1400000000)
+        self.assertEqual(Metric.parse('test 1.5e-5 0').precision, 6)
+        self.assertEqual(Metric.parse('test 1.5e-05 0').precision, 6)
+        self.assertEqual(Metric.parse('test 2e-3 0').precision, 3)
+        self.assertEqual(Metric.parse('test 1.25E+1 0').precision, 1)
+        self.assertEqual(Metric.parse('test 1.5e3 0').precision, 0)
+
+        for line in ('test 1', 'test 1 2 3', 'te st 1 2', 'test x 2',
+                     'test nan 2', 'test 1 inf', u'tést 1 2'):
+            self.assertRaises(DiamondException, Metric.parse, line)
+
+    def test_parse_many(self):
+        batch = Metric.parse_many('\n'.join([
+            'servers.www1.cpu.total.idle 98.5 1400000000',
+            'servers.www1.cpu.total.user 1 1400000000.7',
+            '',
+            'servers.www1.cpu.total.system x 1400000000',
+            'servers.www1.cpu.total.iowait 0 1e30',
+        ]))
+
+        self.assertEqual(len(batch), 2)
+        self.assertEqual([str(metric) for metric in batch], [
+            'servers.www1.cpu.total.idle 98.5 1400000000\n',
+            'servers.www1.cpu.total.user 1 1400000000\n'])
+        self.assertEqual([(number, line) for number, line, reason
+                          in batch.errors], [
+            (4, 'servers.www1.cpu.total.system x 1400000000'),
+            (5, 'servers.www1.cpu.total.iowait 0 1e30')])
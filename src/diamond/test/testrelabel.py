@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+
+import configobj
+from mock import Mock
+
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+from diamond.pipeline import HandlerPipeline
+from diamond.relabel import MetricRelabel, RelabelRule
+
+
+class GraphiteHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config or configobj.ConfigObj())
+        self.paths = []
+
+    def process(self, metric):
+        self.paths.append(metric.path)
+
+
+class ArchiveHandler(GraphiteHandler):
+    pass
+
+
+class TestMetricRelabel(unittest.TestCase):
+
+    def setUp(self):
+        self.relabel = MetricRelabel([
+            RelabelRule('lo', 'drop', r'\.network\.lo\.'),
+            RelabelRule('cpu', 'rename', r'\.cpu\.total\.', '.cpu.all.'),
+            RelabelRule('servers', 'keep', r'^servers\.'),
+            RelabelRule('cpu_graphite', 'route', r'\.cpu\.all\.',
+                        handlers='GraphiteHandler'),
+            RelabelRule('cpu_archive', 'route', r'\.cpu\.',
+                        handlers='ArchiveHandler'),
+        ])
+
+    def test_decide(self):
+        self.assertEqual(self.relabel.decide('servers.www1.network.lo.rx'),
+                         (None, None))
+        self.assertEqual(self.relabel.decide('stats.www1.memory.free'),
+                         (None, None))
+        self.assertEqual(self.relabel.decide('servers.www1.memory.free'),
+                         ('servers.www1.memory.free', None))
+        self.assertEqual(self.relabel.decide('servers.www1.cpu.total.idle'),
+                         ('servers.www1.cpu.all.idle',
+                          frozenset(['GraphiteHandler'])))
+
+    def test_decisions_are_cached(self):
+        self.relabel.decide('servers.www1.memory.free')
+        self.relabel.rules = []
+        self.assertEqual(self.relabel.decide('servers.www1.memory.free'),
+                         ('servers.www1.memory.free', None))
+
+    def test_rules_from_config(self):
+        config = configobj.ConfigObj()
+        config['lo'] = {'action': 'drop', 'match': r'\.lo\.'}
+        config['disks'] = {'action': 'route', 'match': r'\.diskspace\.',
+                           'handlers': ['GraphiteHandler', 'ArchiveHandler']}
+        relabel = MetricRelabel(config)
+
+        self.assertEqual([r.name for r in relabel.rules], ['lo', 'disks'])
+        self.assertEqual(relabel.route_names(),
+                         set(['GraphiteHandler', 'ArchiveHandler']))
+
+    def test_invalid_rules(self):
+        self.assertRaises(ValueError, RelabelRule, 'x', 'delete', 'a')
+        self.assertRaises(ValueError, RelabelRule, 'x', 'rename', 'a')
+        self.assertRaises(ValueError, RelabelRule, 'x', 'route', 'a')
+        self.assertRaises(ValueError, RelabelRule, 'x', 'drop', '(a')
+
+    def test_invalid_rules_are_skipped(self):
+        config = configobj.ConfigObj()
+        config['unclosed'] = {'action': 'drop', 'match': r'\.lo(\.'}
+        config['lo'] = {'action': 'drop', 'match': r'\.lo\.'}
+        config['delete'] = {'action': 'delete', 'match': r'\.cpu\.'}
+        log = Mock()
+        relabel = MetricRelabel(config, log=log)
+
+        self.assertEqual([r.name for r in relabel.rules], ['lo'])
+        self.assertEqual(log.error.call_count, 2)
+        self.assertEqual([c[0][1] for c in log.error.call_args_list],
+                         ['unclosed', 'delete'])
+
+
+class TestPipelineRouting(unittest.TestCase):
+
+    def test_metrics_are_routed(self):
+        rules = configobj.ConfigObj()
+        rules['lo'] = {'action': 'drop', 'match': r'\.lo\.'}
+        rules['cpu'] = {'action': 'route', 'match': r'\.cpu\.',
+                        'handlers': 'GraphiteHandler'}
+        graphite = GraphiteHandler()
+        archive = ArchiveHandler()
+        pipeline = HandlerPipeline([graphite, archive], rules=rules)
+
+        pipeline.process([Metric(path, 1) for path in (
+            'servers.www1.cpu.total.idle',
+            'servers.www1.network.lo.rx',
+            'servers.www1.memory.free')])
+
+        self.assertEqual(graphite.paths, ['servers.www1.cpu.total.idle',
+                                          'servers.www1.memory.free'])
+        self.assertEqual(archive.paths, ['servers.www1.memory.free'])
+        self.assertEqual(pipeline.relabel.dropped, 1)
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+from test import unittest
+
+import configobj
+
+from diamond.handler.Handler import Handler
+from diamond.metric import Metric
+from diamond.pipeline import HandlerPipeline
+from diamond.rollup import Rollup
+
+
+def metric(value, timestamp, path='servers.www1.cpu.total.idle'):
+    return Metric(path, value, timestamp=timestamp)
+
+
+class RecordingHandler(Handler):
+
+    def __init__(self, config=None):
+        Handler.__init__(self, config)
+        self.metrics = []
+
+    def process(self, metric):
+        self.metrics.append((metric.path, metric.value, metric.timestamp))
+
+
+class TestRollup(unittest.TestCase):
+
+    def test_window_is_emitted_by_later_point(self):
+        rollup = Rollup(60, ['min', 'max', 'sum', 'count', 'last', 'avg'])
+        output = []
+        for value, timestamp in ((4, 60), (1, 70), (7, 119), (2, 120)):
+            rollup.add(metric(value, timestamp), output)
+
+        self.assertEqual([(m.path, m.value, m.timestamp) for m in output], [
+            ('servers.www1.cpu.total.idle.min', 1, 60),
+            ('servers.www1.cpu.total.idle.max', 7, 60),
+            ('servers.www1.cpu.total.idle.sum', 12, 60),
+            ('servers.www1.cpu.total.idle.count', 3, 60),
+            ('servers.www1.cpu.total.idle.last', 7, 60),
+            ('servers.www1.cpu.total.idle.avg', 4, 60),
+        ])
+        self.assertEqual(rollup.points, 4)
+
+    def test_late_points_are_dropped(self):
+        rollup = Rollup(60)
+        output = []
+        rollup.add(metric(1, 130), output)
+        rollup.add(metric(5, 100), output)
+        rollup.expire(output, now=180)
+
+        self.assertEqual([(m.value, m.timestamp) for m in output],
+                         [(1, 120)])
+
+    def test_series_differing_by_tags_are_kept_apart(self):
+        rollup = Rollup(60, 'sum')
+        output = []
+        for value, mode in ((1, 'idle'), (2, 'user'), (3, 'idle')):
+            rollup.add(Metric('servers.www1.go.cpu', value, timestamp=60,
+                              tags={'mode': mode}), output)
+        rollup.expire(output, now=120)
+
+        self.assertEqual(sorted((m.tags, m.value) for m in output),
+                         [((('mode', 'idle'),), 4), ((('mode', 'user'),), 2)])
+
+    def test_expire_emits_ended_windows_and_frees_slots(self):
+        rollup = Rollup(60, 'sum')
+        output = []
+        rollup.add(metric(1, 60), output)
+        rollup.add(metric(2, 60, 'servers.www1.cpu.total.user'), output)
+
+        rollup.expire(output, now=100)
+        self.assertEqual(output, [])
+
+        rollup.expire(output, now=120)
+        self.assertEqual(sorted((m.path, m.value) for m in output), [
+            ('servers.www1.cpu.total.idle', 1),
+            ('servers.www1.cpu.total.user', 2)])
+        self.assertEqual(len(rollup), 2)
+
+        rollup.add(metric(3, 180), output)
+        rollup.expire(output, now=300)
+        self.assertEqual(len(rollup), 1)
+
+        # The freed slot is reused
+        rollup.add(metric(4, 300, 'servers.www1.cpu.total.system'), output)
+        self.assertEqual(len(rollup.series), 2)
+
+    def test_unknown_aggregate(self):
+        self.assertRaises(ValueError, Rollup, 60, 'median')
+
+
+class TestHandlerPipeline(unittest.TestCase):
+
+    def test_rollup_and_raw_handlers(self):
+        config = configobj.ConfigObj()
+        config['rollup_interval'] = 60
+        rolled = RecordingHandler(config)
+        raw = RecordingHandler(configobj.ConfigObj())
+
+        pipeline = HandlerPipeline([rolled, raw])
+        pipeline.process([metric(value, 60 + 10 * value)
+                          for value in range(6)])
+        pipeline.flush(now=100)
+        self.assertEqual(len(raw.metrics), 6)
+        self.assertEqual(rolled.metrics, [])
+
+        pipeline.flush(now=120)
+        self.assertEqual(rolled.metrics,
+                         [('servers.www1.cpu.total.idle', 2.5, 60)])
+
+    def test_handlers_share_a_rollup(self):
+        config = configobj.ConfigObj()
+        config['rollup_interval'] = 60
+        config['rollup_aggregates'] = ['max']
+        pipeline = HandlerPipeline([RecordingHandler(config),
+                                    RecordingHandler(config)])
+        self.assertEqual(len(pipeline.rollups), 1)
+        self.assertEqual(len(pipeline.rollups[0][2]), 2)
+
+    def test_handler_stats_are_published(self):
+        class CountingHandler(RecordingHandler):
+            def get_stats(self):
+                return {'processed': len(self.metrics)}
+
+        handler = CountingHandler(configobj.ConfigObj())
+        pipeline = HandlerPipeline([handler], stats_interval=60,
+                                   stats_prefix='servers.www1.diamond')
+        pipeline.stats_time = 1000
+        pipeline.process([metric(1, 990)])
+        pipeline.flush(now=999)
+        self.assertEqual(len(handler.metrics), 1)
+
+        pipeline.flush(now=1000)
+        self.assertEqual(handler.metrics[1:], [
+            ('servers.www1.diamond.CountingHandler.processed', 1, 1000)])
+        pipeline.flush(now=1059)
+        self.assertEqual(len(handler.metrics), 2)
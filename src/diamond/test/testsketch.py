@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# coding=utf-8
+##########################################################################
+
+import random
+
+from test import unittest
+
+import configobj
+
+from diamond.collector import Collector
+from diamond.metric import HistogramMetric
+from diamond.sketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_quantiles_are_within_accuracy(self):
+        rng = random.Random(42)
+        values = [rng.expovariate(0.01) for i in xrange(10000)]
+        sketch = QuantileSketch(0.01)
+        for value in values:
+            sketch.add(value)
+
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertAlmostEqual(sketch.quantile(q) / expected, 1,
+                                   delta=0.01)
+        self.assertEqual(sketch.quantile(0), values[0])
+        self.assertEqual(sketch.quantile(1), values[-1])
+        self.assertEqual(len(sketch), 10000)
+
+    def test_negative_and_zero_values(self):
+        sketch = QuantileSketch()
+        for value in (-10, -1, 0, 0, 1, 10):
+            sketch.add(value)
+
+        self.assertAlmostEqual(sketch.quantile(0), -10)
+        self.assertEqual(sketch.quantile(0.5), 0)
+        self.assertAlmostEqual(sketch.quantile(1), 10)
+
+    def test_non_finite_values_are_rejected(self):
+        sketch = QuantileSketch()
+        sketch.add(1)
+        for value in ('nan', 'inf', '-inf'):
+            self.assertRaises(ValueError, sketch.add, float(value))
+
+        self.assertEqual((sketch.count, sketch.sum), (1, 1))
+        self.assertEqual(sketch.quantile(1), 1)
+
+    def test_merge(self):
+        first = QuantileSketch()
+        second = QuantileSketch()
+        whole = QuantileSketch()
+        for value in xrange(1, 1001):
+            (first if value % 2 else second).add(value)
+            whole.add(value)
+
+        first.merge(second)
+        self.assertEqual(first.count, 1000)
+        self.assertEqual(first.sum, whole.sum)
+        self.assertEqual(first.quantile(0.9), whole.quantile(0.9))
+        self.assertRaises(ValueError, first.merge, QuantileSketch(0.05))
+
+    def test_buckets_are_bounded(self):
+        sketch = QuantileSketch(0.01, max_buckets=100)
+        for value in xrange(1, 100001):
+            sketch.add(value)
+
+        self.assertEqual(len(sketch.positive), 100)
+        self.assertAlmostEqual(sketch.quantile(0.99) / 99000, 1, delta=0.01)
+
+    def test_expand(self):
+        sketch = QuantileSketch()
+        for value in xrange(1, 101):
+            sketch.add(value)
+        metric = HistogramMetric('servers.www1.http.latency', sketch,
+                                 timestamp=1000, precision=2,
+                                 percentiles=['50', '99.9'])
+
+        parts = dict((m.path, m.value) for m in metric.expand())
+        self.assertEqual(parts['servers.www1.http.latency.count'], 100)
+        self.assertEqual(parts['servers.www1.http.latency.sum'], 5050)
+        self.assertAlmostEqual(parts['servers.www1.http.latency.p50'], 50,
+                               delta=0.5)
+        self.assertAlmostEqual(parts['servers.www1.http.latency.p99_9'], 99,
+                               delta=1)
+
+
+class TestCollectorObservations(unittest.TestCase):
+
+    def test_observations_are_published_as_histograms(self):
+        config = configobj.ConfigObj()
+        config['server'] = {}
+        config['server']['collectors_config_path'] = ''
+        config['collectors'] = {}
+        config['collectors']['default'] = {'hostname': 'www1'}
+        collector = Collector(config, [])
+        published = []
+        collector.publish_metric = published.append
+
+        for value in (1, 2, float('nan'), 3, float('inf')):
+            collector.observe('latency', value)
+        collector.observe('latency', 10, tags={'url': '/'})
+        collector.publish_observations()
+
+        self.assertEqual(collector.sketches, {})
+        metrics = sorted((m.tags, m) for m in published)
+        self.assertEqual([(m.path, m.metric_type, m.value, tags)
+                          for tags, m in metrics], [
+            ('servers.www1.Collector.latency', 'HISTOGRAM', 3, ()),
+            ('servers.www1.Collector.latency', 'HISTOGRAM', 1,
+             (('url', '/'),)),
+        ])
+        self.assertEqual(metrics[0][1].percentiles, [50, 90, 99])
@@ -4,6 +4,13 @@ import os
 import sys
 import inspect
 
+TIME_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+}
+
 
 def get_diamond_version():
     try:
@@ -36,6 +43,22 @@ def load_modules_from_path(path):
             __import__(modname, globals(), locals(), ['*'])
 
 
+def parse_time(value, now):
+    """
+    Parse an epoch timestamp, 'now' or a time relative to now like -90m
+    """
+    if value is None:
+        return None
+    if value == 'now':
+        return int(now)
+    if value.startswith('-'):
+        unit = TIME_UNITS.get(value[-1])
+        if unit is None:
+            return int(now - float(value[1:]))
+        return int(now - float(value[1:-1]) * unit)
+    return int(float(value))
+
+
 def load_class_from_name(fqcn):
     # Break apart fqcn to get module and classname
     paths = fqcn.split('.')
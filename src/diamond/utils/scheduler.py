@@ -13,6 +13,7 @@ try:
 except ImportError:
     setproctitle = None
 
+from diamond.pipeline import HandlerPipeline
 from diamond.utils.signals import signal_to_exception
 from diamond.utils.signals import SIGALRMException
 from diamond.utils.signals import SIGHUPException
@@ -100,18 +101,18 @@ def collector_process(collector, metric_queue, log):
             break
 
 
-def handler_process(handlers, metric_queue, log):
+def handler_process(handlers, metric_queue, log, rules=None,
+                    stats_interval=0, stats_prefix='diamond.handlers'):
     proc = multiprocessing.current_process()
     if setproctitle:
         setproctitle('%s - %s' % (getproctitle(), proc.name))
 
     log.debug('Starting process %s', proc.name)
 
+    pipeline = HandlerPipeline(handlers, log, rules, stats_interval,
+                               stats_prefix)
+
     while(True):
         metrics = metric_queue.get(block=True, timeout=None)
-        for metric in metrics:
-            for handler in handlers:
-                handler._process(metric)
-
-        for handler in handlers:
-            handler._flush()
+        pipeline.process(metrics)
+        pipeline.flush()